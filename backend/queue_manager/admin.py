@@ -3,7 +3,16 @@ from django.contrib.auth.admin import UserAdmin
 from django.utils.html import format_html
 from django.urls import reverse
 from django import forms
-from .models import User, ServiceCategory, Service, Queue, Window
+from django.db.models import Count
+from .models import User, ServiceCategory, Service, Queue, QueueArchive, Window, ServiceTimeEstimate
+
+class ServiceListFilter(admin.RelatedFieldListFilter):
+    """Service choices with the provider joined in, since a service's name shows its provider"""
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin) or ('name',)
+        services = Service.objects.select_related('provider').order_by(*ordering)
+        return [(service.pk, str(service)) for service in services]
 
 # First define all your ModelAdmin classes
 class CustomUserAdmin(UserAdmin):
@@ -33,9 +42,13 @@ class ServiceCategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'service_count', 'icon')
     search_fields = ('name', 'description')
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(service_total=Count('services'))
+    
     def service_count(self, obj):
-        return obj.services.count()
+        return obj.service_total
     service_count.short_description = 'Services'
+    service_count.admin_order_field = 'service_total'
 
 class ServiceAdmin(admin.ModelAdmin):
     list_display = ('name', 'category', 'provider', 'status', 'average_service_time', 'queue_count')
@@ -43,23 +56,43 @@ class ServiceAdmin(admin.ModelAdmin):
     search_fields = ('name', 'description', 'provider__username')
     raw_id_fields = ('provider',)
     list_editable = ('status',)
+    list_select_related = ('category', 'provider')
     readonly_fields = ('created_at', 'updated_at')
     
+    def get_queryset(self, request):
+        # One count per page instead of one query per row
+        return super().get_queryset(request).annotate(queue_total=Count('queues'))
+    
     def queue_count(self, obj):
-        count = obj.queues.count()
         url = reverse('admin:queue_manager_queue_changelist') + f'?service__id__exact={obj.id}'
-        return format_html('<a href="{}">{} Queues</a>', url, count)
+        return format_html('<a href="{}">{} Queues</a>', url, obj.queue_total)
     queue_count.short_description = 'Active Queues'
+    queue_count.admin_order_field = 'queue_total'
 
 class QueueAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'service', 'status', 'position', 'priority', 'join_time')
-    list_filter = ('status', 'service', 'service__provider')
+    list_display = ('id', 'ticket_number', 'user', 'service', 'status', 'priority', 'join_time')
+    list_filter = ('status', ('service', ServiceListFilter), 'service__provider')
     search_fields = ('user__username', 'service__name', 'notes')
     raw_id_fields = ('user', 'service')
     readonly_fields = ('join_time', 'start_time', 'end_time')
     list_editable = ('status', 'priority')
+    list_select_related = ('user', 'service__provider')
+    date_hierarchy = 'join_time'
+
+class QueueArchiveAdmin(admin.ModelAdmin):
+    list_display = ('id', 'ticket_number', 'user', 'service', 'status', 'priority', 'join_time', 'archived_at')
+    list_filter = ('status', ('service', ServiceListFilter))
+    search_fields = ('user__username', 'service__name', 'notes')
+    raw_id_fields = ('user', 'service')
+    list_select_related = ('user', 'service__provider')
     date_hierarchy = 'join_time'
 
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 class WindowAdmin(admin.ModelAdmin):
     list_display = ('name', 'status', 'service_provider', 'current_queue_link', 'services_list', 'location')
     list_filter = ('status', 'service_provider')
@@ -67,21 +100,34 @@ class WindowAdmin(admin.ModelAdmin):
     filter_horizontal = ('services',)
     readonly_fields = ('last_active',)
     list_editable = ('status',)
+    list_select_related = ('service_provider',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('services')
     
     def current_queue_link(self, obj):
-        if obj.current_queue:
-            url = reverse('admin:queue_manager_queue_change', args=[obj.current_queue.id])
-            return format_html('<a href="{}">Queue #{}</a>', url, obj.current_queue.id)
+        if obj.current_queue_id:
+            url = reverse('admin:queue_manager_queue_change', args=[obj.current_queue_id])
+            return format_html('<a href="{}">Queue #{}</a>', url, obj.current_queue_id)
         return "-"
     current_queue_link.short_description = 'Current Queue'
     
     def services_list(self, obj):
-        return ", ".join([s.name for s in obj.services.all()[:3]])
+        # Slice the prefetched list, not the queryset, which would query again
+        return ", ".join([s.name for s in obj.services.all()][:3])
     services_list.short_description = 'Services'
 
+class ServiceTimeEstimateAdmin(admin.ModelAdmin):
+    list_display = ('service', 'window', 'average_seconds', 'samples', 'updated_at')
+    list_filter = (('service', ServiceListFilter),)
+    list_select_related = ('service__provider', 'window__service_provider')
+    readonly_fields = ('updated_at',)
+
 # Now register all models with the admin site
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(ServiceCategory, ServiceCategoryAdmin)
 admin.site.register(Service, ServiceAdmin)
 admin.site.register(Queue, QueueAdmin)
-admin.site.register(Window, WindowAdmin)
\ No newline at end of file
+admin.site.register(QueueArchive, QueueArchiveAdmin)
+admin.site.register(Window, WindowAdmin)
+admin.site.register(ServiceTimeEstimate, ServiceTimeEstimateAdmin)
\ No newline at end of file
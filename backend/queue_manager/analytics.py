@@ -0,0 +1,51 @@
+from django.db.models import Avg, Count, Max, Min, Q
+
+DURATION_COLUMNS = ('wait_seconds', 'service_seconds')
+
+
+def duration_summary(queryset, column, percentiles=(50, 90, 95), bins=None):
+    """
+    Average, percentiles and histogram of a stored duration column.
+
+    Everything is a plain aggregate over ``column``: one query for the count,
+    mean and range, one indexed ``ORDER BY column LIMIT 1 OFFSET k`` per
+    percentile (nearest rank) and one conditional count for the histogram.
+    ``bins`` are upper bounds in seconds; a last open bin catches the rest.
+    """
+    if column not in DURATION_COLUMNS:
+        raise ValueError(f'Unknown duration column: {column}')
+
+    measured = queryset.filter(**{f'{column}__isnull': False}).order_by()
+    summary = measured.aggregate(
+        count=Count('id'),
+        average=Avg(column),
+        minimum=Min(column),
+        maximum=Max(column),
+    )
+
+    count = summary['count']
+    ordered = measured.order_by(column).values_list(column, flat=True)
+    summary['percentiles'] = {
+        str(p): ordered[min(count - 1, max(0, -(-p * count // 100) - 1))] if count else None
+        for p in percentiles
+    }
+
+    if bins:
+        bounds = sorted(bins)
+        counters = {}
+        lower = None
+        for index, upper in enumerate([*bounds, None]):
+            condition = Q()
+            if lower is not None:
+                condition &= Q(**{f'{column}__gte': lower})
+            if upper is not None:
+                condition &= Q(**{f'{column}__lt': upper})
+            counters[f'bin_{index}'] = Count('id', filter=condition)
+            lower = upper
+        counts = measured.aggregate(**counters)
+        summary['histogram'] = [
+            {'upper_seconds': upper, 'count': counts[f'bin_{index}']}
+            for index, upper in enumerate([*bounds, None])
+        ]
+
+    return summary
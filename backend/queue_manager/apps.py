@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class QueueManagerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'queue_manager'
+
+    def ready(self):
+        from . import (  # noqa: F401  (connects signal receivers)
+            authentication, broadcast, catalog, estimators, eta, metrics, rollups, routers, versions
+        )
@@ -0,0 +1,109 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from . import versions
+from .models import Queue, QueueArchive, Window
+from .routers import pin_to_primary
+
+FINISHED_STATUSES = ('completed', 'cancelled')
+
+# Columns copied from a Queue row to its archived copy
+ARCHIVED_FIELDS = (
+    'id', 'user_id', 'service_id', 'join_time', 'start_time', 'end_time', 'status',
+    'ticket_number', 'priority', 'notes', 'wait_seconds', 'service_seconds',
+)
+
+HORIZON_KEY = 'queue-archive:horizon'
+
+
+def archive_after():
+    return timedelta(days=getattr(settings, 'QUEUE_ARCHIVE_AFTER_DAYS', 90))
+
+
+def horizon_key():
+    return f'{HORIZON_KEY}:{versions.read([versions.ARCHIVE_KEY])[versions.ARCHIVE_KEY]}'
+
+
+def horizon_timeout():
+    return getattr(settings, 'QUEUE_ARCHIVE_HORIZON_SECONDS', 300)
+
+
+def archive_horizon():
+    """
+    ``join_time`` of the newest archived queue, or ``None`` while the archive
+    is empty. History reads skip the archive table entirely unless a page
+    reaches back this far. The entry is keyed on the archive version, so a
+    run of archive_queues reaches every process as soon as it commits.
+    """
+    key = horizon_key()
+    entry = cache.get(key)
+    if entry is None:
+        entry = {'join_time': QueueArchive.objects.aggregate(newest=Max('join_time'))['newest']}
+        cache.set(key, entry, horizon_timeout())
+    return entry['join_time']
+
+
+def extend_horizon(join_time):
+    """Let history reads know that queues joined up to ``join_time`` may now be archived"""
+    current = archive_horizon()
+    if current is None or join_time > current:
+        cache.set(horizon_key(), {'join_time': join_time}, horizon_timeout())
+
+
+def archivable(cutoff=None):
+    """Finished queues joined before ``cutoff`` that no window still points at"""
+    cutoff = cutoff or timezone.now() - archive_after()
+    return Queue.objects.filter(
+        status__in=FINISHED_STATUSES,
+        join_time__lt=cutoff
+    ).filter(
+        ~Exists(Window.objects.filter(current_queue=OuterRef('pk')))
+    )
+
+
+def remove_archived(rows):
+    """
+    Delete the live copies of archived ``rows`` with a plain ``DELETE``.
+
+    Queue's ``post_delete`` receivers are skipped on purpose: the queues are
+    still history, so the rollups must keep counting them. The rest of what
+    those receivers do is done here instead, once per chunk: the owners',
+    services' and archive version counters move, and the owners read from
+    the primary until the replica has the move.
+    """
+    connection = connections[router.db_for_write(Queue)]
+    ids = [row['id'] for row in rows]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE {} IN ({})'.format(
+                connection.ops.quote_name(Queue._meta.db_table),
+                connection.ops.quote_name(Queue._meta.pk.column),
+                ', '.join(['%s'] * len(ids))
+            ),
+            ids
+        )
+
+    user_ids = {row['user_id'] for row in rows}
+    keys = [versions.user_key(user_id) for user_id in user_ids]
+    keys += [versions.service_key(service_id) for service_id in {row['service_id'] for row in rows}]
+    keys.append(versions.ARCHIVE_KEY)
+
+    def notify():
+        versions.bump(*keys)
+        for user_id in user_ids:
+            pin_to_primary(user_id)
+    transaction.on_commit(notify, using=connection.alias)
+
+
+def history(user, statuses=FINISHED_STATUSES):
+    """
+    A user's archived queues in ``statuses``, shaped like
+    ``Queue.objects.with_position()`` for the history readers. Pass the
+    same statuses the live half of the history is filtered on.
+    """
+    return QueueArchive.objects.filter(user=user, status__in=statuses).with_position()
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+# Everything views read from request.user; the password hash and other
+# columns stay deferred and are only loaded if something touches them
+USER_CACHE_FIELDS = (
+    'id', 'username', 'email', 'phone_number', 'user_type', 'is_service_provider',
+    'is_verified', 'date_joined', 'is_active', 'is_staff', 'is_superuser',
+)
+
+
+def user_cache_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def user_cache_timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_SECONDS', 300)
+
+
+def cache_is_shared():
+    """
+    Whether the default cache reaches every worker process. Invalidation
+    only deletes the entry in the cache it runs against, so with a
+    process-local cache another worker would keep a deactivated user for
+    up to ``AUTH_USER_CACHE_SECONDS``. ``AUTH_USER_CACHE_SHARED`` overrides
+    the guess made from the backend, e.g. for a single-process deployment.
+    """
+    shared = getattr(settings, 'AUTH_USER_CACHE_SHARED', None)
+    if shared is not None:
+        return shared
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def build_user(values):
+    """A ``User`` as if loaded from the database with only ``values`` selected"""
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db(DEFAULT_DB_ALIAS, names, [values[name] for name in names])
+
+
+def cache_user(user):
+    if not cache_is_shared():
+        return
+    values = {name: getattr(user, name) for name in USER_CACHE_FIELDS}
+    cache.set(user_cache_key(user.pk), values, user_cache_timeout())
+
+
+def get_cached_user(user_id):
+    """
+    The user with ``user_id`` from the cache, loading and caching the row
+    on a miss. Returns ``None`` if there is no such user. Without a shared
+    cache (see ``cache_is_shared()``) the row is read on every call.
+    """
+    shared = cache_is_shared()
+    values = cache.get(user_cache_key(user_id)) if shared else None
+    if values is None:
+        values = User.objects.filter(pk=user_id).values(*USER_CACHE_FIELDS).first()
+        if values is None:
+            return None
+        if shared:
+            cache.set(user_cache_key(user_id), values, user_cache_timeout())
+    return build_user(values)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` that resolves the token's user from the cache
+    instead of querying the user table on every request.
+
+    The cached entry is dropped whenever the user is saved or deleted, so a
+    deactivation takes effect on the next request. That needs a cache every
+    worker shares; with a process-local one the user is read from the
+    database instead. Token claims alone are not trusted for this because
+    they cannot reflect a later deactivation.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or api_settings.USER_ID_FIELD not in ('id', 'pk'):
+            # Needs the password hash or a lookup the cache is not keyed by
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    key = user_cache_key(instance.pk)
+    cache.delete(key)
+    # Again after commit, in case a request re-cached the old row meanwhile
+    transaction.on_commit(lambda: cache.delete(key))
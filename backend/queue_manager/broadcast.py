@@ -0,0 +1,208 @@
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .dispatch import dispatch_key
+from .models import Queue
+from .signals import queue_status_changed, window_status_changed
+
+logger = logging.getLogger(__name__)
+
+
+def service_group(service_id):
+    return f'service_{service_id}'
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+def send(group, message):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(group, message)
+    except Exception:
+        # A failed push must never fail the request that changed the queue
+        logger.exception('Could not publish %s to %s', message['type'], group)
+
+
+def publish(group, message):
+    """Send ``message`` to a channel layer group once the current transaction commits"""
+    transaction.on_commit(lambda: send(group, message))
+
+
+class AdvanceCoalescer:
+    """
+    Batches changes to each service's waiting line into one ``queue.advance``
+    event per ``QUEUE_BROADCAST_DEBOUNCE_SECONDS``.
+
+    The event lists the dispatch keys ``[priority_rank, ticket_number]`` of
+    tickets that left and joined the line. A client holding key ``K`` moves
+    up by the number of ``left`` keys below ``K`` and down by the number of
+    ``joined`` keys below ``K``, so nobody needs to be sent their position
+    and a busy service costs one small message per batch.
+
+    Batches are sent by one long-lived worker thread per process, started
+    on first use (and again in a forked child), and whatever is still
+    pending when the interpreter exits is flushed then.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._due = {}
+        self._worker = None
+        atexit.register(self.flush_all)
+
+    @property
+    def delay(self):
+        return getattr(settings, 'QUEUE_BROADCAST_DEBOUNCE_SECONDS', 0.25)
+
+    def add(self, service_id, left=None, joined=None):
+        with self._condition:
+            batch = self._pending.get(service_id)
+            if batch is None:
+                batch = self._pending[service_id] = {'left': set(), 'joined': set()}
+                if self.delay > 0:
+                    self._due[service_id] = time.monotonic() + self.delay
+                    self._ensure_worker()
+                    self._condition.notify()
+            if left is not None:
+                batch['left'].add(left)
+            if joined is not None:
+                batch['joined'].add(joined)
+
+        if self.delay <= 0:
+            self.flush(service_id)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='queue-advance-flush', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._due:
+                    self._condition.wait()
+                service_id, deadline = min(self._due.items(), key=lambda item: item[1])
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    # Woken by a new batch; look for the earliest deadline again
+                    self._condition.wait(remaining)
+                    continue
+            self.flush(service_id)
+
+    def flush_all(self):
+        with self._condition:
+            service_ids = list(self._pending)
+        for service_id in service_ids:
+            self.flush(service_id)
+
+    def flush(self, service_id):
+        with self._condition:
+            batch = self._pending.pop(service_id, None)
+            self._due.pop(service_id, None)
+        if batch is None:
+            return
+
+        # A ticket that joined and left within one batch never moved anyone
+        passed_through = batch['left'] & batch['joined']
+        left = sorted(batch['left'] - passed_through)
+        joined = sorted(batch['joined'] - passed_through)
+        if not left and not joined:
+            return
+
+        send(service_group(service_id), {
+            'type': 'queue.advance',
+            'service': service_id,
+            'left': [list(key) for key in left],
+            'joined': [list(key) for key in joined],
+        })
+
+
+coalescer = AdvanceCoalescer()
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def queue_payload(queue):
+    return {
+        'id': queue.id,
+        'service': queue.service_id,
+        'ticket_number': queue.ticket_number,
+        'status': queue.status,
+        'priority': queue.priority,
+        'position': queue.get_position(),
+        'join_time': _isoformat(queue.join_time),
+        'start_time': _isoformat(queue.start_time),
+        'end_time': _isoformat(queue.end_time),
+    }
+
+
+@receiver(queue_status_changed)
+def publish_queue_change(sender, queue, previous_status, **kwargs):
+    publish(user_group(queue.user_id), {
+        'type': 'queue.update',
+        'queue': queue_payload(queue),
+    })
+
+    key = dispatch_key(queue.priority, queue.ticket_number)
+    if previous_status == 'waiting' and queue.status != 'waiting':
+        transaction.on_commit(lambda: coalescer.add(queue.service_id, left=key))
+    elif queue.status == 'waiting' and previous_status != 'waiting':
+        transaction.on_commit(lambda: coalescer.add(queue.service_id, joined=key))
+
+
+@receiver(post_save, sender=Queue)
+def publish_priority_change(sender, instance, created, **kwargs):
+    # A waiting ticket whose priority changes moves to another place in line:
+    # its old key leaves and its new one joins. Queue.save() updates the
+    # _previous_* attributes only after post_save has run
+    previous_priority = getattr(instance, '_previous_priority', instance.priority)
+    if created or previous_priority is None or previous_priority == instance.priority:
+        return
+    if instance.status != 'waiting' or getattr(instance, '_previous_status', None) != 'waiting':
+        return
+
+    service_id = instance.service_id
+    left = dispatch_key(previous_priority, instance.ticket_number)
+    joined = dispatch_key(instance.priority, instance.ticket_number)
+
+    def advance():
+        coalescer.add(service_id, left=left)
+        coalescer.add(service_id, joined=joined)
+    transaction.on_commit(advance)
+
+
+@receiver(window_status_changed)
+def publish_window_change(sender, window, previous_status, previous_queue_id, **kwargs):
+    queue = window.current_queue
+    if queue is None or queue.id == previous_queue_id:
+        return
+
+    message = {
+        'type': 'window.update',
+        'window': {
+            'id': window.id,
+            'name': window.name,
+            'location': window.location,
+            'status': window.status,
+        },
+        'queue_id': queue.id,
+        'ticket_number': queue.ticket_number,
+    }
+    publish(user_group(queue.user_id), message)
+    publish(service_group(queue.service_id), message)
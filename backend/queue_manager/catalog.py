@@ -0,0 +1,68 @@
+import time
+import zlib
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Service, ServiceCategory, ServiceTimeEstimate, Window
+from .versions import query_variant
+
+VERSION_KEY = 'catalog:version'
+
+
+def cache_timeout():
+    return getattr(settings, 'CATALOG_CACHE_SECONDS', 300)
+
+
+def catalog_version():
+    """
+    Current catalog version: the time of the last change in milliseconds,
+    which doubles as the ``Last-Modified`` date of every catalog response
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Nothing recorded (first read or evicted): start a fresh version
+        version = int(time.time() * 1000)
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    """Move to a new version so every cached catalog response is skipped"""
+    previous = cache.get(VERSION_KEY) or 0
+    cache.set(VERSION_KEY, max(int(time.time() * 1000), previous + 1), None)
+
+
+def catalog_etag(request, *args, **kwargs):
+    # One tag per path and query string, as each renders a different body
+    path = format(zlib.crc32(request.path.encode()), '08x')
+    variant = query_variant(request)
+    return f'catalog-{catalog_version()}-{path}' + (f'-v{variant}' if variant else '')
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return datetime.fromtimestamp(catalog_version() / 1000, tz=timezone.utc)
+
+
+def response_key(version, view_name, path):
+    return f'catalog:{version}:{view_name}:{path}'
+
+
+# Learned estimates are part of every service entry, so their (throttled)
+# writes also start a new version
+@receiver([post_save, post_delete], sender=Service)
+@receiver([post_save, post_delete], sender=ServiceCategory)
+@receiver([post_save, post_delete], sender=ServiceTimeEstimate)
+def invalidate_catalog(sender=None, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(m2m_changed, sender=Window.services.through)
+def invalidate_catalog_on_window_services(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_catalog()
@@ -1,17 +1,68 @@
 import json
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from .broadcast import service_group, user_group
+
 class QueueConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        await self.accept()
+        self.subscriptions = set()
+        if self.scope.get("auth_rejected"):
+            # Closing before accept() rejects the handshake
+            await self.close()
+            return
+        await self.accept(subprotocol=self.scope.get("auth_subprotocol"))
+
+        # Users follow their own tickets; services can be followed from the
+        # query string (?service=1&service=2) or with subscribe messages
+        user = self.scope.get("user")
+        if user is not None and user.is_authenticated:
+            await self.subscribe(user_group(user.id))
+
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        for service_id in query.get("service", []):
+            if service_id.isdigit():
+                await self.subscribe(service_group(int(service_id)))
+
         await self.send(text_data=json.dumps({
             "type": "connection_established",
             "message": "You are now connected!"
         }))
 
+    async def subscribe(self, group):
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.subscriptions.add(group)
+
+    async def unsubscribe(self, group):
+        await self.channel_layer.group_discard(group, self.channel_name)
+        self.subscriptions.discard(group)
+
     async def receive(self, text_data):
         try:
             data = json.loads(text_data)
+            action = data.get("action")
+
+            if action in ("subscribe", "unsubscribe"):
+                try:
+                    group = service_group(int(data.get("service_id")))
+                except (TypeError, ValueError):
+                    await self.send(text_data=json.dumps({
+                        "type": "error",
+                        "message": "service_id must be a number"
+                    }))
+                    return
+
+                if action == "subscribe":
+                    await self.subscribe(group)
+                else:
+                    await self.unsubscribe(group)
+                await self.send(text_data=json.dumps({
+                    "type": f"{action}d",
+                    "service_id": int(data["service_id"])
+                }))
+                return
+
             message = data.get("message", "No message received")  # Avoid KeyError
             wait_time = data.get("wait_time", 0)  # Ensure wait_time exists
 
@@ -28,4 +79,17 @@ class QueueConsumer(AsyncWebsocketConsumer):
             }))
 
     async def disconnect(self, close_code):
+        for group in list(self.subscriptions):
+            await self.unsubscribe(group)
         print(f"WebSocket disconnected with code {close_code}")
+
+    async def forward(self, event):
+        """Relay a channel layer event to the client, e.g. queue.update -> queue_update"""
+        await self.send(text_data=json.dumps({
+            **event,
+            "type": event["type"].replace(".", "_")
+        }))
+
+    queue_update = forward
+    queue_advance = forward
+    window_update = forward
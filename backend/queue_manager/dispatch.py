@@ -0,0 +1,268 @@
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .signals import queue_status_changed
+
+
+def lock_rows(queryset):
+    """
+    Lock the rows of ``queryset`` without waiting for other transactions,
+    returning the ids that were locked.
+
+    Rows another request is already claiming are skipped, so concurrent
+    windows never queue up behind each other. Backends without
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` (SQLite) serialize writers anyway;
+    there the ids are returned unlocked and the caller's compare-and-set
+    ``UPDATE`` decides who wins.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        queryset = queryset.select_for_update(skip_locked=True)
+    return list(queryset.values_list('pk', flat=True))
+
+
+def claim_window(window_id):
+    """
+    Flip an available window to busy, returning ``False`` if another request
+    claimed it first. Must run inside a transaction.
+    """
+    from .models import Window
+
+    available = Window.objects.filter(pk=window_id, status='available')
+    if not lock_rows(available):
+        return False
+    return bool(available.update(status='busy', last_active=timezone.now()))
+
+
+def match_windows(windows, tickets):
+    """
+    Pair free windows with waiting tickets in a single pass.
+
+    ``windows`` yields ``(window_id, direct_service_ids, provider_service_ids,
+    last_active)`` and ``tickets`` yields ``(queue_id, service_id)`` in
+    dispatch order. Each ticket, best first, takes the preferred free window
+    that can serve it: one that lists the service itself before one that only
+    serves it through its provider, then the one serving the fewest services
+    (keeping generalist windows free for later tickets), then the one idle
+    the longest. Returns a list of ``(window_id, queue_id)`` pairs.
+    """
+    candidates = {}
+    window_ids = set()
+    for window_id, direct, via_provider, last_active in windows:
+        window_ids.add(window_id)
+        eligible = set(direct) | set(via_provider)
+        for service_id in eligible:
+            rank = (0 if service_id in direct else 1, len(eligible), last_active, window_id)
+            candidates.setdefault(service_id, []).append(rank)
+
+    for ranked in candidates.values():
+        ranked.sort(reverse=True)  # best candidate last, so it can be popped
+
+    taken = set()
+    pairs = []
+    for queue_id, service_id in tickets:
+        if len(taken) == len(window_ids):
+            break
+        ranked = candidates.get(service_id)
+        while ranked and ranked[-1][-1] in taken:
+            ranked.pop()
+        if not ranked:
+            continue
+        window_id = ranked.pop()[-1]
+        taken.add(window_id)
+        pairs.append((window_id, queue_id))
+    return pairs
+
+
+def dispatch_key(priority, ticket_number):
+    """Heap key for a waiting ticket: priority tickets first, then ticket order"""
+    return (0 if priority else 1, ticket_number)
+
+
+class QueueDispatcher:
+    """
+    Keeps one heap of waiting tickets per service so a window can pick its
+    next customer in O(log n) instead of sorting the queue table.
+
+    Heaps are rebuilt from the database on first use and every
+    ``QUEUE_DISPATCHER_REFRESH_SECONDS`` afterwards. Entries are removed
+    lazily: ``_waiting`` maps every waiting ticket to its current entry, and
+    an entry that is no longer current (the ticket stopped waiting or its
+    priority changed) is dropped when it reaches the top of its heap. The
+    database stays the record of every assignment, and a claim only
+    succeeds while the row is still waiting there.
+
+    The heaps are per process. Joins and priority changes made in this
+    process reach them on commit; those made through another worker only
+    with the next reload, so with several workers a ticket can be called
+    after one that should have come later for up to the refresh interval.
+    Lower the interval if that matters more than the reload cost.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._heaps = {}
+        self._waiting = {}
+        self._loaded_at = None
+
+    @property
+    def refresh_interval(self):
+        return getattr(settings, 'QUEUE_DISPATCHER_REFRESH_SECONDS', 30)
+
+    def load(self):
+        """Rebuild every service heap from the waiting tickets in the database"""
+        from .models import Queue
+
+        heaps = {}
+        waiting = {}
+        rows = Queue.objects.filter(status='waiting').order_by().values_list(
+            'id', 'service_id', 'priority', 'ticket_number', 'join_time'
+        )
+        for queue_id, service_id, priority, ticket_number, join_time in rows:
+            entry = (*dispatch_key(priority, ticket_number), join_time.timestamp(), queue_id)
+            heaps.setdefault(service_id, []).append(entry)
+            waiting[queue_id] = entry
+
+        for heap in heaps.values():
+            heapq.heapify(heap)
+
+        with self._lock:
+            self._heaps = heaps
+            self._waiting = waiting
+            self._loaded_at = time.monotonic()
+
+    def reset(self):
+        """Forget all heaps; they are reloaded on the next dispatch"""
+        with self._lock:
+            self._heaps = {}
+            self._waiting = {}
+            self._loaded_at = None
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.load()
+
+    def push(self, queue):
+        """Add a newly waiting ticket to its service heap, or move one whose priority changed"""
+        with self._lock:
+            if self._loaded_at is None:
+                return  # picked up by the initial load
+            entry = (
+                *dispatch_key(queue.priority, queue.ticket_number),
+                queue.join_time.timestamp(),
+                queue.id
+            )
+            heapq.heappush(self._heaps.setdefault(queue.service_id, []), entry)
+            self._waiting[queue.id] = entry
+
+    def restore(self, service_id, entry):
+        """Put back a popped entry whose claim lost to another transaction"""
+        with self._lock:
+            if self._waiting.get(entry[-1]) == entry:
+                heapq.heappush(self._heaps.setdefault(service_id, []), entry)
+
+    def discard(self, queue_id):
+        """Mark a ticket as no longer waiting"""
+        with self._lock:
+            self._waiting.pop(queue_id, None)
+
+    def _head(self, service_id):
+        heap = self._heaps.get(service_id)
+        while heap and self._waiting.get(heap[0][-1]) != heap[0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def pop_next(self, service_ids):
+        """
+        Pop the best waiting ticket across ``service_ids`` from its heap,
+        returning ``(service_id, entry)``. The ticket stays in ``_waiting``
+        until a claim settles it.
+
+        Heads of different services are compared by priority and then by
+        join time, since ticket numbers are only ordered within a service.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            best = None
+            for service_id in service_ids:
+                head = self._head(service_id)
+                if head is None:
+                    continue
+                if best is None or (head[0], head[2]) < (best[0][0], best[0][2]):
+                    best = (head, service_id)
+
+            if best is None:
+                return None
+
+            entry, service_id = best
+            heapq.heappop(self._heaps[service_id])
+            return service_id, entry
+
+    def claim(self, queue_id):
+        """
+        Move a waiting ticket to processing, returning it or ``None`` if it
+        is no longer waiting or another window is claiming it right now.
+        Only a ticket that is gone for good leaves the heaps; one locked by
+        another transaction stays, as that transaction may still roll back.
+        """
+        from .models import Queue
+
+        with transaction.atomic():
+            waiting = Queue.objects.filter(pk=queue_id, status='waiting')
+            if not lock_rows(waiting):
+                if not waiting.exists():
+                    self.discard(queue_id)
+                return None
+            queue = Queue.objects.select_related('user', 'service').get(pk=queue_id)
+            queue.status = 'processing'
+            queue.start_time = timezone.now()
+            queue.update_durations()
+            if not waiting.update(
+                status=queue.status,
+                start_time=queue.start_time,
+                wait_seconds=queue.wait_seconds
+            ):
+                self.discard(queue_id)
+                return None
+            # Still dispatchable should the surrounding transaction roll back
+            transaction.on_commit(lambda: self.discard(queue_id))
+            queue._previous_status = queue.status
+            queue_status_changed.send(sender=Queue, queue=queue, previous_status='waiting')
+        return queue
+
+    def pull_next(self, window):
+        """Claim the next ticket this window is eligible to serve"""
+        from .models import Queue
+
+        service_ids = window.eligible_service_ids()
+        if not service_ids:
+            return None
+
+        reloaded = False
+        locked = []
+        try:
+            while True:
+                popped = self.pop_next(service_ids)
+                if popped is None:
+                    # Another process may have taken joins we have not seen yet
+                    if reloaded or not Queue.objects.filter(service_id__in=service_ids, status='waiting').exists():
+                        return None
+                    self.load()
+                    reloaded = True
+                    continue
+
+                service_id, entry = popped
+                queue = self.claim(entry[-1])
+                if queue is not None:
+                    return queue
+                locked.append((service_id, entry))
+        finally:
+            for service_id, entry in locked:
+                self.restore(service_id, entry)
+
+
+dispatcher = QueueDispatcher()
@@ -0,0 +1,168 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.dispatch import receiver
+
+from .signals import queue_status_changed, window_status_changed
+
+
+class ServiceTimeEstimator:
+    """
+    Rolling (EWMA) service duration per service and per (service, window).
+
+    Each completed queue updates the averages in O(1) from its stored
+    ``service_seconds``, so estimates never scan history. Averages
+    live in memory, are seeded from ``ServiceTimeEstimate`` rows on first use
+    and are written back at most every ``QUEUE_ESTIMATOR_PERSIST_SECONDS``.
+    Services without observations fall back to their hand-entered
+    ``average_service_time``.
+
+    Every worker process learns from the completions it sees, so a write
+    back replays this process's updates on top of the stored average
+    rather than replacing it: ``k`` EWMA updates turn a starting value
+    ``b`` into ``(1 - alpha) ** k * b + c``, and the row gets the same
+    ``c`` and decay applied to whatever it holds by then. The merged value
+    is read back, so each process also picks up what the others learned.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._averages = {}
+        # key -> [average the batch started from, EWMA updates since, new samples]
+        self._pending = {}
+        self._loaded = False
+        self._persisted_at = time.monotonic()
+
+    @property
+    def alpha(self):
+        return getattr(settings, 'QUEUE_ESTIMATOR_ALPHA', 0.2)
+
+    @property
+    def persist_interval(self):
+        return getattr(settings, 'QUEUE_ESTIMATOR_PERSIST_SECONDS', 60)
+
+    def load(self):
+        from .models import ServiceTimeEstimate
+
+        averages = {
+            (service_id, window_id): (average, samples)
+            for service_id, window_id, average, samples in ServiceTimeEstimate.objects.values_list(
+                'service_id', 'window_id', 'average_seconds', 'samples'
+            )
+        }
+        with self._lock:
+            averages.update(self._averages)  # keep observations made meanwhile
+            self._averages = averages
+            self._loaded = True
+
+    def reset(self):
+        with self._lock:
+            self._averages = {}
+            self._pending = {}
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def observe(self, service_id, seconds, window_id=None):
+        """Fold one completed service duration into the service or window average"""
+        if seconds is None or seconds < 0:
+            return
+        self._ensure_loaded()
+
+        key = (service_id, window_id)
+        with self._lock:
+            average, samples = self._averages.get(key, (None, 0))
+            if average is None:
+                # Against a row another process stored meanwhile, the first
+                # sample counts as one update
+                average = seconds
+                pending = self._pending.setdefault(key, [seconds, 1, 0])
+            else:
+                pending = self._pending.setdefault(key, [average, 0, 0])
+                average += self.alpha * (seconds - average)
+                pending[1] += 1
+            pending[2] += 1
+            self._averages[key] = (average, samples + 1)
+
+        if time.monotonic() - self._persisted_at > self.persist_interval:
+            self.persist()
+
+    def estimate(self, service, window_id=None):
+        """Expected service time in seconds for ``service``, optionally at one window"""
+        self._ensure_loaded()
+        with self._lock:
+            if window_id is not None and (service.id, window_id) in self._averages:
+                return self._averages[(service.id, window_id)][0]
+            if (service.id, None) in self._averages:
+                return self._averages[(service.id, None)][0]
+        return service.average_service_time * 60
+
+    def persist(self):
+        """Merge every average changed since the last call into its stored row"""
+        from .models import ServiceTimeEstimate
+
+        with self._lock:
+            batches = {key: (self._averages[key][0], *pending) for key, pending in self._pending.items()}
+            self._pending = {}
+            self._persisted_at = time.monotonic()
+        if not batches:
+            return
+
+        for (service_id, window_id), (average, base, updates, added) in batches.items():
+            decay = (1 - self.alpha) ** updates
+            rows = ServiceTimeEstimate.objects.filter(service_id=service_id, window_id=window_id)
+            merge = {
+                'average_seconds': F('average_seconds') * decay + (average - decay * base),
+                'samples': F('samples') + added,
+            }
+            if rows.update(**merge):
+                continue
+            try:
+                with transaction.atomic():
+                    ServiceTimeEstimate.objects.create(
+                        service_id=service_id, window_id=window_id, average_seconds=average, samples=added
+                    )
+            except IntegrityError:
+                rows.update(**merge)
+
+        merged = Q()
+        for service_id, window_id in batches:
+            merged |= Q(service_id=service_id, window_id=window_id)
+        stored = ServiceTimeEstimate.objects.filter(merged).values_list(
+            'service_id', 'window_id', 'average_seconds', 'samples'
+        )
+        with self._lock:
+            for service_id, window_id, average, samples in stored:
+                # Observations made meanwhile started from the local value; keep them
+                if (service_id, window_id) not in self._pending:
+                    self._averages[(service_id, window_id)] = (average, samples)
+
+
+estimator = ServiceTimeEstimator()
+
+
+@receiver(queue_status_changed)
+def observe_completed_queue(sender, queue, previous_status, **kwargs):
+    if queue.status == 'completed' and previous_status == 'processing':
+        seconds = queue.service_seconds
+        transaction.on_commit(lambda: estimator.observe(queue.service_id, seconds))
+
+
+@receiver(window_status_changed)
+def observe_window_service(sender, window, previous_status, previous_queue_id, **kwargs):
+    if previous_queue_id is None or previous_queue_id == window.current_queue_id:
+        return
+
+    from .models import Queue
+
+    finished = Queue.objects.filter(pk=previous_queue_id, status='completed').values_list(
+        'service_id', 'service_seconds'
+    ).first()
+    if finished:
+        service_id, seconds = finished
+        transaction.on_commit(lambda: estimator.observe(service_id, seconds, window_id=window.id))
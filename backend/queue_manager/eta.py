@@ -0,0 +1,106 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import versions
+from .estimators import estimator
+from .signals import window_status_changed
+from .versions import WINDOWS_KEY
+
+
+def project_start_offsets(waiting, remaining, service_seconds):
+    """
+    Seconds from now until each of ``waiting`` tickets is called, in order,
+    by windows that become free after ``remaining`` seconds and then take
+    ``service_seconds`` per customer.
+
+    Window ``j`` starts tickets at ``remaining[j] + k * service_seconds`` for
+    ``k = 0, 1, ...``; serving in order means the i-th ticket gets the i-th
+    earliest of those slots, so one sort of the slot grid drains every
+    window at once instead of simulating ticket by ticket.
+    """
+    remaining = np.asarray(remaining, dtype=float)
+    if waiting == 0:
+        return np.empty(0)
+    if remaining.size == 0:
+        return np.full(waiting, np.nan)
+
+    rounds = -(-waiting // remaining.size)
+    slots = remaining[:, np.newaxis] + service_seconds * np.arange(rounds)[np.newaxis, :]
+    return np.sort(slots, axis=None)[:waiting]
+
+
+class ETACache:
+    """
+    Projected start times per service, kept in the shared cache under the
+    service's version counter and the windows counter, so a change made
+    through any worker retires the projection everywhere. Busy windows'
+    remaining time is measured when projecting, so entries also expire
+    after ``QUEUE_ETA_CACHE_SECONDS``.
+    """
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'QUEUE_ETA_CACHE_SECONDS', 60)
+
+    def key(self, service_id):
+        counters = versions.read([versions.service_key(service_id), WINDOWS_KEY])
+        return f'eta:service:{service_id}:{counters[versions.service_key(service_id)]}.{counters[WINDOWS_KEY]}'
+
+    def for_service(self, service):
+        key = self.key(service.id)
+        etas = cache.get(key)
+        if etas is None:
+            etas = self.project(service)
+            cache.set(key, etas, self.timeout)
+        return etas
+
+    def project(self, service):
+        """Map every waiting ticket of ``service`` to its expected start time"""
+        from .models import Queue, Window
+
+        waiting = list(
+            Queue.objects.filter(service=service, status='waiting')
+            .order_by('-priority', 'ticket_number')
+            .values_list('id', flat=True)
+        )
+        if not waiting:
+            return {}
+
+        windows = Window.objects.filter(
+            Q(services=service) | Q(service_provider=service.provider_id),
+            status__in=['available', 'busy']
+        ).distinct().values_list('id', 'status', 'current_queue__start_time')
+
+        now = timezone.now()
+        remaining = []
+        for window_id, status, started in windows:
+            if status == 'busy' and started is not None:
+                elapsed = (now - started).total_seconds()
+                remaining.append(max(estimator.estimate(service, window_id) - elapsed, 0))
+            else:
+                remaining.append(0)
+
+        offsets = project_start_offsets(len(waiting), remaining, estimator.estimate(service))
+        return {
+            queue_id: None if np.isnan(offset) else now + timedelta(seconds=float(offset))
+            for queue_id, offset in zip(waiting, offsets)
+        }
+
+    def invalidate(self, service_id=None):
+        versions.bump(WINDOWS_KEY if service_id is None else versions.service_key(service_id))
+
+
+eta_cache = ETACache()
+
+
+@receiver(window_status_changed)
+def invalidate_all_etas(sender, window, previous_status, previous_queue_id, **kwargs):
+    # A window can serve several services, so every projection may shift
+    transaction.on_commit(eta_cache.invalidate)
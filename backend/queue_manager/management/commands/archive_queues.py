@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from queue_manager.archive import ARCHIVED_FIELDS, archive_after, archivable, extend_horizon, remove_archived
+from queue_manager.models import QueueArchive
+
+
+class Command(BaseCommand):
+    help = "Move completed and cancelled queues older than a cutoff from Queue to QueueArchive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=archive_after().days,
+            help='Archive queues joined more than this many days ago (default: QUEUE_ARCHIVE_AFTER_DAYS)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Rows moved per transaction (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        chunk_size = options['chunk_size']
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        finished = archivable(cutoff).order_by('pk')
+
+        last_pk = 0
+        moved = 0
+        while True:
+            # One short transaction per chunk, walking the primary key, so
+            # dispatch never waits behind a long-running archive
+            with transaction.atomic():
+                rows = list(
+                    finished.filter(pk__gt=last_pk).select_for_update().values(*ARCHIVED_FIELDS)[:chunk_size]
+                )
+                if not rows:
+                    break
+
+                QueueArchive.objects.bulk_create([QueueArchive(**row) for row in rows])
+                extend_horizon(max(row['join_time'] for row in rows))
+                remove_archived(rows)
+
+            last_pk = rows[-1]['id']
+            moved += len(rows)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Archived {moved} queues (up to id {last_pk})')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} queues joined before {cutoff:%Y-%m-%d %H:%M}'))
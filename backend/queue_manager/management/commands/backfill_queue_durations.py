@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from queue_manager.models import Queue
+
+
+class Command(BaseCommand):
+    help = "Fill wait_seconds and service_seconds on queues recorded before those columns existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Rows read and updated per transaction (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        missing = Queue.objects.filter(
+            Q(wait_seconds__isnull=True, start_time__isnull=False) |
+            Q(service_seconds__isnull=True, start_time__isnull=False, end_time__isnull=False)
+        ).order_by('pk')
+
+        last_pk = 0
+        updated = 0
+        while True:
+            # Walk the primary key so every chunk is an index range scan
+            chunk = list(
+                missing.filter(pk__gt=last_pk).only('id', 'join_time', 'start_time', 'end_time')[:chunk_size]
+            )
+            if not chunk:
+                break
+
+            for queue in chunk:
+                queue.update_durations()
+            with transaction.atomic():
+                Queue.objects.bulk_update(chunk, ['wait_seconds', 'service_seconds'])
+
+            last_pk = chunk[-1].pk
+            updated += len(chunk)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Backfilled {updated} queues (up to id {last_pk})')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled durations on {updated} queues'))
@@ -0,0 +1,249 @@
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from queue_manager.dispatch import dispatcher
+from queue_manager.models import Queue, Service, ServiceCategory, User, Window
+from queue_manager.views import QueueViewSet, WindowViewSet
+
+PERCENTILES = (50, 95, 99)
+
+# The viewset actions each operation goes through, as routed in urls.py
+VIEWS = {
+    'join': QueueViewSet.as_view({'post': 'create'}),
+    'next_queue': WindowViewSet.as_view({'patch': 'next_queue'}),
+    'complete': QueueViewSet.as_view({'patch': 'complete'}),
+}
+
+
+def latency_summary(seconds):
+    """Latency percentiles, mean and maximum in milliseconds"""
+    if not seconds:
+        return {}
+    millis = np.asarray(seconds) * 1000
+    summary = {f'p{p}': round(float(value), 3) for p, value in zip(PERCENTILES, np.percentile(millis, PERCENTILES))}
+    summary['mean'] = round(float(millis.mean()), 3)
+    summary['max'] = round(float(millis.max()), 3)
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic users, services, windows and queues in bulk, then time joins, "
+        "window dispatch and completions through the API viewsets and print the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Customers to seed (default: 1000)')
+        parser.add_argument('--services', type=int, default=20, help='Services to seed, each with its own provider (default: 20)')
+        parser.add_argument('--windows', type=int, default=40, help='Windows to seed (default: 40)')
+        parser.add_argument('--queues', type=int, default=5000, help='Waiting queues to seed (default: 5000)')
+        parser.add_argument(
+            '--operations',
+            type=int,
+            default=1000,
+            help='Requests timed per operation (default: 1000)'
+        )
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent worker threads (default: 8)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed, for repeatable request mixes')
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the seeded rows afterwards')
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Do not ask for confirmation before writing to the database'
+        )
+
+    def handle(self, *args, **options):
+        for name in ('users', 'services', 'windows', 'operations', 'workers'):
+            if options[name] < 1:
+                raise CommandError(f'--{name} must be at least 1')
+        if options['queues'] < 0:
+            raise CommandError('--queues cannot be negative')
+
+        if options['interactive']:
+            answer = input(
+                f"This adds benchmark rows to the '{connection.settings_dict['NAME']}' database.\n"
+                "Type 'yes' to continue, or 'no' to cancel: "
+            )
+            if answer != 'yes':
+                raise CommandError('Benchmark cancelled.')
+
+        self.verbosity = options['verbosity']
+        self.random = random.Random(options['seed'])
+        self.label = f'bench-{uuid.uuid4().hex[:8]}'
+        started = time.perf_counter()
+        seeded = self.seed(options)
+        seed_seconds = time.perf_counter() - started
+        # Bulk inserts bypass the dispatcher, so let it load the new tickets
+        dispatcher.reset()
+
+        report = {
+            'run': self.label,
+            'started_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'workers': options['workers'],
+            'seeded': {**seeded, 'seconds': round(seed_seconds, 3)},
+            'operations': {},
+        }
+        try:
+            for name, calls in self.plan(options['operations']):
+                report['operations'][name] = self.run(name, calls, options['workers'])
+        finally:
+            if options['cleanup']:
+                self.cleanup()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {self.label} results to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def seed(self, options):
+        """Bulk-create the benchmark rows, all named after ``self.label``"""
+        label = self.label
+        password = make_password(None)
+        category = ServiceCategory.objects.create(name=label)
+
+        User.objects.bulk_create([
+            User(
+                username=f'{label}-provider{i}', email=f'{label}-provider{i}@example.com', password=password,
+                user_type='provider', is_service_provider=True
+            )
+            for i in range(options['services'])
+        ])
+        self.providers = list(User.objects.filter(username__startswith=f'{label}-provider').order_by('pk'))
+        Service.objects.bulk_create([
+            Service(name=f'{label} service {i}', provider=provider, category=category)
+            for i, provider in enumerate(self.providers)
+        ])
+        self.services = list(Service.objects.filter(category=category).order_by('pk'))
+
+        User.objects.bulk_create([
+            User(username=f'{label}-customer{i}', email=f'{label}-customer{i}@example.com', password=password)
+            for i in range(options['users'])
+        ])
+        self.customers = list(User.objects.filter(username__startswith=f'{label}-customer').order_by('pk'))
+
+        Window.objects.bulk_create([
+            Window(name=f'{label}-window{i}', service_provider_id=self.services[i % len(self.services)].provider_id)
+            for i in range(options['windows'])
+        ])
+        self.windows = list(Window.objects.filter(name__startswith=f'{label}-window').order_by('pk'))
+        # Each window also serves the next provider's service, so work can move between them
+        Window.services.through.objects.bulk_create([
+            Window.services.through(window=window, service=self.services[(i + 1) % len(self.services)])
+            for i, window in enumerate(self.windows)
+        ])
+
+        # Waiting tickets for dispatch, and tickets already being served for
+        # the completions, so the two never race for the same row
+        now = timezone.now()
+        Queue.objects.bulk_create([
+            Queue(user=self.random.choice(self.customers), service=self.random.choice(self.services),
+                  priority=self.random.random() < 0.1)
+            for _ in range(options['queues'])
+        ], batch_size=1000)
+        Queue.objects.bulk_create([
+            Queue(user=self.random.choice(self.customers), service=self.random.choice(self.services),
+                  status='processing', start_time=now)
+            for _ in range(options['operations'])
+        ], batch_size=1000)
+        self.processing = list(
+            Queue.objects.filter(service__in=self.services, status='processing').values_list('user_id', 'id')
+        )
+
+        return {
+            'users': len(self.customers),
+            'providers': len(self.providers),
+            'services': len(self.services),
+            'windows': len(self.windows),
+            'waiting_queues': options['queues'],
+            'processing_queues': len(self.processing),
+        }
+
+    def plan(self, operations):
+        """``(operation, calls)`` pairs, a call being ``(user, method, path, data, view kwargs)``"""
+        customers = {user.pk: user for user in self.customers}
+        providers = {user.pk: user for user in self.providers}
+
+        yield 'join', [
+            (self.random.choice(self.customers), 'post', '/api/queues/',
+             {'service_id': self.random.choice(self.services).pk}, {})
+            for _ in range(operations)
+        ]
+
+        windows = [self.random.choice(self.windows) for _ in range(operations)]
+        yield 'next_queue', [
+            (providers[window.service_provider_id], 'patch', f'/api/windows/{window.pk}/next_queue/', {},
+             {'pk': window.pk})
+            for window in windows
+        ]
+
+        yield 'complete', [
+            (customers[user_id], 'patch', f'/api/queues/{queue_id}/complete/', {}, {'pk': queue_id})
+            for user_id, queue_id in self.random.sample(self.processing, min(operations, len(self.processing)))
+        ]
+
+    def run(self, name, calls, workers):
+        """Spread ``calls`` over ``workers`` threads and summarise their timings"""
+        view = VIEWS[name]
+
+        def work(batch):
+            factory = APIRequestFactory()
+            latencies, errors = [], 0
+            try:
+                for user, method, path, data, kwargs in batch:
+                    request = getattr(factory, method)(path, data, format='json')
+                    force_authenticate(request, user=user)
+                    started = time.perf_counter()
+                    try:
+                        response = view(request, **kwargs)
+                        response.render()
+                    except DatabaseError:
+                        # Lock timeouts and the like under contention
+                        errors += 1
+                        continue
+                    latencies.append(time.perf_counter() - started)
+                    if response.status_code >= 400:
+                        errors += 1
+            finally:
+                # Each thread has its own connection; do not leave them open
+                connections.close_all()
+            return latencies, errors
+
+        batches = [calls[i::workers] for i in range(workers)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(work, batches))
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for batch, _ in results for latency in batch]
+        errors = sum(batch_errors for _, batch_errors in results)
+        if self.verbosity > 1:
+            self.stderr.write(f'{name}: {len(calls)} requests in {elapsed:.2f}s, {errors} errors')
+        return {
+            'requests': len(calls),
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'ops_per_second': round(len(calls) / elapsed, 1) if elapsed else None,
+            'latency_ms': latency_summary(latencies),
+        }
+
+    def cleanup(self):
+        Window.objects.filter(name__startswith=f'{self.label}-window').delete()
+        # Providers take their services, and customers their queues, with them
+        User.objects.filter(username__startswith=f'{self.label}-').delete()
+        ServiceCategory.objects.filter(name=self.label).delete()
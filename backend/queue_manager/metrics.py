@@ -0,0 +1,129 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Window, WindowMetricsBucket
+from .signals import window_status_changed
+
+
+def bucket_size():
+    return timedelta(minutes=getattr(settings, 'WINDOW_METRICS_BUCKET_MINUTES', 60))
+
+
+def bucket_start(moment):
+    """Start of the bucket containing ``moment``"""
+    size = int(bucket_size().total_seconds())
+    epoch = int(moment.timestamp())
+    return moment - timedelta(seconds=epoch % size, microseconds=moment.microsecond)
+
+
+def split_into_buckets(start, end):
+    """Yield ``(bucket_start, seconds)`` for each bucket the interval overlaps"""
+    while start < end:
+        current = bucket_start(start)
+        boundary = min(current + bucket_size(), end)
+        yield current, (boundary - start).total_seconds()
+        start = boundary
+
+
+def _add(window_id, bucket, **deltas):
+    updates = {column: F(column) + delta for column, delta in deltas.items() if delta}
+    if not updates:
+        return
+    buckets = WindowMetricsBucket.objects.filter(window=window_id, bucket_start=bucket)
+    if buckets.update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            WindowMetricsBucket.objects.create(window_id=window_id, bucket_start=bucket, **deltas)
+    except IntegrityError:
+        buckets.update(**updates)
+
+
+@receiver(window_status_changed)
+def record_window_transition(sender, window, previous_status, previous_queue_id,
+                             previous_status_since=None, **kwargs):
+    """
+    Close the window's previous state: its duration goes into the busy or
+    idle counters of every bucket it spans, and a customer who left the
+    window counts as served in the bucket where they left.
+    """
+    now = window.status_since or timezone.now()
+    if previous_status_since is None or previous_status_since >= now:
+        return
+
+    column = {'busy': 'busy_seconds', 'available': 'idle_seconds'}.get(previous_status)
+    if column:
+        for bucket, seconds in split_into_buckets(previous_status_since, now):
+            _add(window.id, bucket, **{column: seconds})
+
+    if previous_queue_id is not None and previous_queue_id != window.current_queue_id:
+        _add(
+            window.id,
+            bucket_start(now),
+            served=1,
+            handle_seconds=(now - previous_status_since).total_seconds()
+        )
+
+
+def window_stats(since):
+    """
+    Window counts plus utilization and throughput accumulated since
+    ``since``. The buckets only hold closed intervals, so each window's
+    current busy or idle stretch is added up to now.
+    """
+    now = timezone.now()
+    open_seconds = {}
+    counts = {'total': 0, 'available': 0, 'busy': 0}
+    for window_id, name, status, status_since in Window.objects.values_list('id', 'name', 'status', 'status_since'):
+        counts['total'] += 1
+        if status not in ('available', 'busy'):
+            continue
+        counts[status] += 1
+        if status_since is not None:
+            seconds = max((now - max(status_since, bucket_start(since))).total_seconds(), 0)
+            busy = seconds if status == 'busy' else 0
+            open_seconds[window_id] = (name, busy, seconds - busy)
+
+    per_window = WindowMetricsBucket.objects.filter(bucket_start__gte=bucket_start(since)).values(
+        'window', 'window__name'
+    ).annotate(
+        busy=Sum('busy_seconds'),
+        idle=Sum('idle_seconds'),
+        served_count=Sum('served'),
+        handle=Sum('handle_seconds'),
+    ).order_by('window__name')
+
+    def summarize(busy, idle, served, handle):
+        return {
+            'busy_minutes': round(busy / 60, 1),
+            'idle_minutes': round(idle / 60, 1),
+            'utilization': round(busy / (busy + idle), 3) if busy + idle else 0,
+            'customers_served': served,
+            'mean_handle_time_minutes': round(handle / served / 60, 1) if served else 0,
+        }
+
+    windows = []
+    totals = [0, 0, 0, 0]
+    rows = {row['window']: row for row in per_window}
+    for window_id, (name, busy, idle) in open_seconds.items():
+        rows.setdefault(window_id, {'window': window_id, 'window__name': name})
+        rows[window_id]['busy'] = (rows[window_id].get('busy') or 0) + busy
+        rows[window_id]['idle'] = (rows[window_id].get('idle') or 0) + idle
+    for row in sorted(rows.values(), key=lambda row: row['window__name']):
+        values = (row['busy'] or 0, row['idle'] or 0, row.get('served_count') or 0, row.get('handle') or 0)
+        totals = [total + value for total, value in zip(totals, values)]
+        windows.append({'window': row['window'], 'name': row['window__name'], **summarize(*values)})
+
+    return {
+        'total_windows': counts['total'],
+        'available_windows': counts['available'],
+        'busy_windows': counts['busy'],
+        'since': since,
+        **summarize(*totals),
+        'windows': windows,
+    }
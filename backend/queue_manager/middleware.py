@@ -0,0 +1,66 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import get_cached_user
+
+# Browsers cannot set headers on a WebSocket handshake, so the token comes
+# either as ?token=<jwt> or as the subprotocol after this marker:
+# new WebSocket(url, ['jwt', token])
+TOKEN_SUBPROTOCOL = 'jwt'
+
+
+def token_from_scope(scope):
+    """The raw access token a connection presented and the subprotocol it came through"""
+    subprotocols = list(scope.get('subprotocols') or [])
+    if TOKEN_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(TOKEN_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1], TOKEN_SUBPROTOCOL
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    tokens = query.get('token')
+    return (tokens[0], None) if tokens else (None, None)
+
+
+@database_sync_to_async
+def user_for_token(raw_token):
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return AnonymousUser()
+
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    # Same cache the REST API authenticates from, so a wave of reconnects
+    # after a deploy costs at most one query per user
+    user = get_cached_user(user_id) if user_id is not None else None
+    if user is None or not user.is_active:
+        return AnonymousUser()
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Sets ``scope['user']`` from a simplejwt access token instead of the
+    session cookie, which the JWT-only frontend never has. Connections
+    without a token are anonymous; ones whose token is invalid or expired
+    stay anonymous and get ``scope['auth_rejected']`` so the consumer
+    refuses them rather than quietly downgrading a signed-in client. When
+    the token came as a
+    subprotocol, ``scope['auth_subprotocol']`` names the subprotocol the
+    consumer has to accept, as browsers drop handshakes that do not
+    confirm one of the offered subprotocols.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token, subprotocol = token_from_scope(scope)
+        scope['user'] = await user_for_token(raw_token) if raw_token else AnonymousUser()
+        scope['auth_subprotocol'] = subprotocol
+        scope['auth_rejected'] = raw_token is not None and not scope['user'].is_authenticated
+        return await super().__call__(scope, receive, send)
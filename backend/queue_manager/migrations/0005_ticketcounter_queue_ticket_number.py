@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_ticket_numbers(apps, schema_editor):
+    Queue = apps.get_model('queue_manager', 'Queue')
+    TicketCounter = apps.get_model('queue_manager', 'TicketCounter')
+
+    last_numbers = {}
+    for queue in Queue.objects.order_by('service_id', 'join_time', 'id').only('id', 'service_id'):
+        number = last_numbers.get(queue.service_id, 0) + 1
+        last_numbers[queue.service_id] = number
+        Queue.objects.filter(pk=queue.pk).update(ticket_number=number)
+
+    TicketCounter.objects.bulk_create([
+        TicketCounter(service_id=service_id, last_number=number)
+        for service_id, number in last_numbers.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_manager', '0004_remove_service_priority_delete_assignmentlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCounter',
+            fields=[
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ticket_counter', serialize=False, to='queue_manager.service')),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='ticket_number',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Per-service ticket sequence number'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_ticket_numbers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='queue',
+            constraint=models.UniqueConstraint(fields=('service', 'ticket_number'), name='unique_service_ticket_number'),
+        ),
+    ]
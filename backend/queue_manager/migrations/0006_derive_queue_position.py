@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_manager', '0005_ticketcounter_queue_ticket_number'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='queue',
+            options={'ordering': ['-priority', 'ticket_number']},
+        ),
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='queue_manag_service_ca5d7a_idx',
+        ),
+        migrations.RemoveField(
+            model_name='queue',
+            name='position',
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'status', 'priority', 'ticket_number'], name='queue_manag_service_cf4eeb_idx'),
+        ),
+    ]
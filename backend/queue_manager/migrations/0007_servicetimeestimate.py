@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_manager', '0006_derive_queue_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceTimeEstimate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('average_seconds', models.FloatField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='time_estimates', to='queue_manager.service')),
+                ('window', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='time_estimates', to='queue_manager.window')),
+            ],
+            options={
+                'unique_together': {('service', 'window')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_manager', '0007_servicetimeestimate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyQueueStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('joined', models.PositiveIntegerField(default=0)),
+                ('waiting', models.PositiveIntegerField(default=0)),
+                ('processing', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('cancelled', models.PositiveIntegerField(default=0)),
+                ('priority', models.PositiveIntegerField(default=0)),
+                ('wait_seconds', models.FloatField(default=0, help_text='Total wait of completed queues')),
+                ('waits', models.PositiveIntegerField(default=0, help_text='Completed queues with a known wait')),
+                ('service_seconds', models.FloatField(default=0, help_text='Total service time of completed queues')),
+                ('services', models.PositiveIntegerField(default=0, help_text='Completed queues with a known service time')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_queue_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily queue stats',
+                'unique_together': {('user', 'date')},
+            },
+        ),
+    ]
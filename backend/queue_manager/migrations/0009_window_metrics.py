@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_manager', '0008_dailyqueuestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='window',
+            name='status_since',
+            field=models.DateTimeField(blank=True, help_text='When the status or current queue last changed', null=True),
+        ),
+        migrations.CreateModel(
+            name='WindowMetricsBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('busy_seconds', models.FloatField(default=0)),
+                ('idle_seconds', models.FloatField(default=0)),
+                ('served', models.PositiveIntegerField(default=0)),
+                ('handle_seconds', models.FloatField(default=0, help_text='Total time spent on served customers')),
+                ('window', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metrics', to='queue_manager.window')),
+            ],
+            options={
+                'ordering': ['-bucket_start'],
+                'indexes': [models.Index(fields=['bucket_start'], name='queue_manag_bucket__2c8b6d_idx')],
+                'unique_together': {('window', 'bucket_start')},
+            },
+        ),
+    ]
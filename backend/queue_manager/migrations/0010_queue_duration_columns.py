@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_manager', '0009_window_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queue',
+            name='service_seconds',
+            field=models.FloatField(blank=True, editable=False, help_text='Seconds from being called to completion, stored on completion', null=True),
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='wait_seconds',
+            field=models.FloatField(blank=True, editable=False, help_text='Seconds from joining to being called, stored when processing starts', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'wait_seconds'], name='queue_manag_service_34b490_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'service_seconds'], name='queue_manag_service_aa37cb_idx'),
+        ),
+    ]
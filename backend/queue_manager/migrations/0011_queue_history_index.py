@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_manager', '0010_queue_duration_columns'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='queue_manag_user_id_fae0e3_idx',
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['user', '-join_time', '-id'], name='queue_user_history_idx'),
+        ),
+    ]
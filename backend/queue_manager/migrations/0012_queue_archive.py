@@ -0,0 +1,60 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_manager', '0011_queue_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('join_time', models.DateTimeField()),
+                ('start_time', models.DateTimeField(blank=True, null=True)),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('waiting', 'Waiting'), ('processing', 'Processing'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=10)),
+                ('ticket_number', models.PositiveIntegerField()),
+                ('priority', models.BooleanField(default=False)),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('wait_seconds', models.FloatField(blank=True, null=True)),
+                ('service_seconds', models.FloatField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-join_time', '-id'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='queue_manag_service_cf4eeb_idx',
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(condition=models.Q(('status__in', ['waiting', 'processing'])), fields=['service', 'status', 'priority', 'ticket_number'], name='queue_active_dispatch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(condition=models.Q(('status__in', ['waiting', 'processing'])), fields=['user', 'status'], name='queue_active_user_idx'),
+        ),
+        migrations.AddField(
+            model_name='queuearchive',
+            name='service',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_queues', to='queue_manager.service'),
+        ),
+        migrations.AddField(
+            model_name='queuearchive',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_queues', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='queuearchive',
+            index=models.Index(fields=['user', '-join_time', '-id'], name='archive_user_history_idx'),
+        ),
+    ]
@@ -1,8 +1,14 @@
-from django.db import models
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models import F, Q, Count, Case, When, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 
+from .signals import queue_status_changed, window_status_changed
+
 
 class UserManager(BaseUserManager):
     def create_user(self, username, email, password=None, **extra_fields):
@@ -160,6 +166,91 @@ class Service(models.Model):
         unique_together = ['name', 'provider']
 
 
+class TicketCounter(models.Model):
+    """Per-service ticket sequence, bumped atomically on every join"""
+    service = models.OneToOneField(
+        Service,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='ticket_counter'
+    )
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.service.name}: #{self.last_number}"
+
+    @classmethod
+    def next_number(cls, service):
+        """
+        Reserve the next ticket number for ``service``.
+
+        The increment is a single ``UPDATE ... SET last_number = last_number + 1``
+        on the counter row, so concurrent joins serialize on that one row lock
+        and can never be handed the same number.
+        """
+        return cls.reserve(service)[0]
+
+    @classmethod
+    def reserve(cls, service, count=1):
+        """Reserve ``count`` consecutive ticket numbers for ``service`` as a ``range``"""
+        with transaction.atomic():
+            counter = cls.objects.filter(service=service)
+            if not counter.update(last_number=F('last_number') + count):
+                cls.objects.get_or_create(service=service)
+                counter.update(last_number=F('last_number') + count)
+            last_number = counter.values_list('last_number', flat=True).get()
+        return range(last_number - count + 1, last_number + 1)
+
+
+class QueueQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Number the tickets that have none, one counter update per service,
+        then insert them in bulk.
+
+        Like any ``bulk_create`` this skips ``save()`` and its signals, so no
+        rollup row or version counter is updated, and the dispatcher only
+        sees the new tickets after its next load.
+        """
+        objs = list(objs)
+        unnumbered = defaultdict(list)
+        for queue in objs:
+            if queue.ticket_number is None:
+                unnumbered[queue.service_id].append(queue)
+            queue.update_durations()
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            for queues in unnumbered.values():
+                for queue, number in zip(queues, TicketCounter.reserve(queues[0].service, len(queues))):
+                    queue.ticket_number = number
+            return super().bulk_create(objs, *args, **kwargs)
+
+    def with_position(self):
+        """
+        Annotate each queue with its live place in line as ``queue_position``.
+
+        A waiting ticket's position is one plus the number of waiting tickets of
+        the same service that dispatch would serve first: higher priority, or
+        equal priority with a lower ticket number. Only waiting tickets have a
+        position, so finishing or cancelling one never rewrites the others.
+        """
+        ahead = Queue.objects.filter(
+            service=OuterRef('service'),
+            status='waiting'
+        ).filter(
+            Q(priority__gt=OuterRef('priority')) |
+            Q(priority=OuterRef('priority'), ticket_number__lt=OuterRef('ticket_number'))
+        ).order_by().values('service').annotate(ahead=Count('pk')).values('ahead')
+
+        return self.annotate(
+            queue_position=Case(
+                When(status='waiting', then=Coalesce(Subquery(ahead), 0) + 1),
+                default=None,
+                output_field=IntegerField()
+            )
+        )
+
+
 class Queue(models.Model):
     QUEUE_STATUS_CHOICES = [
         ('waiting', 'Waiting'),
@@ -186,59 +277,192 @@ class Queue(models.Model):
         choices=QUEUE_STATUS_CHOICES, 
         default='waiting'
     )
-    position = models.PositiveIntegerField(default=1)
+    ticket_number = models.PositiveIntegerField(
+        editable=False,
+        help_text="Per-service ticket sequence number"
+    )
     priority = models.BooleanField(
     default=False,
     help_text="Check for high priority"
     )
     notes = models.TextField(blank=True, null=True)
+    wait_seconds = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Seconds from joining to being called, stored when processing starts"
+    )
+    service_seconds = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Seconds from being called to completion, stored on completion"
+    )
+
+    objects = QueueQuerySet.as_manager()
 
     def __str__(self):
         return f"Queue #{self.id} - {self.user.username} for {self.service.name}"
     
     def assign_to_available_window(self):
-        """Attempt to assign this queue to an available window"""
+        """
+        Hand an available window to the dispatcher if one can serve this queue.
+
+        The window takes the best waiting ticket for its services, which is
+        this queue unless someone with a higher priority or an earlier ticket
+        is already waiting.
+        """
         if self.status != 'waiting':
             return False
             
         available_window = Window.objects.filter(
-            services=self.service,
+            Q(services=self.service) | Q(service_provider=self.service.provider_id),
             status='available'
         ).first()
         
-        if available_window:
-            self.status = 'processing'
-            self.start_time = timezone.now()
-            self.save()
-            
-            available_window.current_queue = self
-            available_window.status = 'busy'
-            available_window.save()
-            return True
+        if available_window and available_window.assign_next_queue():
+            return available_window.current_queue_id == self.id
         return False
 
     class Meta:
-        ordering = ['-priority', 'position']
+        ordering = ['-priority', 'ticket_number']
         indexes = [
-            models.Index(fields=['service', 'status']),
-            models.Index(fields=['user']),
+            # Dispatch and positions only look at live tickets, so these stay
+            # small however much finished history piles up next to them
+            models.Index(
+                fields=['service', 'status', 'priority', 'ticket_number'],
+                condition=Q(status__in=['waiting', 'processing']),
+                name='queue_active_dispatch_idx'
+            ),
+            models.Index(
+                fields=['user', 'status'],
+                condition=Q(status__in=['waiting', 'processing']),
+                name='queue_active_user_idx'
+            ),
+            # Keyset pages of a user's history walk (join_time, id) downwards
+            models.Index(fields=['user', '-join_time', '-id'], name='queue_user_history_idx'),
+            models.Index(fields=['service', 'wait_seconds']),
+            models.Index(fields=['service', 'service_seconds']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['service', 'ticket_number'],
+                name='unique_service_ticket_number'
+            ),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._previous_status = instance.__dict__.get('status')
+        instance._previous_priority = instance.__dict__.get('priority')
+        return instance
+
     def save(self, *args, **kwargs):
-        if not self.pk:  # Only for new instances
-            last_position = Queue.objects.filter(
-                service=self.service,
-                status__in=['waiting', 'processing']
-            ).count()
-            self.position = last_position + 1
+        adding = not self.pk
+        if adding:  # Only for new instances
+            self.ticket_number = TicketCounter.next_number(self.service)
+        previous_status = None if adding else getattr(self, '_previous_status', None)
+        previous_priority = getattr(self, '_previous_priority', self.priority)
+        self.update_durations()
         super().save(*args, **kwargs)
 
+        from .dispatch import dispatcher
+        if self.status != 'waiting':
+            dispatcher.discard(self.id)
+        elif adding or self.priority != previous_priority:
+            # A new ticket, or one whose place in line moved
+            transaction.on_commit(lambda: dispatcher.push(self))
+
+        if self.status != previous_status:
+            queue_status_changed.send(sender=Queue, queue=self, previous_status=previous_status)
+        self._previous_status = self.status
+        self._previous_priority = self.priority
+
+    def update_durations(self):
+        """Store wait and service durations from the timestamps set so far"""
+        self.wait_seconds = (
+            (self.start_time - self.join_time).total_seconds()
+            if self.start_time and self.join_time else None
+        )
+        self.service_seconds = (
+            (self.end_time - self.start_time).total_seconds()
+            if self.end_time and self.start_time else None
+        )
+
+    def get_position(self):
+        """Place in line, taken from ``with_position()`` when it was annotated"""
+        if self.status != 'waiting':
+            return None
+        if hasattr(self, 'queue_position'):
+            return self.queue_position
+        return Queue.objects.filter(
+            service=self.service_id,
+            status='waiting'
+        ).filter(
+            Q(priority__gt=self.priority) |
+            Q(priority=self.priority, ticket_number__lt=self.ticket_number)
+        ).count() + 1
+
     def get_wait_time(self):
         if self.status == 'completed':
             return None
         return timezone.now() - self.join_time
 
 
+class QueueArchiveQuerySet(models.QuerySet):
+    def with_position(self):
+        """Same columns as ``Queue.objects.with_position()``; archived queues have no place in line"""
+        return self.annotate(queue_position=Value(None, output_field=IntegerField()))
+
+
+class QueueArchive(models.Model):
+    """
+    A finished queue moved out of ``Queue`` by the ``archive_queues`` command.
+    It keeps its original id, so history cursors stay valid across the move.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archived_queues'
+    )
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE,
+        related_name='archived_queues'
+    )
+    join_time = models.DateTimeField()
+    start_time = models.DateTimeField(null=True, blank=True)
+    end_time = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=Queue.QUEUE_STATUS_CHOICES)
+    ticket_number = models.PositiveIntegerField()
+    priority = models.BooleanField(default=False)
+    notes = models.TextField(blank=True, null=True)
+    wait_seconds = models.FloatField(null=True, blank=True)
+    service_seconds = models.FloatField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = QueueArchiveQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Archived queue #{self.id}"
+
+    def get_position(self):
+        return None
+
+    def get_wait_time(self):
+        if self.status == 'completed':
+            return None
+        return timezone.now() - self.join_time
+
+    class Meta:
+        ordering = ['-join_time', '-id']
+        indexes = [
+            models.Index(fields=['user', '-join_time', '-id'], name='archive_user_history_idx'),
+        ]
+
+
 class Window(models.Model):
     WINDOW_STATUS_CHOICES = [
         ('available', 'Available'),
@@ -274,28 +498,65 @@ class Window(models.Model):
     )
     location = models.CharField(max_length=100, blank=True, null=True)
     last_active = models.DateTimeField(auto_now=True)
+    status_since = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the status or current queue last changed"
+    )
+
+    def eligible_service_ids(self):
+        """Services this window serves directly or through its provider"""
+        served = Q(windows_available=self)
+        if self.service_provider_id:
+            served |= Q(provider=self.service_provider_id)
+        return set(Service.objects.filter(served).order_by().values_list('id', flat=True))
 
     def assign_next_queue(self):
         """Automatically assign the next appropriate queue to this window"""
         if self.status != 'available':
             return False
             
-        next_queue = Queue.objects.filter(
-            service__in=self.services.all(),
-            status='waiting'
-        ).order_by('-priority', 'position').first()
-        
-        if next_queue:
-            next_queue.status = 'processing'
-            next_queue.start_time = timezone.now()
-            next_queue.save()
+        from .dispatch import dispatcher, claim_window
+        with transaction.atomic():
+            if not claim_window(self.pk):
+                return False
+            next_queue = dispatcher.pull_next(self)
             
-            self.current_queue = next_queue
-            self.status = 'busy'
-            self.save()
-            return True
+            if next_queue:
+                self.current_queue = next_queue
+                self.status = 'busy'
+                self.save()
+                return True
+            Window.objects.filter(pk=self.pk).update(status='available')
         return False
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._previous_status = instance.__dict__.get('status')
+        instance._previous_queue_id = instance.__dict__.get('current_queue_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        previous_status = getattr(self, '_previous_status', None)
+        previous_queue_id = getattr(self, '_previous_queue_id', None)
+        previous_status_since = self.status_since
+        changed = self.status != previous_status or self.current_queue_id != previous_queue_id
+        if changed:
+            self.status_since = timezone.now()
+        super().save(*args, **kwargs)
+
+        if changed:
+            window_status_changed.send(
+                sender=Window,
+                window=self,
+                previous_status=previous_status,
+                previous_queue_id=previous_queue_id,
+                previous_status_since=previous_status_since
+            )
+        self._previous_status = self.status
+        self._previous_queue_id = self.current_queue_id
+
     def __str__(self):
         status = f" - {self.get_status_display()}"
         if self.service_provider:
@@ -307,3 +568,79 @@ class Window(models.Model):
         verbose_name = 'Service Window'
         verbose_name_plural = 'Service Windows'
 
+
+class ServiceTimeEstimate(models.Model):
+    """Persisted snapshot of the learned service time for a service, optionally per window"""
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE,
+        related_name='time_estimates'
+    )
+    window = models.ForeignKey(
+        Window,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='time_estimates'
+    )
+    average_seconds = models.FloatField()
+    samples = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        target = f" at {self.window.name}" if self.window_id else ""
+        return f"{self.service.name}{target}: {self.average_seconds:.0f}s"
+
+    class Meta:
+        unique_together = ['service', 'window']
+
+
+class DailyQueueStats(models.Model):
+    """Per-user, per-day queue counters, kept current on every queue transition"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='daily_queue_stats'
+    )
+    date = models.DateField()
+    joined = models.PositiveIntegerField(default=0)
+    waiting = models.PositiveIntegerField(default=0)
+    processing = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    priority = models.PositiveIntegerField(default=0)
+    wait_seconds = models.FloatField(default=0, help_text="Total wait of completed queues")
+    waits = models.PositiveIntegerField(default=0, help_text="Completed queues with a known wait")
+    service_seconds = models.FloatField(default=0, help_text="Total service time of completed queues")
+    services = models.PositiveIntegerField(default=0, help_text="Completed queues with a known service time")
+
+    def __str__(self):
+        return f"{self.user.username} on {self.date}: {self.joined} joined"
+
+    class Meta:
+        unique_together = ['user', 'date']
+        verbose_name_plural = 'Daily queue stats'
+
+
+class WindowMetricsBucket(models.Model):
+    """Busy/idle time and customers served by one window within one time bucket"""
+    window = models.ForeignKey(
+        Window,
+        on_delete=models.CASCADE,
+        related_name='metrics'
+    )
+    bucket_start = models.DateTimeField()
+    busy_seconds = models.FloatField(default=0)
+    idle_seconds = models.FloatField(default=0)
+    served = models.PositiveIntegerField(default=0)
+    handle_seconds = models.FloatField(default=0, help_text="Total time spent on served customers")
+
+    def __str__(self):
+        return f"{self.window.name} @ {self.bucket_start:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        ordering = ['-bucket_start']
+        unique_together = ['window', 'bucket_start']
+        indexes = [
+            models.Index(fields=['bucket_start']),
+        ]
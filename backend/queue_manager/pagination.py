@@ -0,0 +1,145 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+from .archive import archive_horizon
+
+
+class HistoryKeysetPagination:
+    """
+    Cursor pagination over a user's queue history, newest first.
+
+    Pages are cut on ``(join_time, id)`` instead of an offset: the cursor
+    holds the last key served and the next page starts strictly below it,
+    so every page is an index range scan on ``(user, join_time, id)`` and
+    costs the same however long the history is. The page's keys are read
+    first from the index alone; the returned queryset is then limited to
+    those ids and can be rendered either by a serializer or by a projection.
+
+    Archived queues keep their ids and join times, so the same keys page
+    through both tables. The archive is only read when a page reaches back
+    to the newest archived queue.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('-join_time', '-id')
+
+    def __init__(self):
+        self.next_cursor = None
+        self.request = None
+        self.size = None
+
+    @property
+    def page_size(self):
+        return getattr(settings, 'QUEUE_HISTORY_PAGE_SIZE', 20)
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'QUEUE_HISTORY_MAX_PAGE_SIZE', 100)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    @staticmethod
+    def encode_cursor(join_time, pk):
+        return urlsafe_b64encode(f'{join_time.isoformat()}|{pk}'.encode()).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            join_time, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.fromisoformat(join_time), int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+
+    def is_first_page(self, request):
+        return not request.query_params.get(self.cursor_query_param)
+
+    def _after_cursor(self, queryset, request):
+        self.request = request
+        self.size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            join_time, pk = position
+            queryset = queryset.filter(Q(join_time__lt=join_time) | Q(join_time=join_time, pk__lt=pk))
+        return queryset
+
+    def reaches_archive(self, rows, join_time=itemgetter('join_time')):
+        """
+        Whether archived queues can belong on a page whose live rows, fetched
+        with one to spare, are ``rows``: only if the live table ran out first
+        or the page reaches back to the newest archived queue
+        """
+        horizon = archive_horizon()
+        if horizon is None:
+            return False
+        if len(rows) <= self.size:
+            return True
+        return sorted(map(join_time, rows), reverse=True)[self.size] <= horizon
+
+    def paginate_queryset(self, queryset, request, archive=None):
+        """
+        Limit ``queryset`` to the requested page, in history order. Given the
+        matching ``archive`` queryset, the page continues into archived
+        queues where they belong and comes back as a list of both kinds
+        """
+        keys = list(self._after_cursor(queryset, request).values_list('join_time', 'pk')[:self.size + 1])
+        if archive is None or not self.reaches_archive(keys, join_time=itemgetter(0)):
+            keys = self.trim(keys, key=lambda key: key)
+            return queryset.order_by(*self.ordering).filter(pk__in=[pk for _, pk in keys])
+
+        live = {pk for _, pk in keys}
+        keys += self._after_cursor(archive, request).values_list('join_time', 'pk')[:self.size + 1]
+        page = {pk for _, pk in self.trim(keys, key=lambda key: key)}
+        rows = [*queryset.filter(pk__in=page & live), *archive.filter(pk__in=page - live)]
+        return sorted(rows, key=lambda row: (row.join_time, row.pk), reverse=True)
+
+    def page_keys(self, queryset, request):
+        """
+        Subquery of the ids on the requested page plus one more, for callers
+        that fetch the page together with other rows and then ``trim()`` it
+        """
+        return self._after_cursor(queryset, request).values('pk')[:self.size + 1]
+
+    def extend_from_archive(self, rows, archive, request, fetch):
+        """
+        Add the archived rows that belong on the page to ``rows``, the live
+        ones read through ``page_keys``, before they are ``trim()``-ed.
+        ``fetch`` reads a queryset the same way ``rows`` were read.
+        """
+        if not self.reaches_archive(rows):
+            return rows
+        return rows + fetch(self._after_cursor(archive, request)[:self.size + 1])
+
+    def trim(self, rows, key=lambda row: (row['join_time'], row['id'])):
+        """Put a fetched page in history order and cut off the row that signals a next page"""
+        rows = sorted(rows, key=key, reverse=True)
+        if len(rows) > self.size:
+            rows = rows[:self.size]
+            self.next_cursor = self.encode_cursor(*key(rows[-1]))
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def add_link_header(self, response):
+        next_link = self.get_next_link()
+        if next_link:
+            response['Link'] = f'<{next_link}>; rel="next"'
+        return response
@@ -0,0 +1,142 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .archive import archive_horizon
+from .models import DailyQueueStats, Queue, QueueArchive
+from .routers import primary_reads
+from .signals import queue_status_changed
+
+# Each queue status has a counter column of the same name
+STATUS_COLUMNS = {'waiting', 'processing', 'completed', 'cancelled'}
+
+
+def aggregate_day(user_id, date):
+    """
+    Count one user's queues joined on ``date`` with a single conditional
+    aggregate, plus one over the archive if that day may have been archived
+    """
+    totals = _aggregate_day(Queue.objects.filter(user=user_id, join_time__date=date))
+    horizon = archive_horizon()
+    if horizon is not None and date <= timezone.localdate(horizon):
+        archived = _aggregate_day(QueueArchive.objects.filter(user=user_id, join_time__date=date))
+        totals = {column: value + archived[column] for column, value in totals.items()}
+    return totals
+
+
+def _aggregate_day(queryset):
+    completed = Q(status='completed')
+    waited = completed & Q(wait_seconds__isnull=False)
+    served = completed & Q(service_seconds__isnull=False)
+
+    totals = queryset.aggregate(
+        joined=Count('id'),
+        waiting=Count('id', filter=Q(status='waiting')),
+        processing=Count('id', filter=Q(status='processing')),
+        completed=Count('id', filter=completed),
+        cancelled=Count('id', filter=Q(status='cancelled')),
+        priority=Count('id', filter=Q(priority=True)),
+        wait_total=Coalesce(Sum('wait_seconds', filter=waited), 0.0),
+        waits=Count('id', filter=waited),
+        service_total=Coalesce(Sum('service_seconds', filter=served), 0.0),
+        services=Count('id', filter=served),
+    )
+    totals['wait_seconds'] = totals.pop('wait_total')
+    totals['service_seconds'] = totals.pop('service_total')
+    return totals
+
+
+def rebuild_day(user_id, date):
+    """Recompute a user's rollup row for ``date`` from the queue table"""
+    # Never from a replica that may be behind, as the row is stored
+    with primary_reads():
+        totals = aggregate_day(user_id, date)
+    stats, _ = DailyQueueStats.objects.update_or_create(
+        user_id=user_id,
+        date=date,
+        defaults=totals
+    )
+    return stats
+
+
+def day_stats(user_id, date):
+    """A user's rollup row for ``date``, built on first use"""
+    stats = DailyQueueStats.objects.filter(user=user_id, date=date).first()
+    if stats is None:
+        stats = rebuild_day(user_id, date)
+    return stats
+
+
+def _update(column, delta):
+    if delta > 0:
+        return F(column) + delta
+    # Rows written without signals (bulk_create, raw SQL) were never counted,
+    # so their transitions must not take a counter below zero
+    return Greatest(F(column) + delta, 0, output_field=DailyQueueStats._meta.get_field(column))
+
+
+def _apply(queue, changes, create=True):
+    date = timezone.localdate(queue.join_time)
+    updates = {column: _update(column, delta) for column, delta in changes.items() if delta}
+    if not updates:
+        return
+    if DailyQueueStats.objects.filter(user=queue.user_id, date=date).update(**updates) or not create:
+        return
+
+    # First transition of the day: build the row from the table, which
+    # already includes this change since it runs in the same transaction
+    try:
+        with transaction.atomic():
+            rebuild_day(queue.user_id, date)
+    except IntegrityError:
+        DailyQueueStats.objects.filter(user=queue.user_id, date=date).update(**updates)
+
+
+def _completion_changes(queue, sign):
+    changes = {'completed': sign}
+    if queue.wait_seconds is not None:
+        changes['wait_seconds'] = sign * queue.wait_seconds
+        changes['waits'] = sign
+    if queue.service_seconds is not None:
+        changes['service_seconds'] = sign * queue.service_seconds
+        changes['services'] = sign
+    return changes
+
+
+def _status_changes(queue, status, sign):
+    if status == 'completed':
+        return _completion_changes(queue, sign)
+    if status in STATUS_COLUMNS:
+        return {status: sign}
+    return {}
+
+
+@receiver(queue_status_changed)
+def record_transition(sender, queue, previous_status, **kwargs):
+    if previous_status is None:
+        changes = {'joined': 1, 'priority': 1 if queue.priority else 0}
+    else:
+        changes = _status_changes(queue, previous_status, -1)
+
+    for column, delta in _status_changes(queue, queue.status, 1).items():
+        changes[column] = changes.get(column, 0) + delta
+    _apply(queue, changes)
+
+
+@receiver(post_save, sender=Queue)
+def record_priority_change(sender, instance, created, **kwargs):
+    # Queue.save() updates _previous_priority only after post_save has run
+    previous = getattr(instance, '_previous_priority', instance.priority)
+    if not created and previous is not None and instance.priority != previous:
+        _apply(instance, {'priority': 1 if instance.priority else -1})
+
+
+@receiver(post_delete, sender=Queue)
+def record_deletion(sender, instance, **kwargs):
+    changes = {'joined': -1, 'priority': -1 if instance.priority else 0}
+    changes.update(_status_changes(instance, instance.status, -1))
+    # Never create a row here: the user itself may be being deleted
+    _apply(instance, changes, create=False)
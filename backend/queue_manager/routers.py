@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Queue
+from .signals import queue_status_changed
+
+# Alias reads are sent to inside ``replica_reads()``, or None when unset
+_read_alias = ContextVar('replica_read_alias', default=None)
+
+
+def replica_alias():
+    """The configured replica alias, or ``None`` if there is no such database"""
+    alias = getattr(settings, 'QUEUE_REPLICA_DATABASE', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+def read_after_write_seconds():
+    return getattr(settings, 'READ_AFTER_WRITE_SECONDS', 10)
+
+
+def pin_key(user_id):
+    return f'db-pin:user:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Keep ``user_id``'s reads on the primary until the replica has their write"""
+    if user_id is not None and replica_alias():
+        cache.set(pin_key(user_id), True, read_after_write_seconds())
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(pin_key(user_id), False)
+
+
+def changed_recently(timestamp_ms):
+    """Whether something stamped at ``timestamp_ms`` may not have replicated yet"""
+    return time.time() * 1000 - timestamp_ms < read_after_write_seconds() * 1000
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    """
+    Send the reads made inside the block to the replica, unless there is
+    none or ``user_id`` wrote something recently enough that the replica
+    may not show it yet.
+    """
+    alias = replica_alias()
+    if alias is None or is_pinned(user_id):
+        yield DEFAULT_DB_ALIAS
+        return
+
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, e.g. to build a row that gets written back"""
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Routes reads to the replica inside ``replica_reads()`` and everything
+    else, writes included, to the primary. Reads are only moved where a
+    view opts in, since dispatch, locking and ticket numbering must see
+    their own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so their rows relate freely
+        aliases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+@receiver(queue_status_changed)
+def pin_queue_owner(sender, queue, previous_status, **kwargs):
+    # Also covers a provider moving someone else's queue: the owner sees it next
+    user_id = queue.user_id
+    transaction.on_commit(lambda: pin_to_primary(user_id))
+
+
+@receiver(post_delete, sender=Queue)
+def pin_deleted_queue_owner(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: pin_to_primary(user_id))
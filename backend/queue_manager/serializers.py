@@ -2,13 +2,17 @@ from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AnonymousUser
 from .models import User, ServiceCategory, Service, Queue, Window
+from .estimators import estimator
+from .eta import eta_cache
 
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import cache_user
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
         data = super().validate(attrs)
+        cache_user(self.user)  # the client's first authenticated call is a cache hit
         
         refresh = self.get_token(self.user)
         
@@ -25,6 +29,102 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 from django.core.validators import MinLengthValidator, RegexValidator
 
+
+def parse_field_paths(value):
+    """
+    Turn ``"service,service.provider,id"`` into a tree of nested names,
+    ``{'service': {'provider': {}}, 'id': {}}``
+    """
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class ExpandableFieldsMixin:
+    """
+    Renders related objects as primary keys unless they are asked for.
+
+    ``?expand=service,service.provider`` embeds the listed relations (dotted
+    names reach into the embedded serializer) and ``?fields=id,status``
+    trims the response to the listed fields. The top-level serializer reads
+    both from the request; nested serializers receive their branch through
+    the ``expand`` and ``fields`` keyword arguments.
+
+    ``expandable_fields`` maps a field name to the serializer class that
+    embeds it and extra keyword arguments such as ``many=True``;
+    ``select_always`` names relations the serializer reads even when they
+    are not expanded.
+    """
+    expandable_fields = {}
+    select_always = ()
+
+    def __init__(self, *args, expand=None, fields=None, **kwargs):
+        self._expand = expand
+        self._only = fields
+        super().__init__(*args, **kwargs)
+
+    def _requested(self, name, param):
+        value = getattr(self, name)
+        if value is None:
+            request = self.context.get('request')
+            value = parse_field_paths(request.query_params.get(param)) if request else {}
+            setattr(self, name, value)
+        return value
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand = self._requested('_expand', 'expand')
+        only = self._requested('_only', 'fields')
+
+        for name, (serializer_class, options) in self.expandable_fields.items():
+            if name in expand:
+                fields[name] = serializer_class(
+                    read_only=True, expand=expand[name], fields=only.get(name, {}), **options
+                )
+            else:
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True, many=options.get('many', False)
+                )
+
+        if only:
+            for name in list(fields):
+                if name not in only and not fields[name].write_only:
+                    del fields[name]
+        return fields
+
+    @classmethod
+    def optimize_queryset(cls, queryset, expand, prefix='', prefetch=False):
+        """
+        Add the ``select_related``/``prefetch_related`` calls needed to
+        serialize ``queryset`` with the given expansion tree
+        """
+        def relate(queryset, path):
+            # Below a to-many relation every join has to be prefetched instead
+            if prefetch:
+                return queryset.prefetch_related(path)
+            return queryset.select_related(path)
+
+        for name in cls.select_always:
+            queryset = relate(queryset, prefix + name)
+
+        for name, (serializer_class, options) in cls.expandable_fields.items():
+            many = options.get('many', False)
+            if many:
+                # Primary keys of a to-many relation still take one query
+                queryset = queryset.prefetch_related(prefix + name)
+            if name in expand:
+                if not many:
+                    queryset = relate(queryset, prefix + name)
+                queryset = serializer_class.optimize_queryset(
+                    queryset, expand[name], prefix=f'{prefix}{name}__', prefetch=prefetch or many
+                )
+        return queryset
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(
         write_only=True,
@@ -68,7 +168,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         )
         return user
 
-class UserDetailSerializer(serializers.ModelSerializer):
+class UserDetailSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
@@ -84,57 +184,77 @@ class UserDetailSerializer(serializers.ModelSerializer):
         return super().to_representation(instance)
 
 # Service Serializers
-class ServiceCategorySerializer(serializers.ModelSerializer):
+class ServiceCategorySerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ServiceCategory
         fields = ['id', 'name', 'description', 'icon']
 
-class ServiceSerializer(serializers.ModelSerializer):
-    category = ServiceCategorySerializer(read_only=True)
+class ServiceSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=ServiceCategory.objects.all(), 
         source='category', 
         write_only=True
     )
-    provider = UserDetailSerializer(read_only=True)
+    estimated_service_time = serializers.SerializerMethodField()
 
     class Meta:
         model = Service
         fields = [
             'id', 'name', 'description', 'category', 'category_id',
             'provider', 'status', 'average_service_time',
-            'created_at', 'updated_at'
+            'estimated_service_time', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
 
+    expandable_fields = {
+        'category': (ServiceCategorySerializer, {}),
+        'provider': (UserDetailSerializer, {}),
+    }
+
+    def get_estimated_service_time(self, obj):
+        """Learned average service time in minutes"""
+        return round(estimator.estimate(obj) / 60, 1)
+
 # Queue Serializers
-class QueueSerializer(serializers.ModelSerializer):
-    user = UserDetailSerializer(read_only=True)
-    service = ServiceSerializer(read_only=True)
+class QueueSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     service_id = serializers.PrimaryKeyRelatedField(
         queryset=Service.objects.all(), 
         source='service', 
         write_only=True
     )
+    position = serializers.SerializerMethodField()
     wait_time = serializers.SerializerMethodField()
+    eta = serializers.SerializerMethodField()
 
     class Meta:
         model = Queue
         fields = [
-            'id', 'user', 'service', 'service_id', 'join_time',
+            'id', 'user', 'service', 'service_id', 'ticket_number', 'join_time',
             'start_time', 'end_time', 'status', 'position',
-            'priority', 'notes', 'wait_time'
+            'priority', 'notes', 'wait_time', 'eta'
         ]
-        read_only_fields = ['join_time', 'start_time', 'end_time', 'position']
+        read_only_fields = ['ticket_number', 'join_time', 'start_time', 'end_time']
+
+    expandable_fields = {
+        'user': (UserDetailSerializer, {}),
+        'service': (ServiceSerializer, {}),
+    }
+    select_always = ('service',)  # the ETA projection needs the service row
+
+    def get_position(self, obj):
+        return obj.get_position()
 
     def get_wait_time(self, obj):
         return obj.get_wait_time()
 
+    def get_eta(self, obj):
+        """Projected time this ticket will be called, if it is still waiting"""
+        if obj.status != 'waiting':
+            return None
+        return eta_cache.for_service(obj.service).get(obj.id)
+
 # Window Serializers
-class WindowSerializer(serializers.ModelSerializer):
-    service_provider = UserDetailSerializer(read_only=True)
-    current_queue = QueueSerializer(read_only=True)
-    services = ServiceSerializer(many=True, read_only=True)
+class WindowSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     service_ids = serializers.PrimaryKeyRelatedField(
         queryset=Service.objects.all(),
         source='services',
@@ -149,4 +269,9 @@ class WindowSerializer(serializers.ModelSerializer):
             'current_queue', 'services', 'service_ids',
             'location', 'last_active'
         ]
-        read_only_fields = ['last_active']
\ No newline at end of file
+        read_only_fields = ['last_active']
+    expandable_fields = {
+        'service_provider': (UserDetailSerializer, {}),
+        'current_queue': (QueueSerializer, {}),
+        'services': (ServiceSerializer, {'many': True}),
+    }
@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Sent whenever a queue changes status, inside the transaction that made the
+# change. Arguments: ``queue`` and ``previous_status`` (``None`` on join).
+queue_status_changed = Signal()
+
+# Sent whenever a window changes status or current queue. Arguments:
+# ``window``, ``previous_status``, ``previous_queue_id`` and
+# ``previous_status_since`` (when the previous state began).
+window_status_changed = Signal()
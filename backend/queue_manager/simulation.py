@@ -0,0 +1,275 @@
+import heapq
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .dispatch import dispatch_key, match_windows
+from .estimators import estimator
+
+DEFAULT_PERCENTILES = (50, 90, 95, 99)
+
+# Fewer completed queues than this and a service's history is too thin to
+# resample, so its durations are drawn around the estimated mean instead
+MIN_HISTORY_SAMPLES = 30
+
+
+class ServiceProfile:
+    """
+    Demand for one service: Poisson arrivals at ``arrivals_per_hour``, a
+    ``priority_share`` of them priority tickets, and service durations.
+
+    ``service_seconds`` is either a mean, drawn from as an exponential
+    distribution, or an array of observed durations that is resampled.
+    """
+
+    def __init__(self, service_id, arrivals_per_hour, service_seconds, priority_share=0.0):
+        self.service_id = service_id
+        self.arrivals_per_hour = float(arrivals_per_hour)
+        self.service_seconds = np.asarray(service_seconds, dtype=float)
+        self.priority_share = float(priority_share)
+
+    def sample_durations(self, rng, size):
+        if self.service_seconds.ndim == 0:
+            return rng.exponential(float(self.service_seconds), size)
+        return rng.choice(self.service_seconds, size)
+
+
+def service_profiles(arrivals_per_hour, priority_share=0.0, history_days=30):
+    """
+    ``ServiceProfile``s for the services in ``arrivals_per_hour`` (a map of
+    service id to rate), with durations resampled from the last
+    ``history_days`` of completed queues where there are enough of them and
+    otherwise from the estimator's mean, which falls back to the service's
+    ``average_service_time``.
+    """
+    from .models import Queue, Service
+
+    since = timezone.now() - timedelta(days=history_days)
+    history = {}
+    for service_id, seconds in Queue.objects.filter(
+        service__in=list(arrivals_per_hour),
+        status='completed',
+        service_seconds__isnull=False,
+        join_time__gte=since
+    ).order_by().values_list('service_id', 'service_seconds'):
+        history.setdefault(service_id, []).append(seconds)
+
+    profiles = []
+    for service in Service.objects.filter(pk__in=list(arrivals_per_hour)).order_by('pk'):
+        observed = history.get(service.id, [])
+        durations = observed if len(observed) >= MIN_HISTORY_SAMPLES else estimator.estimate(service)
+        profiles.append(ServiceProfile(service.id, arrivals_per_hour[service.id], durations, priority_share))
+    return profiles
+
+
+def window_config(queryset=None):
+    """
+    ``(window_id, direct_service_ids, provider_service_ids)`` for every staffed
+    window, the shape ``simulate()`` and ``match_windows()`` take. Copy or
+    drop entries to describe other staffing scenarios.
+    """
+    from .models import Service, Window
+
+    if queryset is None:
+        queryset = Window.objects.filter(status__in=['available', 'busy'])
+    windows = list(queryset.order_by('pk').values_list('id', 'service_provider_id'))
+
+    direct = {}
+    for window_id, service_id in Window.services.through.objects.filter(
+        window__in=[window_id for window_id, _ in windows]
+    ).values_list('window_id', 'service_id'):
+        direct.setdefault(window_id, set()).add(service_id)
+
+    provided = {}
+    for service_id, provider_id in Service.objects.filter(
+        provider__in={provider_id for _, provider_id in windows if provider_id}
+    ).values_list('id', 'provider_id'):
+        provided.setdefault(provider_id, set()).add(service_id)
+
+    return [
+        (window_id, direct.get(window_id, set()), provided.get(provider_id, set()))
+        for window_id, provider_id in windows
+    ]
+
+
+def sample_arrivals(profiles, hours, rng):
+    """
+    One day of tickets as arrays sorted by arrival: ``(times, service_ids,
+    priorities, ticket_numbers, durations)``.
+
+    Arrival counts are Poisson and, given the count, arrival times uniform
+    over the day, so every service is sampled with a few array operations
+    instead of drawing one inter-arrival gap at a time.
+    """
+    horizon = hours * 3600
+    counts = rng.poisson([profile.arrivals_per_hour * hours for profile in profiles])
+    total = int(counts.sum())
+
+    owner = np.repeat(np.arange(len(profiles)), counts)
+    times = rng.uniform(0, horizon, total)
+    # Ticket numbers follow arrival order within each service
+    by_service = np.lexsort((times, owner))
+    owner, times = owner[by_service], times[by_service]
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    tickets = np.arange(total) - first + 1
+
+    shares = np.array([profile.priority_share for profile in profiles])
+    priorities = rng.random(total) < shares[owner]
+    durations = np.empty(total)
+    for index, profile in enumerate(profiles):
+        durations[owner == index] = profile.sample_durations(rng, counts[index])
+
+    service_ids = np.array([profile.service_id for profile in profiles])[owner] if total else np.empty(0, dtype=int)
+    order = np.argsort(times, kind='stable')
+    return times[order], service_ids[order], priorities[order], tickets[order], durations[order]
+
+
+def _pop_next(heaps, service_ids):
+    # QueueDispatcher.pop_next: heads of different services compare by
+    # priority, then by join time, since ticket numbers are per service
+    best = None
+    for service_id in service_ids:
+        heap = heaps.get(service_id)
+        if heap and (best is None or (heap[0][0], heap[0][2]) < (best[0][0], best[0][2])):
+            best = heap
+    return heapq.heappop(best)[-1] if best else None
+
+
+def simulate(windows, arrivals):
+    """
+    Serve one sampled day of ``arrivals`` with ``windows``.
+
+    A ticket that arrives while windows are free is matched to one by
+    ``match_windows()``, as in ``assign_to_available_window``; otherwise it
+    waits in its service's heap under ``dispatch_key()``. A window that
+    finishes pulls the best ticket it is eligible for, as in
+    ``Window.assign_next_queue``, or becomes free. Windows keep serving
+    after closing time until nothing they can serve is left waiting.
+
+    Returns ``(start_times, busy_seconds)``: the time each ticket was
+    called (NaN if no window serves its service) and the seconds each
+    window spent serving.
+    """
+    # Plain lists: indexing NumPy arrays one element at a time is slow
+    times, service_ids, priorities, tickets, durations = (column.tolist() for column in arrivals)
+    direct = {window_id: set(services) for window_id, services, _ in windows}
+    eligible = {window_id: set(services) | set(provided) for window_id, services, provided in windows}
+    provided = {window_id: eligible[window_id] - direct[window_id] for window_id in eligible}
+    servers = {}
+    for window_id, services in eligible.items():
+        for service_id in services:
+            servers.setdefault(service_id, []).append(window_id)
+
+    starts = np.full(len(times), np.nan)
+    busy_seconds = dict.fromkeys(eligible, 0.0)
+    free_since = dict.fromkeys(eligible, 0.0)
+    heaps = {}
+    completions = []
+
+    def start(index, window_id, now):
+        starts[index] = now
+        busy_seconds[window_id] += durations[index]
+        heapq.heappush(completions, (now + durations[index], window_id))
+
+    arrival = 0
+    while arrival < len(times) or completions:
+        if completions and (arrival == len(times) or completions[0][0] <= times[arrival]):
+            now, window_id = heapq.heappop(completions)
+            index = _pop_next(heaps, eligible[window_id])
+            if index is None:
+                free_since[window_id] = now
+            else:
+                start(index, window_id, now)
+            continue
+
+        index, now, service_id = arrival, times[arrival], service_ids[arrival]
+        arrival += 1
+        free = [window_id for window_id in servers.get(service_id, ()) if window_id in free_since]
+        if len(free) > 1:
+            pairs = match_windows(
+                ((window_id, direct[window_id], provided[window_id], free_since[window_id]) for window_id in free),
+                [(index, service_id)]
+            )
+            free = [pairs[0][0]]
+        if free:
+            window_id = free[0]
+            del free_since[window_id]
+            start(index, window_id, now)
+        else:
+            entry = (*dispatch_key(priorities[index], tickets[index]), now, index)
+            heapq.heappush(heaps.setdefault(service_id, []), entry)
+
+    return starts, busy_seconds
+
+
+def wait_summary(waits, percentiles=DEFAULT_PERCENTILES):
+    """Count, average, maximum and percentiles of wait times in seconds"""
+    waits = np.asarray(waits, dtype=float)
+    if not waits.size:
+        return {'count': 0, 'average': None, 'maximum': None, 'percentiles': {str(p): None for p in percentiles}}
+    return {
+        'count': int(waits.size),
+        'average': float(waits.mean()),
+        'maximum': float(waits.max()),
+        'percentiles': {str(p): float(value) for p, value in zip(percentiles, np.percentile(waits, percentiles))},
+    }
+
+
+def sweep(scenarios, profiles, hours=8, replications=1, seed=None, percentiles=DEFAULT_PERCENTILES):
+    """
+    Simulate ``replications`` days for every staffing scenario in
+    ``scenarios`` (a map of name to ``window_config()``-style windows) and
+    report wait percentiles and window utilization for each.
+
+    Every scenario is run on the same sampled days, so differences between
+    them come from the staffing rather than from sampling noise.
+    """
+    rng = np.random.default_rng(seed)
+    days = [sample_arrivals(profiles, hours, rng) for _ in range(replications)]
+    horizon = hours * 3600
+
+    reports = {}
+    for name, windows in scenarios.items():
+        waits, waited_for, priority_waits, unserved = [], [], [], 0
+        busy = dict.fromkeys((window[0] for window in windows), 0.0)
+        open_seconds = 0.0
+        overtime = []
+        for day in days:
+            times, service_ids, priorities, _, durations = day
+            starts, busy_seconds = simulate(windows, day)
+            served = ~np.isnan(starts)
+            unserved += int((~served).sum())
+            waits.append(starts[served] - times[served])
+            waited_for.append(service_ids[served])
+            priority_waits.append(priorities[served])
+
+            closed = float(np.nanmax(starts + durations, initial=horizon))
+            overtime.append(closed - horizon)
+            open_seconds += closed
+            for window_id, seconds in busy_seconds.items():
+                busy[window_id] += seconds
+
+        waits = np.concatenate(waits)
+        waited_for = np.concatenate(waited_for)
+        priority_waits = np.concatenate(priority_waits)
+        utilization = {window_id: seconds / open_seconds for window_id, seconds in busy.items()}
+        reports[name] = {
+            'tickets': int(waits.size) + unserved,
+            'unserved': unserved,
+            'wait_seconds': wait_summary(waits, percentiles),
+            'priority_wait_seconds': wait_summary(waits[priority_waits], percentiles),
+            'service_wait_seconds': {
+                profile.service_id: wait_summary(waits[waited_for == profile.service_id], percentiles)
+                for profile in profiles
+            },
+            'utilization': utilization,
+            'average_utilization': float(np.mean(list(utilization.values()))) if utilization else None,
+            'overtime_seconds': float(np.mean(overtime)),
+        }
+    return reports
+
+
+def simulate_day(windows, profiles, hours=8, replications=1, seed=None, percentiles=DEFAULT_PERCENTILES):
+    """``sweep()`` for a single window configuration"""
+    return sweep({None: windows}, profiles, hours, replications, seed, percentiles)[None]
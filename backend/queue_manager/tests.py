@@ -1,3 +1,1330 @@
-from django.test import TestCase
+import json
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, resolve
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .archive import archive_horizon, horizon_key
+from .authentication import CachedJWTAuthentication, user_cache_key
+from .broadcast import AdvanceCoalescer
+from .catalog import VERSION_KEY
+from .dispatch import dispatcher, match_windows
+from .eta import eta_cache
+from .estimators import ServiceTimeEstimator, estimator
+from .metrics import window_stats
+from .middleware import JWTAuthMiddleware
+from .models import (
+    User, ServiceCategory, Service, Queue, QueueArchive, Window, DailyQueueStats, ServiceTimeEstimate,
+    TicketCounter
+)
+from .projections import project
+from .rollups import rebuild_day
+from .routing import websocket_urlpatterns
+from .serializers import QueueSerializer, WindowSerializer
+from .simulation import ServiceProfile, service_profiles, simulate, sweep, window_config
+from . import dispatch, urls
+
+
+class ProjectionCompatibilityTests(TestCase):
+    """The .values() fast path must render exactly what the serializers do"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        cls.provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        category = ServiceCategory.objects.create(name='Licensing', icon='id-card')
+        cls.services = [
+            Service.objects.create(name=f'Service {i}', provider=cls.provider, category=category)
+            for i in range(3)
+        ]
+        for i in range(3):
+            window = Window.objects.create(name=f'Window {i}', service_provider=cls.provider)
+            window.services.add(*cls.services[:i + 1])
+        for i in range(12):
+            Queue.objects.create(user=cls.customer, service=cls.services[i % 3], priority=i % 5 == 0)
+
+        Window.objects.get(name='Window 0').assign_next_queue()
+        served = Queue.objects.filter(status='waiting').first()
+        served.status = 'completed'
+        served.start_time = served.join_time
+        served.end_time = timezone.now()
+        served.save()
+
+    def assertSameRepresentation(self, queryset, serializer_class, expand=None, fields=None):
+        expand, fields = expand or {}, fields or {}
+        renderer = JSONRenderer()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now()):
+            expected = serializer_class(
+                serializer_class.optimize_queryset(queryset, expand),
+                many=True, expand=expand, fields=fields
+            ).data
+            actual = project(queryset, serializer_class, expand, fields)
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+    def test_queues(self):
+        queues = Queue.objects.with_position()
+        self.assertSameRepresentation(queues, QueueSerializer)
+        self.assertSameRepresentation(
+            queues, QueueSerializer, expand={'user': {}, 'service': {'provider': {}, 'category': {}}}
+        )
+        self.assertSameRepresentation(
+            queues, QueueSerializer,
+            expand={'service': {}}, fields={'id': {}, 'position': {}, 'service': {'name': {}}}
+        )
+
+    def test_windows(self):
+        windows = Window.objects.all()
+        self.assertSameRepresentation(windows, WindowSerializer)
+        self.assertSameRepresentation(
+            windows, WindowSerializer,
+            expand={'service_provider': {}, 'current_queue': {'service': {}}, 'services': {'category': {}}}
+        )
+        self.assertSameRepresentation(
+            windows, WindowSerializer, expand={'services': {}}, fields={'id': {}, 'services': {'name': {}}}
+        )
+
+
+class TicketCounterTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        self.services = [Service.objects.create(name=f'Service {i}', provider=provider) for i in range(2)]
+
+    def test_numbers_are_sequential_per_service(self):
+        for i in range(6):
+            Queue.objects.create(user=self.customer, service=self.services[i % 2])
+        for service in self.services:
+            with self.subTest(service=service.name):
+                numbers = Queue.objects.filter(service=service).order_by('id').values_list('ticket_number', flat=True)
+                self.assertEqual(list(numbers), [1, 2, 3])
+        self.assertEqual(TicketCounter.reserve(self.services[0], 2), range(4, 6))
+        self.assertEqual(TicketCounter.next_number(self.services[1]), 4)
+
+    def test_service_without_counter_row(self):
+        service = self.services[0]
+        TicketCounter.objects.filter(service=service).delete()
+        self.assertEqual(TicketCounter.reserve(service, 3), range(1, 4))
+        self.assertEqual(TicketCounter.objects.get(service=service).last_number, 3)
+        self.assertEqual(TicketCounter.next_number(service), 4)
+
+
+class QueuePositionTests(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        service = Service.objects.create(name='Service', provider=provider)
+        other = Service.objects.create(name='Other', provider=provider)
+        self.queues = {
+            name: Queue.objects.create(user=customer, service=service, priority=name.startswith('priority'))
+            for name in ('regular 1', 'priority 1', 'regular 2', 'priority 2')
+        }
+        Queue.objects.create(user=customer, service=other, priority=True)
+
+    def positions(self):
+        annotated = dict(Queue.objects.with_position().values_list('id', 'queue_position'))
+        positions = {}
+        for name, queue in self.queues.items():
+            queue.refresh_from_db()
+            self.assertEqual(queue.get_position(), annotated[queue.id], name)
+            positions[name] = annotated[queue.id]
+        return positions
+
+    def test_priority_first_then_ticket_order(self):
+        self.assertEqual(self.positions(), {'priority 1': 1, 'priority 2': 2, 'regular 1': 3, 'regular 2': 4})
+
+        queue = self.queues['priority 1']
+        queue.status = 'completed'
+        queue.start_time = queue.end_time = timezone.now()
+        queue.save()
+        self.assertEqual(self.positions(), {'priority 1': None, 'priority 2': 1, 'regular 1': 2, 'regular 2': 3})
+
+
+@override_settings(QUEUE_HISTORY_PAGE_SIZE=20)
+class MyQueuesQueryCountTests(TestCase):
+    """my_queues costs the same handful of queries however many queues a user has"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        cls.services = [
+            Service.objects.create(name=f'Service {i}', provider=provider) for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def add_queues(self, count):
+        for i in range(count):
+            service = self.services[i % len(self.services)]
+            completed = Queue.objects.create(user=self.customer, service=service)
+            completed.status = 'completed'
+            completed.start_time = completed.end_time = timezone.now()
+            completed.save()
+            Queue.objects.create(user=self.customer, service=service, priority=i % 2 == 0)
+
+    def test_query_count_is_constant(self):
+        self.add_queues(3)
+        self.client.get('/api/queues/my_queues/?expand=service')  # warm the ETA and estimator caches
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/queues/my_queues/?expand=service')
+        self.assertEqual(len(response.data['waiting']), 3)
+
+        self.add_queues(30)
+        self.client.get('/api/queues/my_queues/?expand=service')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/queues/my_queues/?expand=service')
+        self.assertEqual(len(response.data['waiting']), 33)
+        self.assertEqual(len(response.data['completed']), 20)
+        self.assertIsNotNone(response.data['next'])
+
+
+@override_settings(QUEUE_HISTORY_PAGE_SIZE=3, QUEUE_REPLICA_DATABASE=None)
+class QueueListTests(TestCase):
+    def test_finished_queues_are_paginated(self):
+        customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        service = Service.objects.create(name='Service', provider=provider)
+        waiting = Queue.objects.create(user=customer, service=service)
+        for status in ['cancelled'] * 5 + ['completed'] * 2:
+            queue = Queue.objects.create(user=customer, service=service)
+            queue.status = status
+            queue.save()
+
+        client = APIClient()
+        client.force_authenticate(customer)
+        response = client.get('/api/queues/')
+        self.assertEqual([row['id'] for row in response.data if row['status'] == 'waiting'], [waiting.id])
+        self.assertEqual(len(response.data), 4)
+        self.assertIn('rel="next"', response['Link'])
+
+        seen = {row['id'] for row in response.data}
+        while 'Link' in response:
+            response = client.get(response['Link'][1:].split('>')[0])
+            seen |= {row['id'] for row in response.data}
+        self.assertEqual(seen, set(Queue.objects.filter(user=customer).values_list('id', flat=True)))
+
+
+@override_settings(QUEUE_REPLICA_DATABASE=None)
+class QueueETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        self.queue = Queue.objects.create(
+            user=self.customer, service=Service.objects.create(name='Service', provider=provider)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_edit_without_transition_changes_tag(self):
+        for path in ('/api/queues/my_queues/', f'/api/queues/{self.queue.id}/'):
+            with self.subTest(path=path):
+                etag = self.client.get(path)['ETag']
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.patch(f'/api/queues/{self.queue.id}/', {'notes': path}, format='json')
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_tags_only_match_their_resource(self):
+        etag = self.client.get(f'/api/queues/{self.queue.id}/')['ETag']
+        self.assertEqual(self.client.get('/api/queues/999999/', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+        self.assertEqual(self.client.get('/api/queues/my_queues/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        listed = self.client.get('/api/queues/my_queues/')['ETag']
+        self.assertEqual(
+            self.client.get(f'/api/queues/{self.queue.id}/', HTTP_IF_NONE_MATCH=listed).status_code, 200
+        )
+
+    def test_window_changes_move_the_eta_tags(self):
+        for path in ('/api/queues/my_queues/', f'/api/queues/{self.queue.id}/'):
+            with self.subTest(path=path):
+                etag = self.client.get(path)['ETag']
+                with self.captureOnCommitCallbacks(execute=True):
+                    Window.objects.create(name=path, service_provider=self.queue.service.provider)
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_projections_have_their_own_tags(self):
+        plain = self.client.get('/api/queues/my_queues/')['ETag']
+        response = self.client.get('/api/queues/my_queues/?expand=service', HTTP_IF_NONE_MATCH=plain)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], plain)
+        self.assertEqual(
+            self.client.get('/api/queues/my_queues/?expand=service', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+            304
+        )
+
+
+class QueueDispatcherTests(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        service = Service.objects.create(name='Service', provider=provider)
+        self.window = Window.objects.create(name='Window', service_provider=provider)
+        self.tickets = [Queue.objects.create(user=customer, service=service) for _ in range(3)]
+        dispatcher.reset()
+        dispatcher.load()
+
+    def test_priority_change_moves_ticket(self):
+        last = self.tickets[-1]
+        last.priority = True
+        with self.captureOnCommitCallbacks(execute=True):
+            last.save()
+        self.assertEqual(dispatcher.pull_next(self.window).id, last.id)
+        self.assertEqual(dispatcher.pull_next(self.window).id, self.tickets[0].id)
+
+    def test_locked_ticket_stays_in_line(self):
+        lock_rows = dispatch.lock_rows
+        locked = []
+
+        def locked_once(queryset):
+            # The first ticket is held by a transaction that later rolls back
+            if not locked:
+                locked.append(True)
+                return []
+            return lock_rows(queryset)
+
+        with mock.patch('queue_manager.dispatch.lock_rows', side_effect=locked_once):
+            self.assertEqual(dispatcher.pull_next(self.window).id, self.tickets[1].id)
+        self.assertEqual(dispatcher.pull_next(self.window).id, self.tickets[0].id)
+
+
+class MatchWindowsTests(TestCase):
+    def test_specialised_windows_first(self):
+        windows = [(1, {7, 8, 9}, set(), 0), (2, {7}, set(), 5), (3, {7, 8}, set(), 0)]
+        self.assertEqual(match_windows(windows, [(100, 7), (101, 7), (102, 7)]), [(2, 100), (3, 101), (1, 102)])
+
+    def test_tickets_served_in_dispatch_order(self):
+        # One window for two tickets: the first in dispatch order takes it
+        self.assertEqual(match_windows([(1, {7}, set(), 0)], [(101, 7), (100, 7)]), [(1, 101)])
+        # A ticket no free window serves does not hold up the ones after it
+        self.assertEqual(match_windows([(1, {7}, set(), 0)], [(100, 8), (101, 7)]), [(1, 101)])
+
+    def test_provider_windows_as_fallback(self):
+        windows = [(1, set(), {7}, 0), (2, {7, 8, 9}, set(), 0)]
+        self.assertEqual(match_windows(windows, [(100, 7), (101, 7)]), [(2, 100), (1, 101)])
+        self.assertEqual(match_windows([(1, set(), {7}, 0)], [(100, 7)]), [(1, 100)])
+
+    def test_longest_idle_window_breaks_ties(self):
+        windows = [(1, {7}, set(), 20), (2, {7}, set(), 10)]
+        self.assertEqual(match_windows(windows, [(100, 7)]), [(2, 100)])
+
+
+@override_settings(QUEUE_REPLICA_DATABASE=None)
+class AssignAllQueuesTests(TestCase):
+    def test_ticket_claimed_concurrently_is_skipped(self):
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        service = Service.objects.create(name='Service', provider=provider)
+        first, second = (Queue.objects.create(user=customer, service=service) for _ in range(2))
+        windows = [Window.objects.create(name=f'Window {i}', service_provider=provider) for i in range(2)]
+        lock_rows = dispatch.lock_rows
+
+        def claimed_meanwhile(queryset):
+            # Another window takes the first ticket between the read and the write
+            ids = lock_rows(queryset)
+            if queryset.model is Queue:
+                Queue.objects.filter(pk=first.pk).update(status='processing', start_time=timezone.now())
+            return ids
+
+        client = APIClient()
+        client.force_authenticate(provider)
+        with mock.patch('queue_manager.views.lock_rows', side_effect=claimed_meanwhile):
+            response = client.post('/api/windows/assign-all/')
+
+        self.assertEqual([row['queue_id'] for row in response.data['assignments']], [second.id])
+        self.assertEqual(Window.objects.filter(current_queue=first).count(), 0)
+        self.assertEqual(Window.objects.filter(pk__in=[w.pk for w in windows], status='available').count(), 1)
+
+
+class ETACacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        self.service = Service.objects.create(name='Service', provider=provider)
+        Window.objects.create(name='Window', service_provider=provider)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first = Queue.objects.create(user=self.customer, service=self.service)
+
+    def test_projection_is_shared_until_the_line_moves(self):
+        etas = eta_cache.for_service(self.service)
+        with mock.patch.object(eta_cache, 'project') as project:
+            self.assertEqual(eta_cache.for_service(self.service), etas)
+            project.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = Queue.objects.create(user=self.customer, service=self.service)
+        self.assertEqual(set(eta_cache.for_service(self.service)), {self.first.id, second.id})
+
+    def test_window_changes_retire_every_projection(self):
+        eta_cache.for_service(self.service)
+        eta_cache.invalidate()
+        with mock.patch.object(eta_cache, 'project', return_value={}) as project:
+            eta_cache.for_service(self.service)
+            project.assert_called_once()
+
+
+@override_settings(QUEUE_REPLICA_DATABASE=None)
+class WindowStatsTests(TestCase):
+    def setUp(self):
+        self.provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        self.window = Window.objects.create(name='Window', service_provider=self.provider)
+        Window.objects.filter(pk=self.window.pk).update(status_since=timezone.now() - timedelta(minutes=30))
+
+    def test_open_interval_counts_up_to_now(self):
+        stats = window_stats(timezone.now() - timedelta(hours=2))
+        self.assertEqual([window['window'] for window in stats['windows']], [self.window.id])
+        self.assertAlmostEqual(stats['idle_minutes'], 30, delta=0.2)
+        self.assertEqual(stats['busy_minutes'], 0)
+
+    def test_hours_out_of_range(self):
+        client = APIClient()
+        client.force_authenticate(self.provider)
+        for hours in ('1e20', 'inf', 'nan', 'soon'):
+            with self.subTest(hours=hours):
+                self.assertEqual(client.get(f'/api/windows/stats/?hours={hours}').status_code, 400)
+
+
+@override_settings(QUEUE_REPLICA_DATABASE=None)
+class ServiceDurationsTests(TestCase):
+    def test_days_out_of_range(self):
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        service = Service.objects.create(name='Service', provider=provider)
+        client = APIClient()
+        client.force_authenticate(provider)
+        for days in ('0', '-3', '1000000000', '99999999999999999999', 'week'):
+            with self.subTest(days=days):
+                response = client.get(f'/api/services/{service.id}/durations/?days={days}')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.get(f'/api/services/{service.id}/durations/?days=30').status_code, 200)
+
+
+class BackfillQueueDurationsTests(TestCase):
+    def test_fills_missing_durations(self):
+        customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        service = Service.objects.create(name='Service', provider=provider)
+        joined = timezone.now() - timedelta(hours=1)
+        completed, serving, waiting = [Queue.objects.create(user=customer, service=service) for _ in range(3)]
+        Queue.objects.filter(pk=completed.pk).update(
+            status='completed', join_time=joined, start_time=joined + timedelta(minutes=10),
+            end_time=joined + timedelta(minutes=15, seconds=30)
+        )
+        Queue.objects.filter(pk=serving.pk).update(
+            status='processing', join_time=joined, start_time=joined + timedelta(minutes=20)
+        )
+        # As recorded before the columns existed
+        Queue.objects.update(wait_seconds=None, service_seconds=None)
+
+        out = StringIO()
+        call_command('backfill_queue_durations', chunk_size=2, stdout=out)
+
+        durations = dict(Queue.objects.values_list('pk', 'wait_seconds'))
+        self.assertEqual(durations, {completed.pk: 600.0, serving.pk: 1200.0, waiting.pk: None})
+        self.assertEqual(Queue.objects.get(pk=completed.pk).service_seconds, 330.0)
+        self.assertIsNone(Queue.objects.get(pk=serving.pk).service_seconds)
+        self.assertIn('Backfilled durations on 2 queues', out.getvalue())
+
+
+class AdvanceCoalescerTests(TestCase):
+    @override_settings(QUEUE_BROADCAST_DEBOUNCE_SECONDS=0.05)
+    def test_one_message_per_batch(self):
+        coalescer = AdvanceCoalescer()
+        with mock.patch('queue_manager.broadcast.send') as send:
+            coalescer.add(1, left=(1, 3))
+            coalescer.add(1, joined=(1, 9))
+            coalescer.add(1, joined=(1, 4))
+            coalescer.add(1, left=(1, 4))
+            deadline = time.monotonic() + 5
+            while not send.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+        send.assert_called_once_with('service_1', {
+            'type': 'queue.advance', 'service': 1, 'left': [[1, 3]], 'joined': [[1, 9]]
+        })
+
+    def test_priority_change_moves_the_ticket(self):
+        customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        queue = Queue.objects.create(user=customer, service=Service.objects.create(name='Service', provider=provider))
+        with mock.patch('queue_manager.broadcast.coalescer') as coalescer:
+            with self.captureOnCommitCallbacks(execute=True):
+                queue.priority = True
+                queue.save()
+        coalescer.add.assert_has_calls([
+            mock.call(queue.service_id, left=(1, queue.ticket_number)),
+            mock.call(queue.service_id, joined=(0, queue.ticket_number)),
+        ])
+
+    @override_settings(QUEUE_BROADCAST_DEBOUNCE_SECONDS=60)
+    def test_pending_batches_flush_at_exit(self):
+        coalescer = AdvanceCoalescer()
+        with mock.patch('queue_manager.broadcast.send') as send:
+            coalescer.add(1, left=(0, 2))
+            coalescer.add(2, joined=(1, 5))
+            coalescer.flush_all()
+        self.assertEqual(sorted(call.args[0] for call in send.call_args_list), ['service_1', 'service_2'])
+
+
+@override_settings(QUEUE_ESTIMATOR_ALPHA=0.5, QUEUE_ESTIMATOR_PERSIST_SECONDS=3600)
+class ServiceTimeEstimatorTests(TestCase):
+    """Workers each learn from their own completions and merge into one row"""
+
+    def setUp(self):
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        self.service = Service.objects.create(name='Service', provider=provider)
+
+    def stored(self):
+        row = ServiceTimeEstimate.objects.get(service=self.service, window=None)
+        return row.average_seconds, row.samples
+
+    def test_persists_blend_instead_of_overwriting(self):
+        ServiceTimeEstimate.objects.create(service=self.service, average_seconds=100, samples=1)
+        first, second = ServiceTimeEstimator(), ServiceTimeEstimator()
+        first.observe(self.service.id, 200)
+        second.observe(self.service.id, 300)
+
+        first.persist()
+        self.assertEqual(self.stored(), (150, 2))
+        second.persist()
+        # As if one process had seen 200 and then 300
+        self.assertEqual(self.stored(), (225, 3))
+        self.assertEqual(second.estimate(self.service), 225)
+
+    def test_first_samples_in_two_processes(self):
+        first, second = ServiceTimeEstimator(), ServiceTimeEstimator()
+        first.observe(self.service.id, 60)
+        second.observe(self.service.id, 120)
+        first.persist()
+        second.persist()
+        self.assertEqual(self.stored(), (90, 2))
+
+
+@override_settings(AUTH_USER_CACHE_SHARED=True)
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        self.authentication = CachedJWTAuthentication()
+        self.token = self.authentication.get_validated_token(str(AccessToken.for_user(self.user)))
+
+    def test_cache_hit_needs_no_queries(self):
+        self.authentication.get_user(self.token)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authentication.get_user(self.token), self.user)
+
+    def test_save_invalidates(self):
+        self.authentication.get_user(self.token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.email = 'changed@example.com'
+            self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+        self.assertEqual(self.authentication.get_user(self.token).email, 'changed@example.com')
+
+    def test_deactivated_user_is_rejected(self):
+        self.authentication.get_user(self.token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.get_user(self.token)
+        response = self.client.get('/api/users/me/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(AUTH_USER_CACHE_SHARED=False)
+    def test_process_local_cache_reads_the_database(self):
+        # As another worker would see it: the local entry was never invalidated
+        self.authentication.get_user(self.token)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertNumQueries(1), self.assertRaises(AuthenticationFailed):
+            self.authentication.get_user(self.token)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class JWTAuthMiddlewareTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        self.token = str(AccessToken.for_user(self.user))
+        self.application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def scope_for(self, path, subprotocols=None):
+        """The scope the middleware hands on, without running a consumer"""
+        seen = {}
+
+        async def inner(scope, receive, send):
+            seen.update(scope)
+
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'websocket', 'path': path, 'query_string': query.encode(),
+            'subprotocols': subprotocols or [],
+        }
+        await JWTAuthMiddleware(inner)(scope, None, None)
+        return seen
+
+    async def connect(self, path, subprotocols=None):
+        communicator = WebsocketCommunicator(self.application, path, subprotocols=subprotocols)
+        connected, subprotocol = await communicator.connect()
+        if connected:
+            await communicator.disconnect()
+        return connected, subprotocol
+
+    async def test_query_string_token(self):
+        scope = await self.scope_for(f'/ws/queue/?token={self.token}')
+        self.assertEqual(scope['user'], self.user)
+        self.assertIsNone(scope['auth_subprotocol'])
+        self.assertFalse(scope['auth_rejected'])
+        self.assertEqual(await self.connect(f'/ws/queue/?token={self.token}'), (True, None))
+
+    async def test_subprotocol_token(self):
+        scope = await self.scope_for('/ws/queue/', subprotocols=['jwt', self.token])
+        self.assertEqual(scope['user'], self.user)
+        self.assertEqual(scope['auth_subprotocol'], 'jwt')
+        # The handshake has to confirm the subprotocol or browsers drop it
+        self.assertEqual(await self.connect('/ws/queue/', subprotocols=['jwt', self.token]), (True, 'jwt'))
+
+    async def test_invalid_or_expired_token_is_rejected(self):
+        expired = AccessToken.for_user(self.user)
+        expired.set_exp(lifetime=-timedelta(minutes=1))
+        for token in ('not-a-token', str(expired)):
+            with self.subTest(token=token[:12]):
+                scope = await self.scope_for(f'/ws/queue/?token={token}')
+                self.assertFalse(scope['user'].is_authenticated)
+                self.assertTrue(scope['auth_rejected'])
+                connected, _ = await self.connect(f'/ws/queue/?token={token}')
+                self.assertFalse(connected)
+
+    async def test_no_token_stays_anonymous(self):
+        scope = await self.scope_for('/ws/queue/?service=1')
+        self.assertFalse(scope['user'].is_authenticated)
+        self.assertFalse(scope['auth_rejected'])
+        self.assertEqual(await self.connect('/ws/queue/?service=1'), (True, None))
+
+
+@override_settings(QUEUE_REPLICA_DATABASE=None)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        self.category = ServiceCategory.objects.create(name='Licensing')
+        Service.objects.create(name='Renewal', provider=self.provider, category=self.category)
+        self.client = APIClient()
+
+    def names(self, response):
+        return sorted(item['name'] for item in response.json())
+
+    def test_tags_differ_per_path_and_query(self):
+        tags = {
+            path: self.client.get(path)['ETag']
+            for path in ('/api/services/', '/api/services/?expand=category', '/api/service-categories/')
+        }
+        self.assertEqual(len(set(tags.values())), 3)
+        for path, etag in tags.items():
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.client.get('/api/services/', HTTP_IF_NONE_MATCH=tags['/api/service-categories/']).status_code, 200
+        )
+
+    def test_writes_invalidate_cached_responses(self):
+        for path, create in (
+            ('/api/services/', lambda: Service.objects.create(name='Permit', provider=self.provider)),
+            ('/api/service-categories/', lambda: ServiceCategory.objects.create(name='Permits')),
+        ):
+            with self.subTest(path=path):
+                first = self.client.get(path)
+                with self.captureOnCommitCallbacks(execute=True):
+                    create()
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Permit' if 'services' in path else 'Permits', self.names(response))
+
+
+@override_settings(QUEUE_REPLICA_DATABASE=None)
+class DailyRollupTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        self.service = Service.objects.create(name='Service', provider=provider)
+
+    def today(self):
+        return DailyQueueStats.objects.get(user=self.customer, date=timezone.localdate())
+
+    def legacy_stats(self):
+        """What QueueViewSet.stats computed from the queue table before the rollups"""
+        user_queues = Queue.objects.filter(user=self.customer, join_time__date=timezone.now().date())
+        completed = user_queues.filter(status='completed')
+        waits = [(q.start_time - q.join_time).total_seconds() for q in completed if q.start_time and q.join_time]
+        services = [(q.end_time - q.start_time).total_seconds() for q in completed if q.end_time and q.start_time]
+        return {
+            'queues_joined': user_queues.count(),
+            'waiting': user_queues.filter(status='waiting').count(),
+            'processing': user_queues.filter(status='processing').count(),
+            'served': completed.count(),
+            'cancelled': user_queues.filter(status='cancelled').count(),
+            'priority_queues': user_queues.filter(priority=True).count(),
+            'avg_wait_time_minutes': round((sum(waits) / len(waits) if waits else 0) / 60, 1),
+            'avg_processing_time_minutes': round((sum(services) / len(services) if services else 0) / 60, 1),
+            'total_active_queues': user_queues.filter(status__in=['waiting', 'processing']).count(),
+        }
+
+    def test_matches_the_queue_table(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        Queue.objects.create(user=self.customer, service=self.service, priority=True)
+        client.get('/api/queues/stats/')  # the row exists before the transitions below
+
+        for wait, service, status in ((60, None, 'processing'), (120, 300, 'completed'), (30, 90, 'completed'),
+                                      (None, None, 'cancelled'), (None, None, 'waiting')):
+            queue = Queue.objects.create(user=self.customer, service=self.service)
+            if wait is not None:
+                queue.start_time = queue.join_time + timedelta(seconds=wait)
+            if service is not None:
+                queue.end_time = queue.start_time + timedelta(seconds=service)
+            queue.status = status
+            queue.save()
+        queue.priority = True
+        queue.save()
+
+        self.assertEqual(client.get('/api/queues/stats/').json(), self.legacy_stats())
+
+    def test_uncounted_rows_never_go_negative(self):
+        Queue.objects.create(user=self.customer, service=self.service)
+        Queue.objects.bulk_create([Queue(user=self.customer, service=self.service)])
+        for queue in Queue.objects.all():
+            queue.status = 'cancelled'
+            queue.save()
+        self.assertEqual(self.today().waiting, 0)
+        self.assertEqual(self.today().cancelled, 2)
+        # The bulk-created join was never counted; a rebuild brings it back in line
+        rebuilt = rebuild_day(self.customer.id, timezone.localdate())
+        self.assertEqual((rebuilt.joined, rebuilt.waiting, rebuilt.cancelled), (2, 0, 2))
+
+    def test_priority_change(self):
+        queue = Queue.objects.create(user=self.customer, service=self.service)
+        queue.priority = True
+        queue.save()
+        self.assertEqual(self.today().priority, 1)
+        queue.priority = False
+        queue.save()
+        self.assertEqual(self.today().priority, 0)
+
+
+@override_settings(QUEUE_REPLICA_DATABASE=None)
+class QueueArchiveTests(TestCase):
+    """Archiving moves old history to another table without changing what users see"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        service = Service.objects.create(name='Service', provider=provider)
+        cls.completed = []
+        for i in range(7):
+            queue = Queue.objects.create(user=cls.customer, service=service)
+            queue.status = 'completed'
+            queue.start_time = queue.end_time = timezone.now()
+            queue.save()
+            cls.completed.append(queue.id)
+        cls.waiting = Queue.objects.create(user=cls.customer, service=service)
+        cls.old = cls.completed[:4]
+        for age, pk in enumerate(reversed(cls.old)):
+            Queue.objects.filter(pk=pk).update(join_time=timezone.now() - timedelta(days=100 + age))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def archive(self):
+        call_command('archive_queues', stdout=StringIO())
+
+    def walk_my_queues(self):
+        ids, url = [], '/api/queues/my_queues/'
+        while url:
+            response = self.client.get(url)
+            ids += [queue['id'] for queue in response.data['completed']]
+            url = response.data['next']
+        return ids
+
+    def walk_history(self):
+        ids, url = [], '/api/queues/'
+        while url:
+            response = self.client.get(url)
+            ids += [queue['id'] for queue in response.data if queue['status'] == 'completed']
+            url = response.get('Link', '<>')[1:].split('>')[0]
+        return ids
+
+    def test_moves_old_finished_queues(self):
+        today = DailyQueueStats.objects.get(user=self.customer, date=timezone.localdate())
+        self.archive()
+
+        self.assertCountEqual(QueueArchive.objects.values_list('id', flat=True), self.old)
+        self.assertFalse(Queue.objects.filter(pk__in=self.old).exists())
+        self.assertTrue(Queue.objects.filter(pk=self.waiting.pk).exists())
+        # Archived queues are still history, so the rollups keep counting them
+        self.assertEqual(DailyQueueStats.objects.get(pk=today.pk).completed, 7)
+
+    def test_history_pages_span_both_tables(self):
+        expected = sorted(self.completed[4:], reverse=True) + sorted(self.old, reverse=True)
+        self.assertEqual(self.walk_my_queues(), expected)
+        self.assertEqual(self.walk_history(), expected)
+
+        self.archive()
+        self.assertEqual(self.walk_my_queues(), expected)
+        self.assertEqual(self.walk_history(), expected)
+
+    def test_archiving_moves_the_owner_version(self):
+        etag = self.client.get('/api/queues/my_queues/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.archive()
+        self.assertEqual(self.client.get('/api/queues/my_queues/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_archiving_moves_the_horizon_version(self):
+        self.assertIsNone(archive_horizon())
+        stale = horizon_key()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.archive()
+        # A process holding the entry from before the run no longer reads it
+        cache.set(stale, {'join_time': None})
+        self.assertNotEqual(horizon_key(), stale)
+        self.assertEqual(archive_horizon(), QueueArchive.objects.order_by('-join_time')[0].join_time)
+
+    def test_cancelled_queues_stay_in_history(self):
+        Queue.objects.filter(pk=self.old[0]).update(status='cancelled')
+        self.archive()
+
+        response = self.client.get('/api/queues/?page_size=100')
+        self.assertIn(self.old[0], [queue['id'] for queue in response.data if queue['status'] == 'cancelled'])
+
+
+# A real second database, not a test mirror of the first
+HAS_REPLICA = (
+    'replica' in settings.DATABASES and
+    not settings.DATABASES['replica'].get('TEST', {}).get('MIRROR')
+)
+
+
+@skipUnless(HAS_REPLICA, "needs a separate 'replica' database, e.g. a second SQLite file")
+@override_settings(QUEUE_REPLICA_DATABASE='replica')
+class ReplicaRoutingTests(TestCase):
+    """
+    Lag-tolerant reads go to the replica, everything else to the primary.
+    Rows are only written to the primary here, so reads that reach the
+    replica come back empty.
+    """
+    databases = {'default', 'replica'} if HAS_REPLICA else {'default'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        cls.service = Service.objects.create(name='Service', provider=provider)
+        cls.queue = Queue.objects.create(user=cls.customer, service=cls.service)
+
+    def setUp(self):
+        cache.clear()
+        cache.set(VERSION_KEY, 0, None)  # catalog unchanged for long enough to replicate
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_lag_tolerant_reads_use_the_replica(self):
+        self.assertEqual(self.client.get('/api/services/').data, [])
+        self.assertIn('message', self.client.get('/api/queues/').data)
+
+        # Polled with ETags, so always read from the primary
+        response = self.client.get('/api/queues/my_queues/')
+        self.assertEqual(len(response.data['waiting']), 1)
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        other = Service.objects.create(name='Other', provider=self.service.provider)
+        response = self.client.post('/api/queues/', {'service_id': other.id})
+        self.assertEqual(response.status_code, 201)
+        queues = self.client.get('/api/queues/').data
+        self.assertEqual({queue['id'] for queue in queues}, {self.queue.id, response.data['id']})
+
+    def test_queue_owner_is_pinned_when_someone_else_moves_their_queue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.queue.status = 'processing'
+            self.queue.start_time = timezone.now()
+            self.queue.save()
+        queues = self.client.get('/api/queues/').data
+        self.assertEqual([queue['id'] for queue in queues], [self.queue.id])
+
+
+class Endpoint:
+    def __init__(self, method, path, payload=None, user=None, setup=None):
+        self.method, self.path, self.payload, self.user, self.setup = method, path, payload, user, setup
+
+
+def _register(t):
+    name = t.unique('newuser')
+    return {'username': name, 'email': f'{name}@example.com', 'password': 'password123', 'confirm_password': 'password123'}
+
+
+# Path, payload and setup are called with the test case on every request, so
+# each call gets fresh rows to act on
+ENDPOINTS = {
+    'api-root': Endpoint('get', lambda t: '/api/', None, None),
+    'token-obtain-pair': Endpoint('post', lambda t: '/api/auth/token/', lambda t: {'username': 'customer', 'password': 'password123'}, None),
+    'token-refresh': Endpoint('post', lambda t: '/api/auth/token/refresh/', lambda t: {'refresh': t.refresh_token()}, None),
+    'token-verify': Endpoint('post', lambda t: '/api/auth/token/verify/', lambda t: {'token': t.refresh_token()}, None),
+
+    'user-list': Endpoint('get', lambda t: '/api/users/', None, 'customer'),
+    'user-detail': Endpoint('get', lambda t: f'/api/users/{t.customer.id}/', None, 'customer'),
+    'user-create': Endpoint('post', lambda t: '/api/users/', _register, None),
+    'user-update': Endpoint('put', lambda t: f'/api/users/{t.customer.id}/', lambda t: {'username': 'customer', 'email': 'customer@example.com', 'phone_number': '+123456789'}, 'customer'),
+    'user-partial-update': Endpoint('patch', lambda t: f'/api/users/{t.customer.id}/', lambda t: {'phone_number': '+123456789'}, 'customer'),
+    'user-destroy': Endpoint('delete', lambda t: f'/api/users/{t.fresh_user().id}/', None, 'customer'),
+    'user-me': Endpoint('get', lambda t: '/api/users/me/', None, 'customer'),
+    'user-register': Endpoint('post', lambda t: '/api/users/register/', _register, None),
+    'user-register-provider': Endpoint('post', lambda t: '/api/users/register/provider/', _register, None),
+    'user-me-update': Endpoint('patch', lambda t: '/api/users/mes/', lambda t: {'phone_number': '+123456789'}, 'customer'),
+
+    'servicecategory-list': Endpoint('get', lambda t: '/api/service-categories/', None, None),
+    'servicecategory-detail': Endpoint('get', lambda t: f'/api/service-categories/{t.category.id}/', None, None),
+    'servicecategory-create': Endpoint('post', lambda t: '/api/service-categories/', lambda t: {'name': t.unique('category')}, 'provider'),
+    'servicecategory-update': Endpoint('put', lambda t: f'/api/service-categories/{t.category.id}/', lambda t: {'name': 'Licensing'}, 'provider'),
+    'servicecategory-partial-update': Endpoint('patch', lambda t: f'/api/service-categories/{t.category.id}/', lambda t: {'description': 'Updated'}, 'provider'),
+    'servicecategory-destroy': Endpoint('delete', lambda t: f'/api/service-categories/{t.fresh_category().id}/', None, 'provider'),
+
+    'service-list': Endpoint('get', lambda t: '/api/services/', None, None),
+    'service-list-expanded': Endpoint('get', lambda t: '/api/services/?expand=category,provider', None, None),
+    'service-detail': Endpoint('get', lambda t: f'/api/services/{t.service.id}/', None, None),
+    'service-create': Endpoint('post', lambda t: '/api/services/', lambda t: {'name': t.unique('service'), 'category_id': t.category.id}, 'provider'),
+    'service-update': Endpoint('put', lambda t: f'/api/services/{t.service.id}/', lambda t: {'name': 'Licence renewal', 'category_id': t.category.id}, 'provider'),
+    'service-partial-update': Endpoint('patch', lambda t: f'/api/services/{t.service.id}/', lambda t: {'description': 'Updated'}, 'provider'),
+    'service-destroy': Endpoint('delete', lambda t: f'/api/services/{t.fresh_service().id}/', None, 'provider'),
+    'service-queues': Endpoint('get', lambda t: f'/api/services/{t.service.id}/queues/', None, 'provider'),
+    'service-queues-expanded': Endpoint('get', lambda t: f'/api/services/{t.service.id}/queues/?expand=user,service', None, 'provider'),
+    'service-durations': Endpoint('get', lambda t: f'/api/services/{t.service.id}/durations/', None, 'provider'),
+
+    'queue-list': Endpoint('get', lambda t: '/api/queues/', None, 'customer'),
+    'queue-detail': Endpoint('get', lambda t: f'/api/queues/{t.fresh_queue().id}/', None, 'customer'),
+    'queue-create': Endpoint('post', lambda t: '/api/queues/', lambda t: {'service_id': t.service.id}, 'customer'),
+    'queue-update': Endpoint('put', lambda t: f'/api/queues/{t.fresh_queue().id}/', lambda t: {'service_id': t.service.id, 'notes': 'Updated'}, 'customer'),
+    'queue-partial-update': Endpoint('patch', lambda t: f'/api/queues/{t.fresh_queue().id}/', lambda t: {'notes': 'Updated'}, 'customer'),
+    'queue-destroy': Endpoint('delete', lambda t: f'/api/queues/{t.fresh_queue().id}/', None, 'customer'),
+    'queue-start': Endpoint('patch', lambda t: f'/api/queues/{t.fresh_queue().id}/start/', None, 'customer'),
+    'queue-complete': Endpoint('patch', lambda t: f'/api/queues/{t.fresh_queue().id}/complete/', None, 'customer'),
+    'queue-my-queues': Endpoint('get', lambda t: '/api/queues/my_queues/', None, 'customer'),
+    'queue-my-queues-expanded': Endpoint('get', lambda t: '/api/queues/my_queues/?expand=service,user', None, 'customer'),
+    'queue-stats': Endpoint('get', lambda t: '/api/queues/stats/', None, 'customer'),
+
+    'window-list': Endpoint('get', lambda t: '/api/windows/', None, 'provider'),
+    'window-list-expanded': Endpoint('get', lambda t: '/api/windows/?expand=services,service_provider,current_queue', None, 'provider'),
+    'window-detail': Endpoint('get', lambda t: f'/api/windows/{t.window.id}/', None, 'provider'),
+    'window-create': Endpoint('post', lambda t: '/api/windows/', lambda t: {'name': t.unique('window'), 'service_ids': [t.service.id]}, 'provider'),
+    'window-update': Endpoint('put', lambda t: f'/api/windows/{t.window.id}/', lambda t: {'name': 'Window', 'service_ids': [t.service.id]}, 'provider'),
+    'window-partial-update': Endpoint('patch', lambda t: f'/api/windows/{t.window.id}/', lambda t: {'location': 'Hall B'}, 'provider'),
+    'window-destroy': Endpoint('delete', lambda t: f'/api/windows/{t.fresh_window().id}/', None, 'provider'),
+    'window-assign': Endpoint('patch', lambda t: f'/api/windows/{t.fresh_window().id}/assign/', lambda t: {'provider_id': t.provider.id}, 'provider'),
+    'window-next-queue': Endpoint('patch', lambda t: f'/api/windows/{t.fresh_window(busy=True).id}/next/', None, 'provider'),
+    'window-available': Endpoint('get', lambda t: '/api/windows/available/', None, 'provider'),
+    'window-assign-queue': Endpoint('post', lambda t: f'/api/windows/{t.fresh_window().id}/assign-queue/', lambda t: {'queue_id': t.fresh_queue().id}, 'provider'),
+    'window-assign-all': Endpoint('post', lambda t: '/api/windows/assign-all/', None, 'provider', setup=lambda t: t.ready_window()),
+    'window-assign-best': Endpoint('post', lambda t: '/api/windows/assign-best/', lambda t: {'queue_id': t.ready_window().id}, 'provider'),
+    'window-stats': Endpoint('get', lambda t: '/api/windows/stats/', None, 'provider'),
+}
+
+# Exact queries per call with warm process caches. A count that moves either
+# way fails the test, so update the budget with the change that moved it;
+# raising one needs a reason.
+QUERY_BUDGETS = {
+    'api-root': 0,
+    'token-obtain-pair': 1,
+    'token-refresh': 1,
+    'token-verify': 0,
+    'user-list': 1,
+    'user-detail': 1,
+    'user-create': 3,
+    'user-update': 4,
+    'user-partial-update': 1,
+    'user-destroy': 10,
+    'user-me': 0,
+    'user-register': 3,
+    'user-register-provider': 3,
+    'user-me-update': 1,
+    'servicecategory-list': 0,  # served from the catalog cache
+    'servicecategory-detail': 1,
+    'servicecategory-create': 2,
+    'servicecategory-update': 3,
+    'servicecategory-partial-update': 2,
+    'servicecategory-destroy': 3,
+    'service-list': 0,  # served from the catalog cache
+    'service-list-expanded': 0,  # served from the catalog cache
+    'service-detail': 1,
+    'service-create': 2,
+    'service-update': 3,
+    'service-partial-update': 2,
+    'service-destroy': 7,
+    'service-queues': 2,
+    'service-queues-expanded': 2,
+    'service-durations': 11,  # summary, one per percentile and the histogram, for each column
+    'queue-list': 7,  # two more once the history page runs into the archive
+    'queue-detail': 2,
+    'queue-create': 10,
+    'queue-update': 3,
+    'queue-partial-update': 2,
+    'queue-destroy': 4,
+    'queue-start': 4,
+    'queue-complete': 4,
+    'queue-my-queues': 2,  # active queues and a history page together, then the archive
+    'queue-my-queues-expanded': 2,
+    'queue-stats': 1,
+    'window-list': 2,
+    'window-list-expanded': 2,
+    'window-detail': 2,
+    'window-create': 7,
+    'window-update': 7,
+    'window-partial-update': 4,
+    'window-destroy': 6,
+    'window-assign': 4,
+    'window-next-queue': 19,  # finish, dispatch and window metrics in one transaction
+    'window-available': 2,
+    'window-assign-queue': 19,
+    'window-assign-all': 17,  # compare-and-set on the matched queues, then their wait times
+    'window-assign-best': 20,
+    'window-stats': 2,
+}
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    # Long enough that history pages always run into the archive, the
+    # costlier path, whatever the scale
+    QUEUE_HISTORY_PAGE_SIZE=1000,
+    QUEUE_REPLICA_DATABASE=None
+)
+class EndpointQueryBudgetTests(TestCase):
+    """
+    Every route in urls.py stays within a fixed query budget, and costs the
+    same with several times more users, services, windows and queues
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        cls.provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        cls.category = ServiceCategory.objects.create(name='Licensing')
+        cls.service = Service.objects.create(name='Licence renewal', provider=cls.provider, category=cls.category)
+        cls.window = Window.objects.create(name='Window', service_provider=cls.provider)
+        cls.window.services.add(cls.service)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password123')
+        cls.batches = 0
+        cls.seed()
+
+    @classmethod
+    def seed(cls, scale=1):
+        """Add ``scale`` batches of customers, services, windows and their queues"""
+        for _ in range(scale):
+            cls.batches += 1
+            batch = cls.batches
+            category = ServiceCategory.objects.create(name=f'Category {batch}')
+            # Their own provider, so these windows never serve the test's service
+            provider = User.objects.create_service_provider(f'provider{batch}', f'provider{batch}@example.com')
+            services = [
+                Service.objects.create(name=f'Service {batch}.{i}', provider=provider, category=category)
+                for i in range(3)
+            ]
+            customers = [cls.customer] + [
+                User.objects.create_user(f'customer{batch}.{i}', f'customer{batch}.{i}@example.com')
+                for i in range(3)
+            ]
+            for i, service in enumerate([cls.service, *services]):
+                for customer in customers:
+                    Queue.objects.create(user=customer, service=service, priority=i % 2 == 0)
+                    served = Queue.objects.create(user=customer, service=service)
+                    served.status = 'completed'
+                    served.start_time = served.end_time = timezone.now()
+                    served.save()
+            for i in range(2):
+                window = Window.objects.create(name=f'Window {batch}.{i}', service_provider=provider)
+                window.services.add(*services[i:i + 2])
+            busy = Window.objects.create(name=f'Window {batch}.busy', service_provider=provider)
+            busy.services.add(*services)
+            busy.assign_next_queue()
+            for service in services:
+                ServiceTimeEstimate.objects.create(service=service, window=busy, average_seconds=300)
+                QueueArchive.objects.create(
+                    id=10 ** 6 + service.id, user=cls.customer, service=service, status='completed',
+                    join_time=timezone.now() - timedelta(days=100), ticket_number=0
+                )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.counter = 0
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f'{prefix}-{self.batches}-{self.counter}'
+
+    def refresh_token(self):
+        return str(RefreshToken.for_user(self.customer))
+
+    def fresh_user(self):
+        name = self.unique('user')
+        return User.objects.create_user(name, f'{name}@example.com')
+
+    def fresh_category(self):
+        return ServiceCategory.objects.create(name=self.unique('category'))
+
+    def fresh_service(self):
+        return Service.objects.create(name=self.unique('service'), provider=self.provider, category=self.category)
+
+    def fresh_queue(self):
+        return Queue.objects.create(user=self.customer, service=self.service)
+
+    def fresh_window(self, busy=False):
+        window = Window.objects.create(name=self.unique('window'), service_provider=self.provider)
+        window.services.add(self.service)
+        if busy:
+            self.fresh_queue()
+            window.assign_next_queue()
+        return window
+
+    def ready_window(self):
+        """An available window and a waiting ticket it can serve"""
+        self.fresh_window()
+        return self.fresh_queue()
+
+    def call(self, name):
+        endpoint = ENDPOINTS[name]
+        self.client.force_authenticate(getattr(self, endpoint.user) if endpoint.user else None)
+        if endpoint.setup:
+            endpoint.setup(self)
+        path = endpoint.path(self)
+        data = endpoint.payload(self) if endpoint.payload else None
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, endpoint.method)(path, data, format='json')
+        self.assertLess(response.status_code, 400, f'{name}: {response.status_code} {getattr(response, "data", "")}')
+        return len(queries)
+
+    def measure(self):
+        """Queries per endpoint, each measured on its second call so process-level caches are warm"""
+        counts = {}
+        for name in ENDPOINTS:
+            cache.clear()
+            dispatcher.reset()
+            self.call(name)
+            counts[name] = self.call(name)
+        return counts
+
+    def test_every_route_is_budgeted(self):
+        def handlers(patterns):
+            for pattern in patterns:
+                if isinstance(pattern, URLResolver):
+                    yield from handlers(pattern.url_patterns)
+                else:
+                    view = pattern.callback
+                    for handler in getattr(view, 'actions', {'': None}).values():
+                        yield getattr(view, 'cls', view), handler
+
+        covered = set()
+        for endpoint in ENDPOINTS.values():
+            view = resolve(endpoint.path(self).split('?')[0]).func
+            covered.add((getattr(view, 'cls', view), getattr(view, 'actions', {}).get(endpoint.method)))
+        self.assertEqual(set(handlers(urls.urlpatterns)) - covered, set())
+
+    def admin_changelist_queries(self):
+        client = APIClient()
+        client.force_login(self.admin)
+        counts = {}
+        for model in ('user', 'servicecategory', 'service', 'queue', 'queuearchive', 'window', 'servicetimeestimate'):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(f'/admin-access/queue_manager/{model}/')
+            self.assertEqual(response.status_code, 200, model)
+            counts[model] = len(queries)
+        return counts
+
+    def test_admin_changelists(self):
+        small = self.admin_changelist_queries()
+        self.seed(scale=4)
+        self.assertEqual(self.admin_changelist_queries(), small)
+
+    def test_query_budgets(self):
+        small = self.measure()
+        self.seed(scale=4)
+        large = self.measure()
+        for name in ENDPOINTS:
+            with self.subTest(endpoint=name):
+                self.assertEqual(small[name], QUERY_BUDGETS[name], 'query count differs from the budget')
+                self.assertEqual(large[name], small[name], 'query count grows with the data')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'checks PostgreSQL EXPLAIN output')
+class DispatchQueryPlanTests(TestCase):
+    """Dispatch reads use the indexes on live queues instead of scanning the whole table"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        cls.services = [Service.objects.create(name=f'Service {i}', provider=provider) for i in range(3)]
+        for i in range(300):
+            queue = Queue.objects.create(user=cls.customer, service=cls.services[i % 3], priority=i % 7 == 0)
+            if i % 10:
+                queue.status = 'completed'
+                queue.start_time = queue.end_time = timezone.now()
+                queue.save()
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE queue_manager_queue')
+            # A table this small is cheapest to scan whatever its indexes, so
+            # rule that out and let the plan show whether an index applies
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertIndexScan(self, queryset, *indexes):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan on queue_manager_queue', plan)
+        self.assertTrue(any(index in plan for index in indexes), plan)
+
+    def test_dispatcher_load(self):
+        waiting = Queue.objects.filter(status='waiting').order_by().values_list(
+            'id', 'service_id', 'priority', 'ticket_number', 'join_time'
+        )
+        self.assertIndexScan(waiting, 'queue_active_dispatch_idx', 'queue_active_user_idx')
+
+    def test_waiting_check(self):
+        waiting = Queue.objects.filter(service_id__in=[service.id for service in self.services], status='waiting')
+        self.assertIndexScan(waiting, 'queue_active_dispatch_idx')
+
+    def test_positions(self):
+        self.assertIndexScan(
+            Queue.objects.filter(service=self.services[0], status='waiting').with_position(),
+            'queue_active_dispatch_idx'
+        )
+
+    def test_active_queues_of_a_user(self):
+        active = Queue.objects.filter(user=self.customer, status__in=['waiting', 'processing'])
+        self.assertIndexScan(active, 'queue_active_user_idx')
+
+    def test_history_page(self):
+        page = Queue.objects.filter(user=self.customer, status='completed').order_by('-join_time', '-id')[:21]
+        self.assertIndexScan(page, 'queue_user_history_idx')
+
+
+class BulkSeedingTests(TestCase):
+    def test_bulk_create_numbers_tickets_per_service(self):
+        customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        first = Service.objects.create(name='First', provider=provider)
+        second = Service.objects.create(name='Second', provider=provider)
+        joined = Queue.objects.create(user=customer, service=first)
+
+        Queue.objects.bulk_create([Queue(user=customer, service=service) for service in (first, second, first)])
+
+        self.assertEqual(
+            list(Queue.objects.filter(service=first).order_by('pk').values_list('ticket_number', flat=True)),
+            [joined.ticket_number, joined.ticket_number + 1, joined.ticket_number + 2]
+        )
+        self.assertEqual(list(Queue.objects.filter(service=second).values_list('ticket_number', flat=True)), [1])
+        # Joins after the bulk insert continue the sequence
+        self.assertEqual(TicketCounter.next_number(first), joined.ticket_number + 3)
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        dispatcher.reset()
+
+    def test_reports_each_operation(self):
+        out = StringIO()
+        call_command(
+            'benchmark', '--noinput', users=5, services=2, windows=2, queues=10, operations=4,
+            workers=1, seed=1, cleanup=True, stdout=out
+        )
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(set(report['operations']), {'join', 'next_queue', 'complete'})
+        for name, result in report['operations'].items():
+            with self.subTest(operation=name):
+                self.assertEqual(result['requests'], 4)
+                self.assertEqual(result['errors'], 0)
+                self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+        self.assertFalse(User.objects.filter(username__startswith=report['run']).exists())
+
+
+class SimulationTests(TestCase):
+    def arrivals(self, *tickets):
+        """``(time, service_id, priority, ticket_number, duration)`` rows as the arrays simulate() takes"""
+        columns = list(zip(*tickets))
+        return tuple(np.array(column) for column in columns)
+
+    def test_dispatch_order(self):
+        # A priority ticket that arrives last is still called before earlier normal ones
+        starts, busy = simulate([(1, {7}, set())], self.arrivals(
+            (0, 7, False, 1, 10), (1, 7, False, 2, 10), (2, 7, True, 3, 10)
+        ))
+        self.assertEqual(starts.tolist(), [0, 20, 10])
+        self.assertEqual(busy, {1: 30})
+
+    def test_window_eligibility(self):
+        windows = [(1, {7, 8}, set()), (2, set(), {7}), (3, {7}, set())]
+        starts, busy = simulate(windows, self.arrivals((0, 7, False, 1, 10), (0, 7, False, 2, 10), (0, 9, False, 1, 10)))
+        # Direct windows before provider ones, then the one serving fewer services
+        self.assertEqual(busy, {1: 10, 2: 0, 3: 10})
+        self.assertTrue(np.isnan(starts[2]))
+
+    def test_sweep(self):
+        profiles = [ServiceProfile(1, 20, 300, priority_share=0.2), ServiceProfile(2, 10, [120, 600])]
+        scenarios = {
+            'short': [(1, {1}, set()), (2, {2}, set())],
+            'staffed': [(1, {1}, set()), (2, {2}, set()), (3, {1, 2}, set()), (4, {1}, set())],
+        }
+        reports = sweep(scenarios, profiles, hours=4, replications=3, seed=1)
+
+        self.assertEqual(reports, sweep(scenarios, profiles, hours=4, replications=3, seed=1))
+        short, staffed = reports['short'], reports['staffed']
+        self.assertEqual(short['tickets'], staffed['tickets'])
+        self.assertEqual(short['unserved'], 0)
+        self.assertLess(staffed['wait_seconds']['percentiles']['95'], short['wait_seconds']['percentiles']['95'])
+        self.assertLess(staffed['average_utilization'], short['average_utilization'])
+        for utilization in [*short['utilization'].values(), *staffed['utilization'].values()]:
+            self.assertTrue(0 <= utilization <= 1)
+
+    def test_configuration_from_database(self):
+        estimator.reset()
+        customer = User.objects.create_user('customer', 'customer@example.com', 'password123')
+        provider = User.objects.create_service_provider('provider', 'provider@example.com', 'password123')
+        estimated = Service.objects.create(name='Estimated', provider=provider, average_service_time=10)
+        observed = Service.objects.create(name='Observed', provider=provider)
+        other = Service.objects.create(
+            name='Other',
+            provider=User.objects.create_service_provider('other', 'other@example.com', 'password123')
+        )
+        started = timezone.now() - timedelta(hours=1)
+        Queue.objects.bulk_create([
+            Queue(user=customer, service=observed, status='completed',
+                  start_time=started, end_time=started + timedelta(seconds=120))
+            for _ in range(30)
+        ])
+        window = Window.objects.create(name='Window', service_provider=provider)
+        window.services.add(other)
+        Window.objects.create(name='Closed', service_provider=provider, status='closed')
+
+        profiles = {profile.service_id: profile for profile in service_profiles({estimated.id: 6, observed.id: 3})}
+        self.assertEqual(float(profiles[estimated.id].service_seconds), 600)
+        self.assertEqual(profiles[observed.id].service_seconds.tolist(), [120] * 30)
+        self.assertEqual(window_config(), [(window.id, {other.id}, {estimated.id, observed.id})])
\ No newline at end of file
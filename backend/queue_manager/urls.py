@@ -45,6 +45,6 @@ urlpatterns = [
     path('windows/<int:pk>/assign/', WindowViewSet.as_view({'patch': 'assign'}), name='window-assign'),
     path('windows/<int:pk>/assign-queue/', WindowViewSet.as_view({'post': 'assign_queue'}), name='window-assign-queue'),
     path('windows/<int:pk>/next/', WindowViewSet.as_view({'patch': 'next_queue'}), name='window-next-queue'),
-    path('windows/assign-all/', WindowViewSet.as_view({'get': 'assign_all_queues'}), name='window-assign-all'),
+    path('windows/assign-all/', WindowViewSet.as_view({'post': 'assign_all_queues'}), name='window-assign-all'),
     path('windows/assign-best/', WindowViewSet.as_view({'post': 'assign_to_best_window'}), name='window-assign-best'),
 ]
\ No newline at end of file
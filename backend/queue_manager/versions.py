@@ -0,0 +1,141 @@
+import time
+import zlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Queue
+from .signals import queue_status_changed
+
+
+def user_key(user_id):
+    return f'queue-version:user:{user_id}'
+
+
+def service_key(service_id):
+    return f'queue-version:service:{service_id}'
+
+
+# Moves whenever any window changes state, which shifts every ETA
+WINDOWS_KEY = 'queue-version:windows'
+
+# Moves whenever archive_queues commits a chunk, so every process rereads
+# how far the archive reaches
+ARCHIVE_KEY = 'queue-version:archive'
+
+
+def _seed():
+    # Counters start at the current time, so one recreated after eviction
+    # never repeats a value a client may still hold
+    return int(time.time() * 1000)
+
+
+def bump(*keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _seed(), None)
+
+
+def read(keys):
+    """Current value of every counter in ``keys``, in one cache round trip"""
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, _seed(), None)
+            values[key] = cache.get(key)
+    return values
+
+
+def query_variant(request):
+    """
+    Short hash of the request's query parameters, so every projection
+    (``?expand=``, ``?fields=``) and history page gets a tag of its own
+    """
+    params = sorted(request.query_params.lists())
+    return format(zlib.crc32(urlencode(params, doseq=True).encode()), '08x') if params else ''
+
+
+class QueueETag:
+    """
+    ETag naming the resource and the counters a queue response depends on,
+    e.g. ``"q42-u7.1720000000123-s3.1720000000456-w.1720000000789"``: the
+    resource (``list`` or ``q<id>``), the user's counter, which moves on
+    every change to their own queues, one counter per service they are
+    waiting in, which moves whenever that line moves, and, when they wait
+    anywhere, the windows counter, since the ETAs in the body shift with
+    it. Since the tag lists its own inputs, checking it is a single
+    ``get_many``. Responses to a query string end in ``-v<variant>`` (see
+    ``query_variant()``).
+    """
+
+    def __init__(self, user_id, service_ids=(), variant='', resource=''):
+        self.user_id = user_id
+        self.service_ids = sorted(set(service_ids))
+        self.variant = variant
+        self.resource = resource
+
+    @property
+    def keys(self):
+        keys = [user_key(self.user_id)] + [service_key(service_id) for service_id in self.service_ids]
+        return keys + [WINDOWS_KEY] if self.service_ids else keys
+
+    def render(self, values):
+        parts = [self.resource] if self.resource else []
+        parts.append(f'u{self.user_id}.{values[user_key(self.user_id)]}')
+        parts += [f's{service_id}.{values[service_key(service_id)]}' for service_id in self.service_ids]
+        if self.service_ids:
+            parts.append(f'w.{values[WINDOWS_KEY]}')
+        if self.variant:
+            parts.append(f'v{self.variant}')
+        return '"' + '-'.join(parts) + '"'
+
+    @classmethod
+    def parse(cls, header):
+        """The tag a client sent in ``If-None-Match``, or ``None`` if it is not one of ours"""
+        if not header:
+            return None
+        value = header.strip()
+        if value.startswith('W/'):
+            value = value[2:]
+        try:
+            parts = value.strip('"').split('-')
+            resource = parts.pop(0) if parts and not parts[0].startswith('u') else ''
+            user, *services = parts
+            variant = services.pop()[1:] if services and services[-1].startswith('v') else ''
+            if services and services[-1].startswith('w.'):
+                services.pop()
+            if not user.startswith('u') or any(not part.startswith('s') for part in services):
+                return None
+            tag = cls(
+                int(user[1:].split('.')[0]), [int(part[1:].split('.')[0]) for part in services], variant, resource
+            )
+        except ValueError:
+            return None
+        tag.sent = '"' + value.strip('"') + '"'
+        return tag
+
+
+@receiver(queue_status_changed)
+def bump_on_transition(sender, queue, previous_status, **kwargs):
+    # Dispatch moves tickets with UPDATE, which post_save never sees
+    keys = (user_key(queue.user_id), service_key(queue.service_id))
+    transaction.on_commit(lambda: bump(*keys))
+
+
+@receiver(post_save, sender=Queue)
+def bump_on_save(sender, instance, **kwargs):
+    # Edits that keep the status still change the response: notes for the
+    # owner, and priority for everyone waiting in the same line
+    keys = (user_key(instance.user_id), service_key(instance.service_id))
+    transaction.on_commit(lambda: bump(*keys))
+
+
+@receiver(post_delete, sender=Queue)
+def bump_on_deletion(sender, instance, **kwargs):
+    keys = (user_key(instance.user_id), service_key(instance.service_id))
+    transaction.on_commit(lambda: bump(*keys))
@@ -1,24 +1,42 @@
-from django.db import models
-from django.db.models import Q, Count, Case, When, Value, IntegerField, Avg
+from django.db.models import Q, Count, Case, When, Value, IntegerField
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action, permission_classes
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
-from django.db.models import F, Q, Count, Avg
-from django.db.models.functions import Extract
-from django.db import connection
+from django.db import transaction
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.utils import timezone
+from datetime import timedelta
+from django.core.cache import cache
+from contextlib import ExitStack
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 
 from .models import User, ServiceCategory, Service, Queue, Window
+from .analytics import duration_summary
+from . import archive
+from .catalog import (
+    cache_timeout as catalog_cache_timeout, catalog_etag, catalog_last_modified,
+    catalog_version, response_key
+)
+from .dispatch import dispatcher, claim_window, lock_rows, match_windows
+from .metrics import window_stats
+from .pagination import HistoryKeysetPagination
+from .projections import Projection
+from .rollups import day_stats
+from .routers import changed_recently, pin_to_primary, replica_reads
+from . import versions
+from .versions import QueueETag, query_variant
+from .signals import queue_status_changed, window_status_changed
 from .serializers import (
     UserRegistrationSerializer, UserDetailSerializer,
     ServiceCategorySerializer, ServiceSerializer,
-    QueueSerializer, WindowSerializer, CustomTokenObtainPairSerializer
+    QueueSerializer, WindowSerializer, CustomTokenObtainPairSerializer,
+    parse_field_paths
 )
 
 
@@ -26,6 +44,89 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 
+class ExpandableViewMixin:
+    """Loads exactly the relations a request asks to embed with ``?expand=``"""
+
+    def expand_queryset(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        if not hasattr(serializer_class, 'optimize_queryset'):
+            return queryset
+        expand = parse_field_paths(self.request.query_params.get('expand'))
+        return serializer_class.optimize_queryset(queryset, expand)
+
+    def get_projection(self, queryset, serializer_class=None):
+        params = self.request.query_params
+        return Projection(
+            serializer_class or self.get_serializer_class(),
+            parse_field_paths(params.get('expand')),
+            parse_field_paths(params.get('fields')),
+            annotations=queryset.query.annotations
+        )
+
+    def project_queryset(self, queryset, serializer_class=None):
+        """
+        Read-only fast path for hot list endpoints: the same representation
+        as the serializer, built from ``.values()`` rows
+        """
+        return self.get_projection(queryset, serializer_class).render(queryset)
+
+
+class ReplicaReadMixin:
+    """
+    Runs the actions in ``replica_actions`` against the read replica, which
+    may lag a little behind, and keeps anyone who changes something on the
+    primary for a few seconds so they always see their own write.
+    """
+    replica_actions = ()
+
+    def use_replica(self, request):
+        return self.action in self.replica_actions
+
+    def dispatch(self, request, *args, **kwargs):
+        # Routing is switched on once the user is known, in initial(), and
+        # off here, which also covers exceptions that escape the view
+        with ExitStack() as self._replica_reads:
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.use_replica(request):
+            self._replica_reads.enter_context(replica_reads(request.user.id))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method not in permissions.SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class CatalogCacheMixin:
+    """
+    Serves ``list`` from the cache until the catalog changes.
+
+    Responses are stored under the current catalog version, which the
+    signal receivers in ``catalog`` bump on every change, so stale entries
+    are never invalidated one by one, just no longer read. Clients get an
+    ``ETag``/``Last-Modified`` pair for the version and a 304 when they
+    already hold it.
+    """
+
+    def use_replica(self, request):
+        # Right after a change the replica may still serve the old catalog,
+        # which would then be cached under the new version
+        if self.action == 'list' and changed_recently(catalog_version()):
+            return False
+        return super().use_replica(request)
+
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
+    def list(self, request, *args, **kwargs):
+        key = response_key(catalog_version(), self.basename, request.get_full_path())
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, catalog_cache_timeout())
+        return Response(data)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     
@@ -36,7 +137,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def me(self, request):
-        serializer = UserDetailSerializer(request.user)
+        serializer = UserDetailSerializer(request.user, context=self.get_serializer_context())
         return Response(serializer.data)
 
     @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
@@ -58,7 +159,9 @@ class UserViewSet(viewsets.ModelViewSet):
     # In views.py
     def partial_update(self, request, *args, **kwargs):
         user = request.user
-        serializer = UserDetailSerializer(user, data=request.data, partial=True)
+        serializer = UserDetailSerializer(
+            user, data=request.data, partial=True, context=self.get_serializer_context()
+        )
         serializer.is_valid(raise_exception=True)
         
         # Handle password change if provided
@@ -74,16 +177,21 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class ServiceCategoryViewSet(viewsets.ModelViewSet):
+class ServiceCategoryViewSet(CatalogCacheMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = ServiceCategory.objects.all()
     serializer_class = ServiceCategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    replica_actions = ('list', 'retrieve')
 
 
-class ServiceViewSet(viewsets.ModelViewSet):
-    queryset = Service.objects.select_related('provider', 'category')
+class ServiceViewSet(CatalogCacheMixin, ReplicaReadMixin, ExpandableViewMixin, viewsets.ModelViewSet):
+    queryset = Service.objects.all()
     serializer_class = ServiceSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    replica_actions = ('list', 'retrieve', 'durations')
+
+    def get_queryset(self):
+        return self.expand_queryset(super().get_queryset())
 
     def perform_create(self, serializer):
         serializer.save(provider=self.request.user)
@@ -91,62 +199,127 @@ class ServiceViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def queues(self, request, pk=None):
         service = self.get_object()
-        queues = service.queues.filter(status__in=['waiting', 'processing'])
-        serializer = QueueSerializer(queues, many=True)
-        return Response(serializer.data)
+        queues = service.queues.filter(status__in=['waiting', 'processing']).with_position()
+        return Response(self.project_queryset(queues, QueueSerializer))
+
+    @action(detail=True, methods=['get'])
+    def durations(self, request, pk=None):
+        """Wait and service time distribution of this service's finished queues"""
+        service = self.get_object()
+        queues = service.queues.all()
+        if request.query_params.get('days'):
+            try:
+                days = int(request.query_params['days'])
+            except ValueError:
+                return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+            if days < 1:
+                return Response({'error': 'days must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                since = timezone.now() - timedelta(days=days)
+            except OverflowError:
+                return Response({'error': 'days is out of range'}, status=status.HTTP_400_BAD_REQUEST)
+            queues = queues.filter(join_time__gte=since)
+
+        bins = [60, 300, 600, 1800, 3600]
+        return Response({
+            'service': service.id,
+            'wait': duration_summary(queues, 'wait_seconds', bins=bins),
+            'service_time': duration_summary(queues, 'service_seconds', bins=bins),
+        })
 
 
-class QueueViewSet(viewsets.ModelViewSet):
+class QueueViewSet(ReplicaReadMixin, ExpandableViewMixin, viewsets.ModelViewSet):
     serializer_class = QueueSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Not my_queues or retrieve: their ETags come from counters bumped on
+    # commit, and a lagging replica would pin stale data to a fresh tag
+    replica_actions = ('list', 'stats')
 
     def get_queryset(self):
         """Return only the queues belonging to the current user"""
-        return Queue.objects.filter(user=self.request.user).select_related(
-            'user', 
-            'service',
-            'service__provider',
-            'service__category'
-        ).prefetch_related('active_window')
+        return self.expand_queryset(Queue.objects.filter(user=self.request.user).with_position())
 
     def list(self, request, *args, **kwargs):
-        """Custom list response with user-specific messaging"""
+        """
+        Custom list response with user-specific messaging. Waiting and
+        processing queues come in full on the first page; completed and
+        cancelled ones follow one keyset page at a time, with the next page
+        linked from the ``Link`` header.
+        """
         queryset = self.filter_queryset(self.get_queryset())
+        archived = self.expand_queryset(archive.history(request.user))
         
-        if not queryset.exists():
+        if not queryset.exists() and not archived.exists():
             return Response(
                 {'message': 'You currently have no active queues.'},
                 status=status.HTTP_200_OK
             )
         
-        active_queues = queryset.exclude(status='completed')
+        paginator = HistoryKeysetPagination()
+        history = paginator.paginate_queryset(
+            queryset.filter(status__in=archive.FINISHED_STATUSES), request, archive=archived
+        )
+        active_queues = queryset.filter(status__in=['waiting', 'processing'])
         
         if not active_queues.exists():
-            return Response(
+            response = Response(
                 {
                     'message': 'You have no active queues at the moment.',
-                    'completed_queues': self.get_serializer(queryset, many=True).data
+                    'completed_queues': self.get_serializer(history, many=True).data,
+                    'next': paginator.get_next_link()
                 },
                 status=status.HTTP_200_OK
             )
+            return paginator.add_link_header(response)
         
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+        queues = list(active_queues) if paginator.is_first_page(request) else []
+        serializer = self.get_serializer([*queues, *history], many=True)
+        return paginator.add_link_header(Response(serializer.data))
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+    def not_modified(self, request, resource):
+        """
+        Answer a poll whose ``If-None-Match`` still matches with a 304 after
+        a single cache read. Also returns the counter values read, so the
+        full response can tell whether one moved while it was being built.
+        """
+        tag = QueueETag.parse(request.headers.get('If-None-Match'))
+        # A tag issued for another user or another resource never matches
+        if tag is None or tag.user_id != request.user.id or tag.resource != resource:
+            tag = QueueETag(request.user.id)
+            return None, versions.read(tag.keys)
+        
+        # A tag sent for another projection or page never matches this one
+        tag.variant = query_variant(request)
+        values = versions.read(tag.keys)
+        etag = tag.render(values)
+        if etag == tag.sent:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag}), values
+        return None, values
+
+    def tag_response(self, response, resource, service_ids, before):
+        """Attach the ETag, unless a transition raced the response it would describe"""
+        tag = QueueETag(self.request.user.id, service_ids, query_variant(self.request), resource)
+        values = versions.read(tag.keys)
+        if all(before.get(key, value) == value for key, value in values.items()):
+            response['ETag'] = tag.render(values)
+        return response
 
     def retrieve(self, request, *args, **kwargs):
         """Ensure users can only retrieve their own queues"""
+        resource = f'q{kwargs[self.lookup_field]}'
+        response, before = self.not_modified(request, resource)
+        if response is not None:
+            return response
+        
         instance = self.get_object()
         if instance.user != request.user:
             return Response(
                 {'error': 'You can only view your own queues.'},
                 status=status.HTTP_403_FORBIDDEN
             )
-        return super().retrieve(request, *args, **kwargs)
+        response = Response(self.get_serializer(instance).data)
+        waiting_in = [instance.service_id] if instance.status == 'waiting' else []
+        return self.tag_response(response, resource, waiting_in, before)
 
     def perform_create(self, serializer):
         """Automatically assign the current user to new queues"""
@@ -166,7 +339,7 @@ class QueueViewSet(viewsets.ModelViewSet):
         queue.status = 'processing'
         queue.start_time = timezone.now()
         queue.save()
-        return Response(QueueSerializer(queue).data)
+        return Response(self.get_serializer(queue).data)
 
     @action(detail=True, methods=['patch'])
     def complete(self, request, pk=None):
@@ -182,106 +355,88 @@ class QueueViewSet(viewsets.ModelViewSet):
         queue.end_time = timezone.now()
         queue.save()
         
-        # Update positions of remaining queues in the same service
-        Queue.objects.filter(
-            service=queue.service,
-            status='waiting',
-            position__gt=queue.position
-        ).update(position=models.F('position') - 1)
-        
-        return Response(QueueSerializer(queue).data)
+        return Response(self.get_serializer(queue).data)
 
     @action(detail=False, methods=['get'])
     def my_queues(self, request):
-        """Get all queues for the current user with status information"""
+        """
+        Get the current user's waiting and processing queues in full and
+        their completed queues one keyset page at a time (see ``next``)
+        """
+        response, before = self.not_modified(request, 'list')
+        if response is not None:
+            return response
+        
         queryset = self.get_queryset()
         
-        waiting = queryset.filter(status='waiting')
-        processing = queryset.filter(status='processing')
-        completed = queryset.filter(status='completed')
+        # One query for the active queues and one page (plus one row) of
+        # history, split by status here instead of one query per section
+        paginator = HistoryKeysetPagination()
+        completed_page = paginator.page_keys(queryset.filter(status='completed'), request)
+        projection = self.get_projection(queryset)
+        def fetch(rows):
+            return projection.fetch(rows, 'status', 'join_time', 'service')
+        
+        rows = fetch(queryset.filter(Q(status__in=['waiting', 'processing']) | Q(pk__in=completed_page)))
+        
+        sections = {'waiting': [], 'processing': [], 'completed': []}
+        for row in rows:
+            sections[row['status']].append(row)
+        # Older history continues in the archive table, read only when the page gets there
+        sections['completed'] = paginator.trim(paginator.extend_from_archive(
+            sections['completed'], archive.history(request.user, ['completed']), request, fetch
+        ))
         
         response_data = {
             'message': 'Your queue status',
-            'waiting': self.get_serializer(waiting, many=True).data,
-            'processing': self.get_serializer(processing, many=True).data,
-            'completed': self.get_serializer(completed, many=True).data,
-            'has_active_queues': waiting.exists() or processing.exists()
+            'waiting': projection.serialize(sections['waiting']),
+            'processing': projection.serialize(sections['processing']),
+            'completed': projection.serialize(sections['completed']),
+            'next': paginator.get_next_link(),
+            'has_active_queues': bool(sections['waiting'] or sections['processing'])
         }
+        waiting_in = [row['service'] for row in sections['waiting']]
         
         if not response_data['has_active_queues']:
             response_data['message'] = 'You currently have no active queues'
         
-        return Response(response_data)
+        response = paginator.add_link_header(Response(response_data))
+        return self.tag_response(response, 'list', waiting_in, before)
     # In QueueViewSet class
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Get comprehensive queue statistics for the current user"""
-        today = timezone.now().date()
+        # Counters for today are maintained on every queue transition, so
+        # this is a single row read however long the user's history is
+        day = day_stats(request.user.id, timezone.localdate())
         
-        # Get user's queues for today
-        user_queues = Queue.objects.filter(
-            user=request.user,
-            join_time__date=today
-        )
-        
-        # Get completed queues
-        completed_queues = user_queues.filter(status='completed')
-        
-        # Calculate average wait time (time between join and start)
-        if connection.vendor == 'postgresql':
-            # PostgreSQL-specific calculation using Extract
-            avg_wait_seconds = completed_queues.annotate(
-                wait_seconds=Extract(F('start_time') - F('join_time'), 'epoch')
-            ).aggregate(
-                avg_wait=Avg('wait_seconds')
-            )['avg_wait'] or 0
-            
-            # Calculate average processing time (time between start and end)
-            avg_processing_seconds = completed_queues.annotate(
-                processing_seconds=Extract(F('end_time') - F('start_time'), 'epoch')
-            ).aggregate(
-                avg_processing=Avg('processing_seconds')
-            )['avg_processing'] or 0
-        else:
-            # Fallback for other databases
-            wait_times = []
-            processing_times = []
-            
-            for q in completed_queues:
-                if q.start_time and q.join_time:
-                    wait_times.append((q.start_time - q.join_time).total_seconds())
-                if q.end_time and q.start_time:
-                    processing_times.append((q.end_time - q.start_time).total_seconds())
-            
-            avg_wait_seconds = sum(wait_times) / len(wait_times) if wait_times else 0
-            avg_processing_seconds = sum(processing_times) / len(processing_times) if processing_times else 0
+        avg_wait_seconds = day.wait_seconds / day.waits if day.waits else 0
+        avg_processing_seconds = day.service_seconds / day.services if day.services else 0
         
         # Calculate statistics
         stats = {
-            'queues_joined': user_queues.count(),
-            'waiting': user_queues.filter(status='waiting').count(),
-            'processing': user_queues.filter(status='processing').count(),
-            'served': completed_queues.count(),
-            'cancelled': user_queues.filter(status='cancelled').count(),
-            'priority_queues': user_queues.filter(priority=True).count(),
+            'queues_joined': day.joined,
+            'waiting': day.waiting,
+            'processing': day.processing,
+            'served': day.completed,
+            'cancelled': day.cancelled,
+            'priority_queues': day.priority,
             'avg_wait_time_minutes': round(avg_wait_seconds / 60, 1),  # Convert to minutes, round to 1 decimal
             'avg_processing_time_minutes': round(avg_processing_seconds / 60, 1),  # Convert to minutes
-            'total_active_queues': user_queues.filter(status__in=['waiting', 'processing']).count()
+            'total_active_queues': day.waiting + day.processing
         }
         
         return Response(stats)
 
-class WindowViewSet(viewsets.ModelViewSet):
-    queryset = Window.objects.select_related('service_provider', 'current_queue')
+class WindowViewSet(ReplicaReadMixin, ExpandableViewMixin, viewsets.ModelViewSet):
+    queryset = Window.objects.all()
     serializer_class = WindowSerializer
     permission_classes = [permissions.IsAuthenticated]
+    replica_actions = ('stats',)
 
     def get_queryset(self):
-        """Optimize queryset based on action"""
-        queryset = super().get_queryset()
-        if self.action in ['available', 'assign_to_best_window']:
-            queryset = queryset.prefetch_related('services', 'service_provider__services_provided')
-        return queryset
+        """Load only the relations the response embeds"""
+        return self.expand_queryset(super().get_queryset())
 
     @action(detail=True, methods=['patch'])
     def assign(self, request, pk=None):
@@ -304,45 +459,43 @@ class WindowViewSet(viewsets.ModelViewSet):
         """Process the next queue for this window"""
         window = self.get_object()
         
-        if not window.service_provider:
+        if not window.service_provider_id:
             return Response(
                 {'error': 'No service provider assigned to this window'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Complete current queue if exists
-        if window.current_queue:
-            window.current_queue.status = 'completed'
-            window.current_queue.end_time = timezone.now()
-            window.current_queue.save()
-        
-        # Get next queue with proper service matching
-        next_queue = Queue.objects.filter(
-            Q(service__in=window.services.all()) |
-            Q(service__provider=window.service_provider),
-            status='waiting'
-        ).order_by('-priority', 'position').first()
-        
-        if next_queue:
-            next_queue.status = 'processing'
-            next_queue.start_time = timezone.now()
-            next_queue.save()
-            window.current_queue = next_queue
-            window.status = 'busy'
-        else:
-            window.current_queue = None
-            window.status = 'available'
-        
-        window.last_active = timezone.now()
-        window.save()
+        with transaction.atomic():
+            # Serialize requests for this window only; other windows keep pulling
+            window = self.get_queryset().select_related('current_queue').select_for_update(
+                of=('self',)
+            ).get(pk=window.pk)
+            
+            # Complete current queue if exists
+            if window.current_queue:
+                window.current_queue.status = 'completed'
+                window.current_queue.end_time = timezone.now()
+                window.current_queue.save()
+            
+            # Get next queue with proper service matching
+            next_queue = dispatcher.pull_next(window)
+            
+            if next_queue:
+                window.current_queue = next_queue
+                window.status = 'busy'
+            else:
+                window.current_queue = None
+                window.status = 'available'
+            
+            window.last_active = timezone.now()
+            window.save()
         return Response(self.get_serializer(window).data)
 
     @action(detail=False, methods=['get'])
     def available(self, request):
         """Get all available windows that can take new queues"""
         windows = self.get_queryset().filter(status='available')
-        serializer = self.get_serializer(windows, many=True)
-        return Response(serializer.data)
+        return Response(self.project_queryset(windows))
 
     @action(detail=True, methods=['post'])
     def assign_queue(self, request, pk=None):
@@ -371,27 +524,139 @@ class WindowViewSet(viewsets.ModelViewSet):
             )
         
         # Check if window can handle this queue's service
-        if not (window.services.filter(id=queue.service.id).exists() or 
-               (window.service_provider and 
-                window.service_provider.services_provided.filter(id=queue.service.id).exists())):
+        if queue.service_id not in window.eligible_service_ids():
             return Response(
                 {'error': 'Window cannot handle this service'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         # Perform assignment
-        queue.status = 'processing'
-        queue.start_time = timezone.now()
-        queue.save()
-        
-        window.current_queue = queue
-        window.status = 'busy'
-        window.last_active = timezone.now()
-        window.save()
+        with transaction.atomic():
+            if not claim_window(window.pk):
+                return Response(
+                    {'error': 'Window is not available for new assignments'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            queue = dispatcher.claim(queue.id)
+            if queue is None:
+                transaction.set_rollback(True)
+                return Response(
+                    {'error': 'Queue not found or not waiting'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            window.current_queue = queue
+            window.status = 'busy'
+            window.last_active = timezone.now()
+            window.save()
         
         return Response({
             'window': self.get_serializer(window).data,
-            'queue': QueueSerializer(queue).data
+            'queue': QueueSerializer(queue, context=self.get_serializer_context()).data
+        })
+
+    @action(detail=False, methods=['post'], url_path='assign-all')
+    def assign_all_queues(self, request):
+        """
+        Match every available window with a waiting queue in one request.
+        Windows and waiting queues are loaded once, paired by match_windows()
+        and written back with two bulk updates in a single transaction.
+        """
+        with transaction.atomic():
+            window_ids = lock_rows(Window.objects.filter(status='available'))
+            windows = list(
+                Window.objects.filter(pk__in=window_ids).prefetch_related('services')
+            )
+            provider_services = {}
+            for service_id, provider_id in Service.objects.filter(
+                provider__in={window.service_provider_id for window in windows}
+            ).values_list('id', 'provider_id'):
+                provider_services.setdefault(provider_id, set()).add(service_id)
+
+            direct_services = {
+                window.id: {service.id for service in window.services.all()}
+                for window in windows
+            }
+            service_ids = set().union(*direct_services.values(), *provider_services.values())
+            tickets = Queue.objects.filter(
+                service__in=service_ids,
+                status='waiting'
+            ).order_by('-priority', 'join_time', 'id').values_list('id', 'service_id')
+
+            pairs = match_windows(
+                (
+                    (
+                        window.id,
+                        direct_services[window.id],
+                        provider_services.get(window.service_provider_id, ()),
+                        window.last_active
+                    )
+                    for window in windows
+                ),
+                tickets.iterator()
+            )
+
+            # Drop any queue another window claimed since it was read
+            claimed = set(lock_rows(
+                Queue.objects.filter(pk__in=[queue_id for _, queue_id in pairs], status='waiting')
+            ))
+            pairs = [(window_id, queue_id) for window_id, queue_id in pairs if queue_id in claimed]
+
+            # Without SKIP LOCKED the ids above come back unlocked, so the
+            # move itself is a compare-and-set on status. start_time marks the
+            # rows it moved: one a concurrent request claimed in between
+            # carries that request's start time and its pair is dropped
+            now = timezone.now()
+            Queue.objects.filter(pk__in=claimed, status='waiting').update(status='processing', start_time=now)
+            queues = {
+                queue_id: queue
+                for queue_id, queue in Queue.objects.in_bulk(claimed).items()
+                if queue.status == 'processing' and queue.start_time == now
+            }
+            pairs = [(window_id, queue_id) for window_id, queue_id in pairs if queue_id in queues]
+            for queue in queues.values():
+                queue.update_durations()
+            Queue.objects.bulk_update(queues.values(), ['wait_seconds'])
+
+            windows_by_id = {window.id: window for window in windows}
+            assigned = []
+            for window_id, queue_id in pairs:
+                window = windows_by_id[window_id]
+                window._previous_status_since = window.status_since
+                window.current_queue = queues[queue_id]
+                window.status = 'busy'
+                window.last_active = now
+                window.status_since = now
+                assigned.append(window)
+            Window.objects.bulk_update(
+                assigned, ['current_queue', 'status', 'last_active', 'status_since']
+            )
+
+            for queue in queues.values():
+                queue_status_changed.send(sender=Queue, queue=queue, previous_status='waiting')
+            for window in assigned:
+                window_status_changed.send(
+                    sender=Window,
+                    window=window,
+                    previous_status='available',
+                    previous_queue_id=window._previous_queue_id,
+                    previous_status_since=window._previous_status_since
+                )
+
+        for _, queue_id in pairs:
+            dispatcher.discard(queue_id)
+
+        return Response({
+            'message': f'Assigned {len(pairs)} queues to windows',
+            'assignments': [
+                {
+                    'window_id': window_id,
+                    'window': windows_by_id[window_id].name,
+                    'queue_id': queue_id
+                }
+                for window_id, queue_id in pairs
+            ]
         })
 
     @action(detail=False, methods=['post'], url_path='assign-best')
@@ -440,22 +705,33 @@ class WindowViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            selected_window = suitable_windows.first()
-            
             # Perform assignment
-            queue.status = 'processing'
-            queue.start_time = timezone.now()
-            queue.save()
-            
-            selected_window.current_queue = queue
-            selected_window.status = 'busy'
-            selected_window.last_active = timezone.now()
-            selected_window.save()
+            with transaction.atomic():
+                queue = dispatcher.claim(queue.id)
+                if queue is None:
+                    raise Queue.DoesNotExist
+                
+                # Take the best window no other request is claiming right now
+                selected_window = next(
+                    (window for window in suitable_windows if claim_window(window.pk)),
+                    None
+                )
+                if selected_window is None:
+                    transaction.set_rollback(True)
+                    return Response(
+                        {'error': 'No available windows for this service'},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                
+                selected_window.current_queue = queue
+                selected_window.status = 'busy'
+                selected_window.last_active = timezone.now()
+                selected_window.save()
             
             return Response({
                 'message': f'Queue {queue.id} assigned to window {selected_window.name}',
                 'window': self.get_serializer(selected_window).data,
-                'queue': QueueSerializer(queue).data
+                'queue': QueueSerializer(queue, context=self.get_serializer_context()).data
             })
 
         except Queue.DoesNotExist:
@@ -471,13 +747,20 @@ class WindowViewSet(viewsets.ModelViewSet):
         
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        """Get window statistics"""
-        stats = {
-            'total_windows': self.get_queryset().count(),
-            'available_windows': self.get_queryset().filter(status='available').count(),
-            'busy_windows': self.get_queryset().filter(status='busy').count(),
-            'average_wait_time': self.get_queryset().aggregate(
-                avg_wait=Avg('current_queue__wait_time')
-            )['avg_wait'] or 0
-        }
-        return Response(stats)
\ No newline at end of file
+        """
+        Get window counts plus utilization and throughput from the
+        precomputed metric buckets, for today or the last ?hours=N
+        """
+        hours = request.query_params.get('hours')
+        if hours is not None:
+            try:
+                since = timezone.now() - timedelta(hours=float(hours))
+            except (ValueError, OverflowError):
+                return Response(
+                    {'error': 'hours must be a number of hours that fits in a date'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            since = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        return Response(window_stats(since))
@@ -1,18 +1,20 @@
 import os
+
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import queue_manager.routing
 
 # Set the default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'virtual_queue_system.settings')
 
-# Import websocket_urlpatterns AFTER setting DJANGO_SETTINGS_MODULE
-from queue_manager.routing import websocket_urlpatterns
+# Set up Django before importing anything that loads models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from queue_manager.middleware import JWTAuthMiddleware  # noqa: E402
+from queue_manager.routing import websocket_urlpatterns  # noqa: E402
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,
+    "websocket": JWTAuthMiddleware(
         URLRouter(
             websocket_urlpatterns
         )
@@ -39,6 +39,28 @@ CHANNEL_LAYERS = {
     },
 }
 
+# How often the in-memory dispatcher rebuilds its heaps from the database.
+# Joins and priority changes made through another worker are only seen
+# after the next rebuild, so this bounds how long they can be overtaken
+QUEUE_DISPATCHER_REFRESH_SECONDS = 30
+
+# Window over which waiting-line changes are batched into one push per service
+QUEUE_BROADCAST_DEBOUNCE_SECONDS = 0.25
+
+# Learned service times: EWMA smoothing factor and how often to persist them
+QUEUE_ESTIMATOR_ALPHA = 0.2
+QUEUE_ESTIMATOR_PERSIST_SECONDS = 60
+
+# Upper bound on how long projected start times are served from the cache
+QUEUE_ETA_CACHE_SECONDS = 60
+
+# Width of the time buckets that window busy/idle metrics are rolled into
+WINDOW_METRICS_BUCKET_MINUTES = 60
+
+# Completed queues returned per page of a user's history, and the most a client may ask for
+QUEUE_HISTORY_PAGE_SIZE = 20
+QUEUE_HISTORY_MAX_PAGE_SIZE = 100
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -53,10 +75,15 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'queue_manager.authentication.CachedJWTAuthentication',
     ),
 }
 
+# How long an authenticated user's profile is served from the cache. Only
+# used with a cache shared by all workers, unless AUTH_USER_CACHE_SHARED = True
+# says a process-local one is safe (a single worker process)
+AUTH_USER_CACHE_SECONDS = 300
+
 
 
 CORS_ORIGIN_ALLOW_ALL = True  # Allow all origins for development
@@ -94,6 +121,36 @@ DATABASES = {
     }
 }
 
+# Stats, history and catalog reads go to this alias when it is configured,
+# e.g. DATABASES['replica'] = {..., 'TEST': {'MIRROR': 'default'}}; without
+# it every query stays on 'default'
+DATABASE_ROUTERS = ['queue_manager.routers.ReplicaRouter']
+QUEUE_REPLICA_DATABASE = 'replica'
+
+# How long someone's reads stay on the primary after they change something;
+# keep it above the worst replication lag
+READ_AFTER_WRITE_SECONDS = 10
+
+# Shared by every worker: catalog versions, queue ETag counters, ETAs and the
+# user cache are invalidated by writing here, which a process-local cache
+# would hide from the other workers. Same Redis as the channel layer
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REDIS_CACHE_URL', default='redis://127.0.0.1:6380/1'),
+    }
+}
+
+# Upper bound on how long a cached catalog response is served, in seconds
+CATALOG_CACHE_SECONDS = 300
+
+# manage.py archive_queues moves finished queues joined more than this many
+# days ago into QueueArchive. Each committed chunk moves the archive version,
+# so other processes reread how far the archive reaches on their next request;
+# QUEUE_ARCHIVE_HORIZON_SECONDS only bounds how long an entry is kept
+QUEUE_ARCHIVE_AFTER_DAYS = 90
+QUEUE_ARCHIVE_HORIZON_SECONDS = 300
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -95,7 +95,7 @@ const deleteService = async (id) => {
 
 
 const getQueue = async (id) => {
-  return await axios.get(`/queues/${id}/`);
+  return await axios.get(`/queues/${id}/`, { params: { expand: 'user,service' } });
 };
 
 const updateQueueStatus = async (id, status) => {
@@ -116,11 +116,11 @@ const createWindow = async (windowData) => {
 };
 
 const getWindows = async () => {
-  return await axios.get('/windows/');
+  return await axios.get('/windows/', { params: { expand: 'service_provider,current_queue,services' } });
 };
 
 const getWindow = async (id) => {
-  return await axios.get(`/windows/${id}/`);
+  return await axios.get(`/windows/${id}/`, { params: { expand: 'service_provider,current_queue,services' } });
 };
 
 const updateWindowStatus = async (id, status) => {
@@ -138,7 +138,7 @@ const deleteWindow = async (id) => {
 
 // Window methods
 const getAvailableWindows = async () => {
-  return await axios.get('/windows/available/');
+  return await axios.get('/windows/available/', { params: { expand: 'service_provider,current_queue,services' } });
 };
 
 const assignQueueToWindow = async (windowId) => {
@@ -146,26 +146,26 @@ const assignQueueToWindow = async (windowId) => {
 };
 
 const assignAllQueues = async () => {
-  return await axios.get('/windows/assign-all/');
+  return await axios.post('/windows/assign-all/');
 };
 
 
 const assignToBestWindow = async (queueId) => {
-  return await axios.post('/windows/assign-best/', { queue_id: queueId });
+  return await axios.post('/windows/assign-best/', { queue_id: queueId }, { params: { expand: 'service_provider,current_queue,services' } });
 };
 
 // Queue methods
 const getQueues = async () => {
-  return await axios.get('/queues/');
+  return await axios.get('/queues/', { params: { expand: 'user,service' } });
 };
 
 const joinQueue = async (queueData) => {
-  return await axios.post('/queues/', queueData);
+  return await axios.post('/queues/', queueData, { params: { expand: 'service' } });
 };
 
 
 const getMyQueues = async () => {
-  return await axios.get('/queues/my_queues/');
+  return await axios.get('/queues/my_queues/', { params: { expand: 'service' } });
 };
 
 
@@ -1,30 +1,83 @@
-import { useEffect } from 'react';
+import { useEffect, useRef } from 'react';
+
+const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000/api';
+
+// ws://host/ws/queue/ next to the REST API; ?service=<id> also follows that
+// service's waiting line, not just the signed-in user's own tickets
+export const queueSocketUrl = (serviceId) => {
+  const url = new URL(API_BASE_URL.replace(/^http/, 'ws'));
+  url.pathname = '/ws/queue/';
+  if (serviceId) url.searchParams.set('service', serviceId);
+  return url.toString();
+};
+
+// Browsers cannot send an Authorization header on the handshake, so the
+// access token goes as a subprotocol, as the backend's JWTAuthMiddleware expects
+const authProtocols = () => {
+  const accessToken = localStorage.getItem('access');
+  return accessToken ? ['jwt', accessToken] : [];
+};
+
+const MAX_RECONNECT_DELAY = 30000;
+
+// onReconnect runs when a dropped socket comes back, so the page can reload
+// whatever it may have missed in between
+const useWebSocket = ({ url, onMessage, onError, onReconnect }) => {
+  // Handlers are read through refs so a re-render does not reconnect
+  const onMessageRef = useRef(onMessage);
+  const onErrorRef = useRef(onError);
+  const onReconnectRef = useRef(onReconnect);
+  onMessageRef.current = onMessage;
+  onErrorRef.current = onError;
+  onReconnectRef.current = onReconnect;
 
-const useWebSocket = ({ url, onMessage, onError }) => {
   useEffect(() => {
-    const ws = new WebSocket(url);
+    if (!url) return;
 
-    ws.onopen = () => {
-      console.log('WebSocket connected');
-    };
+    let ws;
+    let reconnectTimer;
+    let attempts = 0;
+    let closed = false;
 
-    ws.onmessage = (event) => {
-      onMessage && onMessage(event);
-    };
+    const connect = () => {
+      ws = new WebSocket(url, authProtocols());
 
-    ws.onerror = (error) => {
-      console.error('WebSocket error:', error);
-      onError && onError(error);
-    };
+      ws.onopen = () => {
+        if (attempts > 0 && onReconnectRef.current) onReconnectRef.current();
+        attempts = 0;
+      };
 
-    ws.onclose = () => {
-      console.log('WebSocket disconnected');
+      ws.onmessage = (event) => {
+        try {
+          onMessageRef.current && onMessageRef.current(JSON.parse(event.data));
+        } catch (error) {
+          console.error('Invalid WebSocket message:', error);
+        }
+      };
+
+      ws.onerror = (error) => {
+        console.error('WebSocket error:', error);
+        onErrorRef.current && onErrorRef.current(error);
+      };
+
+      // Reconnect with backoff; the server pushes every change, so a dropped
+      // socket is the only way to miss one
+      ws.onclose = () => {
+        if (closed) return;
+        const delay = Math.min(1000 * 2 ** attempts, MAX_RECONNECT_DELAY);
+        attempts += 1;
+        reconnectTimer = setTimeout(connect, delay);
+      };
     };
 
+    connect();
+
     return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
       ws.close();
     };
-  }, [url, onMessage, onError]);
+  }, [url]);
 };
 
-export default useWebSocket;
\ No newline at end of file
+export default useWebSocket;
@@ -12,6 +12,7 @@ import {
 } from 'react-icons/fi';
 import Navbar from '../components/Navbar';
 import authAPI from '../features/auth/authAPI';
+import useWebSocket, { queueSocketUrl } from '../hooks/useWebSocket';
 
 const DashboardPage = () => {
   const navigate = useNavigate();
@@ -36,6 +37,27 @@ const DashboardPage = () => {
   const [currentQueue, setCurrentQueue] = useState(null);
   const [services, setServices] = useState([]);
   const [selectedService, setSelectedService] = useState(null);
+  // Bumped whenever the server pushes a change to one of the user's queues
+  const [statsVersion, setStatsVersion] = useState(0);
+
+  useWebSocket({
+    url: user?.id ? queueSocketUrl() : null,
+    onMessage: (message) => {
+      if (message.type !== 'queue_update') return;
+      const queue = message.queue;
+      setStatsVersion(version => version + 1);
+      if (currentQueue?.id !== queue.id) return;
+      if (['waiting', 'processing'].includes(queue.status)) {
+        setCurrentQueue({ ...currentQueue, ...queue, service: currentQueue.service });
+        setPosition(queue.position);
+      } else {
+        setCurrentQueue(null);
+        setPosition(null);
+        setWaitTime(null);
+      }
+    },
+    onReconnect: () => setStatsVersion(version => version + 1)
+  });
 
   // Fetch initial data
   useEffect(() => {
@@ -95,7 +117,7 @@ const DashboardPage = () => {
     };
 
     fetchQueueStats();
-  }, []);
+  }, [statsVersion]);
 
   // Fetch queue length
   useEffect(() => {
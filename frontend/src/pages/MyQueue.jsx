@@ -8,6 +8,7 @@ import {
   FiRotateCw, FiPrinter
 } from 'react-icons/fi';
 import Navbar from '../components/Navbar';
+import useWebSocket, { queueSocketUrl } from '../hooks/useWebSocket';
 import React from 'react';
 
 
@@ -173,6 +174,50 @@ const MyQueue = () => {
     }
   }, [queueData?.id, fetchWindows, checkForWindowAssignment, navigate]);
 
+  // Reload just this ticket, e.g. after its own place in line changed
+  const reloadQueue = useCallback(async () => {
+    if (!queueData?.id) return;
+    try {
+      const response = await authAPI.getQueue(queueData.id);
+      setQueueData(response.data);
+    } catch (error) {
+      console.error('Error reloading queue:', error);
+    }
+  }, [queueData?.id]);
+
+  // The server pushes this ticket's changes, the window that calls it and
+  // every move of its service's line, so nothing here polls
+  const handleSocketMessage = useCallback((message) => {
+    if (message.type === 'queue_update' && message.queue.id === queueData?.id) {
+      // Keep the expanded service object from the REST response
+      setQueueData(prev => ({ ...prev, ...message.queue, service: prev.service }));
+    } else if (message.type === 'window_update' && message.queue_id === queueData?.id) {
+      setAssignedWindow(message.window);
+      setShowWindowPopup(true);
+    } else if (message.type === 'queue_advance' && queueData?.status === 'waiting') {
+      // Keys are [priority rank, ticket number], the order dispatch serves
+      // in; only tickets ahead of ours move our position
+      const key = [queueData.priority ? 0 : 1, queueData.ticket_number];
+      const same = ([rank, ticket]) => rank === key[0] && ticket === key[1];
+      if (message.left.some(same)) {
+        // Our own ticket moved, e.g. its priority changed
+        reloadQueue();
+        return;
+      }
+      const ahead = ([rank, ticket]) => rank < key[0] || (rank === key[0] && ticket < key[1]);
+      const moved = message.joined.filter(ahead).length - message.left.filter(ahead).length;
+      if (moved) {
+        setQueueData(prev => ({ ...prev, position: prev.position + moved }));
+      }
+    }
+  }, [queueData?.id, queueData?.status, queueData?.priority, queueData?.ticket_number, reloadQueue]);
+
+  useWebSocket({
+    url: queueData?.id ? queueSocketUrl(queueData.service?.id ?? queueData.service) : null,
+    onMessage: handleSocketMessage,
+    onReconnect: refreshQueueData
+  });
+
   // Manual refresh handler
   const handleManualRefresh = async () => {
     if (isRefreshing) return;
@@ -221,26 +266,21 @@ const MyQueue = () => {
     fetchInitialData();
   }, [navigate, fetchWindows, checkForWindowAssignment]);
 
-  // Set up periodic refresh and countdown
+  // Count down locally between pushed updates
   useEffect(() => {
     if (!queueData?.id) return;
 
-    const refreshInterval = setInterval(() => {
-      refreshQueueData();
-    }, 60000);
-
     // Start countdown if in waiting status
     if (queueData?.status === 'waiting' && queueData.wait_time) {
       startCountdown();
     }
 
     return () => {
-      clearInterval(refreshInterval);
       if (countdownInterval.current) {
         clearInterval(countdownInterval.current);
       }
     };
-  }, [queueData?.id, queueData?.status, queueData?.wait_time, refreshQueueData, startCountdown]);
+  }, [queueData?.id, queueData?.status, queueData?.wait_time, startCountdown]);
 
   // Handle queue status changes
   useEffect(() => {